@@ -0,0 +1,173 @@
+"""
+This script checks the clips created by RemoveSilence.cut_clips against the original loop implementation, and
+measures how long it takes to split videos with very large Loud Maps.
+
+Usage:
+    python benchmarks/cut_clips.py
+    python benchmarks/cut_clips.py --intervals 50000 200000 --checks 500
+
+The Loud Maps are synthetic, so no media file is needed.
+"""
+import argparse
+from fractions import Fraction
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'video_editor'))
+
+from entities.timeline import Timeline
+from features.remove_silence import RemoveSilence
+
+
+FPS = 30
+
+
+def legacy_split_clip(loud_map, base_clip_duration, previous_video_duration):
+    """
+    Original loop implementation of RemoveSilence.cut_clips for a single video.
+    Returns the (duration, start, offset, silent) of each created clip.
+    """
+    clips = []
+    previous_loud_clip_offset = 0
+    previous_loud_clip_start = 0
+    previous_loud_clip_duration = 0
+
+    for loud_part in loud_map:
+        loud_clip_start = loud_part['offset']
+
+        silent_clip_start = previous_loud_clip_start + previous_loud_clip_duration
+        silent_clip_duration = loud_clip_start - silent_clip_start
+        silent_clip_offset = previous_loud_clip_offset + previous_loud_clip_duration
+
+        if silent_clip_duration > 0:
+            clips.append((silent_clip_duration, silent_clip_offset, previous_video_duration + silent_clip_start, True))
+
+        loud_clip_offset = silent_clip_offset + silent_clip_duration
+        clips.append((loud_part['dur'], loud_clip_start, previous_video_duration + loud_clip_offset, False))
+
+        previous_loud_clip_start = loud_clip_start
+        previous_loud_clip_offset = loud_clip_offset
+        previous_loud_clip_duration = loud_part['dur']
+
+    if previous_loud_clip_start + previous_loud_clip_duration < base_clip_duration:
+        silent_clip_start = previous_loud_clip_start + previous_loud_clip_duration
+        silent_clip_duration = base_clip_duration - silent_clip_start
+        silent_clip_offset = previous_loud_clip_offset + previous_loud_clip_duration
+        clips.append((silent_clip_duration, silent_clip_offset, previous_video_duration + silent_clip_start, True))
+
+    return clips
+
+
+def generate_loud_map(num_intervals, rng, max_gap=20, max_duration=60):
+    """
+    Generate a Loud Map (in the auto-editor format). Gaps may be empty, like in real Loud Maps.
+    """
+    loud_parts = []
+    position = rng.randint(0, max_gap)
+    timeline_position = 0
+    for _ in range(num_intervals):
+        duration = rng.randint(1, max_duration)
+        loud_parts.append({'start': timeline_position, 'dur': duration, 'offset': position})
+        timeline_position += duration
+        position += duration + rng.randint(0, max_gap)
+
+    return {'timebase': f"{FPS}/1", 'v': [loud_parts]}, position + rng.randint(0, max_gap)
+
+
+def cut_clips(loud_maps, durations, output_folder):
+    """
+    Run RemoveSilence.cut_clips on a timeline with one video per Loud Map.
+    Returns the (duration, start, offset, silent) of the clips of each video (in frames) and the time it took.
+    """
+    timeline = Timeline(output_folder)
+    timeline.add_format_element(FPS, 1920, 1080, 'BenchmarkFormat')
+    for index, num_frames in enumerate(durations):
+        timeline.add_asset_element(FPS, num_frames, 2, f"video_{index}.mp4", f"file://localhost/video_{index}.mp4")
+
+    timeline.create_timeline_structure()
+    offset = 0
+    for index, (ref, num_frames) in enumerate(zip(timeline.video_assets_refs, durations)):
+        timeline.add_clip_to_timeline(ref, num_frames, 0, Fraction(offset, FPS), FPS, f"video_{index}.mp4")
+        offset += num_frames
+
+    remove_silence = RemoveSilence(timeline, output_folder)
+    remove_silence.get_loud_map = lambda filename: loud_maps[int(filename.split('_')[1])]
+
+    start_time = time.perf_counter()
+    remove_silence.cut_clips()
+    elapsed = time.perf_counter() - start_time
+
+    # Convert clip times from ticks to frames
+    frame_ticks = timeline.get_frame_ticks(FPS)
+    clips = [
+        [
+            (clip.duration // frame_ticks, clip.start // frame_ticks, clip.offset // frame_ticks, clip.silent)
+            for clip in timeline.video_assets[ref]
+        ]
+        for ref in timeline.video_assets_refs
+    ]
+    return clips, elapsed
+
+
+def check_regressions(num_checks, rng, output_folder):
+    """
+    Compare the clips of cut_clips and the original implementation on random Loud Maps.
+    """
+    loud_maps = []
+    durations = []
+    for _ in range(num_checks):
+        loud_map, num_frames = generate_loud_map(rng.randint(0, 30), rng, max_gap=rng.choice([0, 3, 20]))
+
+        # Some videos end with a loud part
+        loud_parts = loud_map['v'][0]
+        if loud_parts and rng.random() < 0.3:
+            num_frames = loud_parts[-1]['offset'] + loud_parts[-1]['dur']
+
+        loud_maps.append(loud_map)
+        durations.append(num_frames)
+
+    clips, _ = cut_clips(loud_maps, durations, output_folder)
+
+    previous_video_duration = 0
+    for index, (loud_map, num_frames) in enumerate(zip(loud_maps, durations)):
+        expected = legacy_split_clip(loud_map['v'][0], num_frames, previous_video_duration)
+        if clips[index] != expected:
+            raise AssertionError(f"Clips of video {index} differ from the original implementation.")
+        previous_video_duration += num_frames
+
+    print(f"Regression check: {num_checks} random Loud Maps match the original implementation.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark RemoveSilence.cut_clips.')
+    parser.add_argument('--intervals', type=int, nargs='+', default=[50000, 200000], help='Number of loud parts of the benchmarked video.')
+    parser.add_argument('--checks', type=int, default=500, help='Number of random Loud Maps compared against the original implementation.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random Loud Maps.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as output_folder:
+        check_regressions(args.checks, rng, output_folder)
+
+        # Intervals are the computation of the parts only, cut_clips also includes creating the clips
+        print(f"{'intervals':>10} {'clips':>8} {'legacy intervals (s)':>21} {'intervals (s)':>14} {'cut_clips (s)':>14}")
+        for num_intervals in args.intervals:
+            loud_map, num_frames = generate_loud_map(num_intervals, rng)
+
+            start_time = time.perf_counter()
+            legacy_split_clip(loud_map['v'][0], num_frames, 0)
+            legacy_elapsed = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            RemoveSilence(None, output_folder).get_split_intervals(loud_map['v'][0], num_frames)
+            intervals_elapsed = time.perf_counter() - start_time
+
+            clips, elapsed = cut_clips([loud_map], [num_frames], output_folder)
+            print(f"{num_intervals:>10} {len(clips[0]):>8} {legacy_elapsed:>21.3f} {intervals_elapsed:>14.3f} {elapsed:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+This script compares the auto-editor and native loud map backends of RemoveSilence.
+
+Usage:
+    python benchmarks/loud_map_backends.py <video> [<video> ...]
+    python benchmarks/loud_map_backends.py --duration 3600
+
+When no video is given, a synthetic video with scripted silent gaps is generated with ffmpeg.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import ffmpeg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'video_editor'))
+
+from features.remove_silence import RemoveSilence
+
+
+def generate_synthetic_video(output_path, duration, fps=30, silence_every=10, silence_duration=2):
+    """
+    Generate a small video with a tone that is muted for `silence_duration` seconds every `silence_every` seconds.
+    """
+    video = ffmpeg.input(f"testsrc=duration={duration}:rate={fps}:size=320x240", f='lavfi')
+    audio = (
+        ffmpeg
+        .input(f"sine=frequency=440:duration={duration}", f='lavfi')
+        .filter('volume', volume=0, enable=f"lt(mod(t,{silence_every}),{silence_duration})")
+    )
+    (
+        ffmpeg
+        .output(video, audio, output_path, vcodec='libx264', preset='ultrafast', acodec='aac', shortest=None)
+        .global_args('-v', 'error')
+        .run(overwrite_output=True)
+    )
+
+
+def get_loud_intervals(loud_map):
+    """
+    Get the (source start, duration) of each loud part of a loud map.
+    """
+    return [(loud_part['offset'], loud_part['dur']) for loud_part in loud_map['v'][0]]
+
+
+def get_agreement(intervals_a, intervals_b, num_frames):
+    """
+    Get the ratio of frames that both loud maps classify the same way.
+    """
+    loud_a = set(frame for start, duration in intervals_a for frame in range(start, start + duration))
+    loud_b = set(frame for start, duration in intervals_b for frame in range(start, start + duration))
+    return 1 - len(loud_a ^ loud_b) / max(num_frames, 1)
+
+
+def benchmark_backend(backend, video_path, output_folder):
+    """
+    Generate the loud map of a video with a backend and measure how long it takes.
+    """
+    remove_silence = RemoveSilence(None, output_folder, backend=backend)
+    os.makedirs(remove_silence.loud_maps_folder, exist_ok=True)
+
+    start_time = time.perf_counter()
+    remove_silence.generate_video_loud_map(video_path, backend)
+    elapsed = time.perf_counter() - start_time
+
+    return elapsed, get_loud_intervals(remove_silence.get_loud_map(backend))
+
+
+def main():
+    # Get arguments
+    parser = argparse.ArgumentParser(description='Compare loud map backends.')
+    parser.add_argument('videos', nargs='*', help='Videos to analyse. A synthetic one is generated when empty.')
+    parser.add_argument('--duration', type=int, default=600, help='Duration in seconds of the synthetic video.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as output_folder:
+        videos = args.videos
+        if not videos:
+            synthetic_video = os.path.join(output_folder, 'synthetic.mp4')
+            print(f"Generating {args.duration}s synthetic video...")
+            generate_synthetic_video(synthetic_video, args.duration)
+            videos = [synthetic_video]
+
+        for video_path in videos:
+            auto_editor_elapsed, auto_editor_intervals = benchmark_backend('auto-editor', video_path, output_folder)
+            native_elapsed, native_intervals = benchmark_backend('native', video_path, output_folder)
+            num_frames = max(
+                [start + duration for start, duration in auto_editor_intervals + native_intervals],
+                default=0
+            )
+
+            print(f"{os.path.basename(video_path)}:")
+            print(f"    auto-editor: {auto_editor_elapsed:.2f}s ({len(auto_editor_intervals)} loud parts)")
+            print(f"    native:      {native_elapsed:.2f}s ({len(native_intervals)} loud parts)")
+            print(f"    speedup:     {auto_editor_elapsed / max(native_elapsed, 1e-9):.1f}x")
+            print(f"    agreement:   {get_agreement(auto_editor_intervals, native_intervals, num_frames):.1%} of frames")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+This script runs every Orchestrator stage on synthetic videos and reports the wall time, CPU time, peak RSS and
+clips per second of each stage. Results are saved as JSON, so they can be compared across commits.
+
+Usage:
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --scenarios short ntsc --output before.json
+    python benchmarks/pipeline.py --output after.json --compare before.json
+    python benchmarks/pipeline.py --orchestrator-args "--skip-jcut --jobs 2"
+    python benchmarks/pipeline.py --orchestrator-args "--scheduler dag" --compare sequential.json
+
+The fixture videos are generated offline with ffmpeg lavfi sources (a test pattern and a tone with scripted
+silent gaps). Whisper is replaced by the 'stub' model by default, so no model is downloaded and the suite runs
+quickly on CPU-only machines.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import ffmpeg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'video_editor'))
+
+from orchestrator import Orchestrator
+from utils.resources import format_bytes, get_rss_bytes
+
+
+# Fixture videos of each scenario. Silent gaps are what RemoveSilence cuts, so they set the number of clips
+SCENARIOS = {
+    'short': {'num_videos': 2, 'duration': 20, 'fps': '30', 'silence_every': 4, 'silence_duration': 1},
+    'ntsc': {'num_videos': 3, 'duration': 40, 'fps': '30000/1001', 'silence_every': 3, 'silence_duration': 1},
+    'many_clips': {'num_videos': 4, 'duration': 60, 'fps': '25', 'silence_every': 2, 'silence_duration': 0.5},
+    'long': {'num_videos': 2, 'duration': 600, 'fps': '30', 'silence_every': 10, 'silence_duration': 2},
+}
+DEFAULT_SCENARIOS = ['short', 'ntsc', 'many_clips']
+
+# Orchestrator steps of each stage, in the same order as __main__
+STAGES = [
+    ('preprocess', ['preprocess_videos', 'determine_input_folder']),
+    ('create_timeline', ['create_timeline']),
+    ('concatenate', ['concatenate_files']),
+    ('proxies', ['generate_proxies']),
+    ('remove_silence', ['remove_silence']),
+    ('remove_wordless', ['remove_wordless_clips']),
+    ('jcut', ['jcut_timeline']),
+    ('edit_timeline', ['edit_timeline']),
+    ('subway_surfers', ['add_subway_surfers']),
+    ('subtitles', ['determine_subtitles_video', 'add_subtitles']),
+    ('fcpxml', ['generate_fcpxml_file']),
+]
+
+# With --scheduler dag, a single step replaces the ones from preprocessing to removing wordless clips
+DAG_STAGES = [('process_files', ['process_files'])] + STAGES[STAGES.index(('jcut', ['jcut_timeline'])):]
+
+# Folders written by the pipeline inside the videos folder
+OUTPUT_FOLDERS = ['preprocessed', 'proxies', 'remove_silence', 'timeline']
+
+
+class PeakRssSampler:
+    """
+    Sample the resident memory of the process in a background thread and keep the peak.
+
+    NOTE:
+        - The kernel only keeps the peak of the whole process lifetime, so it can't tell the peak of each stage.
+        - Memory of child processes (ffmpeg, transcription workers) is not included.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stop_event.is_set():
+            self.peak = max(self.peak, get_rss_bytes())
+            self.stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = get_rss_bytes()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+        self.peak = max(self.peak, get_rss_bytes())
+
+
+def generate_fixture(output_path, duration, fps, silence_every, silence_duration, size='320x240'):
+    """
+    Generate a video with a tone that is muted for `silence_duration` seconds every `silence_every` seconds.
+    """
+    video = ffmpeg.input(f"testsrc=duration={duration}:rate={fps}:size={size}", f='lavfi')
+    audio = (
+        ffmpeg
+        .input(f"sine=frequency=440:duration={duration}", f='lavfi')
+        .filter('volume', volume=0, enable=f"lt(mod(t,{silence_every}),{silence_duration})")
+    )
+    (
+        ffmpeg
+        .output(video, audio, output_path, vcodec='libx264', preset='ultrafast', acodec='aac', shortest=None)
+        .global_args('-v', 'error')
+        .run(overwrite_output=True)
+    )
+
+
+def generate_fixtures(videos_folder, num_videos, duration, fps, silence_every, silence_duration):
+    """
+    Generate the fixture videos of a scenario, reusing the ones generated by previous runs.
+    """
+    os.makedirs(videos_folder, exist_ok=True)
+    for index in range(num_videos):
+        video_path = os.path.join(videos_folder, f"video_{index}.mp4")
+        if not os.path.exists(video_path):
+            generate_fixture(video_path, duration, fps, silence_every, silence_duration)
+
+    # Start every run from the fixtures only
+    for folder in OUTPUT_FOLDERS:
+        shutil.rmtree(os.path.join(videos_folder, folder), ignore_errors=True)
+
+
+def get_children_cpu_time() -> float:
+    """
+    Get the CPU time of the child processes (e.g. ffmpeg) that already finished.
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def count_clips(orchestrator) -> int:
+    """
+    Count all clips in the timeline of the orchestrator.
+    """
+    if orchestrator.timeline is None:
+        return 0
+
+    return sum(len(clips) for clips in orchestrator.timeline.video_assets.values())
+
+
+def run_stage(orchestrator, steps):
+    """
+    Run the steps of a stage and measure them.
+    """
+    children_cpu_before = get_children_cpu_time()
+    cpu_before = time.process_time()
+    start_time = time.perf_counter()
+
+    with PeakRssSampler() as sampler:
+        for step in steps:
+            getattr(orchestrator, step)()
+
+    wall = time.perf_counter() - start_time
+    clips = count_clips(orchestrator)
+    return {
+        'wall_seconds': wall,
+        'cpu_seconds': time.process_time() - cpu_before,
+        'children_cpu_seconds': get_children_cpu_time() - children_cpu_before,
+        'peak_rss_bytes': sampler.peak,
+        'clips': clips,
+        'clips_per_second': clips / wall if wall > 0 else None,
+    }
+
+
+def run_scenario(name, scenario, fixtures_folder, cache_folder, whisper_model, orchestrator_args):
+    """
+    Run all stages on the fixtures of a scenario. Returns the measurements of each stage.
+    """
+    videos_folder = os.path.join(fixtures_folder, name)
+    print(f"Generating fixtures of '{name}'...")
+    generate_fixtures(videos_folder, **scenario)
+
+    # Every scenario starts with an empty artifact store, like a first run
+    cache_dir = os.path.join(cache_folder, name)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    orchestrator = Orchestrator()
+    orchestrator.parse_arguments([
+        videos_folder,
+        '--silence-backend', 'native',
+        '--whisper-model', whisper_model,
+        '--transcription-jobs', '1',
+        '--cache-dir', cache_dir,
+        *orchestrator_args,
+    ])
+    orchestrator.reserve_whisper_models()
+
+    stages = {}
+    for stage, steps in (DAG_STAGES if orchestrator.args.scheduler == 'dag' else STAGES):
+        print(f"Running stage '{stage}' of '{name}'...")
+        stages[stage] = run_stage(orchestrator, steps)
+
+    return stages
+
+
+def get_commit() -> str:
+    """
+    Get the commit of the benchmarked code, if it's in a git repository.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    """
+    Print the measurements of every stage of every scenario.
+    """
+    print(f"{'scenario':>12} {'stage':>16} {'wall (s)':>9} {'cpu (s)':>8} {'child cpu (s)':>14} {'peak rss':>9} {'clips':>7} {'clips/s':>9}")
+    for name, scenario in results['scenarios'].items():
+        for stage, measures in scenario['stages'].items():
+            clips_per_second = measures['clips_per_second']
+            print(
+                f"{name:>12} {stage:>16} {measures['wall_seconds']:>9.3f} {measures['cpu_seconds']:>8.3f} "
+                f"{measures['children_cpu_seconds']:>14.3f} {format_bytes(measures['peak_rss_bytes']):>9} "
+                f"{measures['clips']:>7} {clips_per_second if clips_per_second is not None else 0:>9.0f}"
+            )
+
+
+def print_comparison(results, baseline):
+    """
+    Print how the wall time of each stage changed against a previous run.
+    """
+    print(f"\nComparison against {baseline.get('commit') or 'baseline'}:")
+    print(f"{'scenario':>12} {'stage':>16} {'before (s)':>11} {'after (s)':>10} {'speedup':>8}")
+    for name, scenario in results['scenarios'].items():
+        baseline_stages = baseline['scenarios'].get(name, {}).get('stages', {})
+        for stage, measures in scenario['stages'].items():
+            if stage not in baseline_stages:
+                continue
+
+            before = baseline_stages[stage]['wall_seconds']
+            after = measures['wall_seconds']
+            speedup = f"{before / after:.2f}x" if after > 0 else '-'
+            print(f"{name:>12} {stage:>16} {before:>11.3f} {after:>10.3f} {speedup:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every Orchestrator stage on synthetic videos.')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=DEFAULT_SCENARIOS, help='Scenarios to run.')
+    parser.add_argument('--output', type=str, default='pipeline_benchmark.json', help='JSON file where the results are saved.')
+    parser.add_argument('--compare', type=str, default=None, help='JSON file of a previous run to compare against.')
+    parser.add_argument('--fixtures-dir', type=str, default=None, help='Folder where fixture videos are kept between runs. Defaults to a temporary folder.')
+    parser.add_argument('--whisper-model', type=str, default='stub', help='Whisper model used by the transcription stages.')
+    parser.add_argument('--orchestrator-args', type=str, default='', help='Extra arguments for the Orchestrator (e.g. "--skip-jcut").')
+    args = parser.parse_args()
+
+    results = {
+        'commit': get_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'whisper_model': args.whisper_model,
+        'orchestrator_args': args.orchestrator_args,
+        'scenarios': {},
+    }
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        fixtures_folder = args.fixtures_dir or os.path.join(temporary_folder, 'fixtures')
+        cache_folder = os.path.join(temporary_folder, 'cache')
+
+        for name in args.scenarios:
+            stages = run_scenario(
+                name,
+                SCENARIOS[name],
+                fixtures_folder,
+                cache_folder,
+                args.whisper_model,
+                shlex.split(args.orchestrator_args)
+            )
+            results['scenarios'][name] = {**SCENARIOS[name], 'stages': stages}
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=4)
+
+    print_results(results)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            print_comparison(results, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+This script measures how the timeline editing stages (RemoveSilence, RemoveWordless and JCut) scale with the
+number of clips. With linear edits, the time per clip should stay roughly constant as the timeline grows.
+The stages are measured one after another, and then fused in a single pass (as run by the Orchestrator).
+
+Usage:
+    python benchmarks/timeline_edits.py
+    python benchmarks/timeline_edits.py --clips 1000 10000 100000 --videos 10
+
+The loud maps and transcriptions are synthetic, so no media file or Whisper model is needed.
+"""
+import argparse
+from fractions import Fraction
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'video_editor'))
+
+from entities.timeline import Timeline
+from features.j_cut import JCut
+from features.remove_silence import RemoveSilence
+from features.remove_wordless import RemoveWordless
+
+
+FPS = 30
+LOUD_FRAMES = 40     # Duration of each loud part
+SILENT_FRAMES = 10   # Duration of the silent part between loud parts
+WORDLESS_EVERY = 5   # One loud part out of WORDLESS_EVERY has no speech
+
+
+def create_timeline(output_folder, num_videos, loud_parts_per_video):
+    """
+    Create a timeline with one clip per video, long enough to be split in `loud_parts_per_video` loud parts.
+    """
+    timeline = Timeline(output_folder)
+    timeline.add_format_element(FPS, 1920, 1080, 'BenchmarkFormat')
+
+    num_frames = loud_parts_per_video * (LOUD_FRAMES + SILENT_FRAMES)
+    for index in range(num_videos):
+        filename = f"video_{index}.mp4"
+        timeline.add_asset_element(FPS, num_frames, 2, filename, f"file://localhost/{filename}")
+
+    timeline.create_timeline_structure()
+    for index, ref in enumerate(timeline.video_assets_refs):
+        timeline.add_clip_to_timeline(ref, num_frames, 0, Fraction(index * num_frames, FPS), FPS, f"video_{index}.mp4")
+    timeline.update_sequence_duration()
+
+    return timeline
+
+
+def get_loud_map(loud_parts_per_video):
+    """
+    Get a Loud Map (in the auto-editor format) with a silent gap before each loud part.
+    """
+    loud_parts = []
+    for index in range(loud_parts_per_video):
+        loud_parts.append({
+            'start': index * LOUD_FRAMES,
+            'dur': LOUD_FRAMES,
+            'offset': index * (LOUD_FRAMES + SILENT_FRAMES) + SILENT_FRAMES,
+        })
+
+    return {'timebase': f"{FPS}/1", 'v': [loud_parts]}
+
+
+def get_transcription(loud_parts_per_video):
+    """
+    Get a transcription with one segment inside each loud part, except for the wordless ones.
+    """
+    segments = []
+    for index in range(loud_parts_per_video):
+        if index % WORDLESS_EVERY == 0:
+            continue
+
+        start_frame = index * (LOUD_FRAMES + SILENT_FRAMES) + SILENT_FRAMES + 5
+        segments.append(SimpleNamespace(start=start_frame / FPS, end=(start_frame + LOUD_FRAMES - 10) / FPS))
+
+    return SimpleNamespace(segments=segments)
+
+
+def count_clips(timeline):
+    """
+    Count all clips in the timeline.
+    """
+    return sum(len(clips) for clips in timeline.video_assets.values())
+
+
+def benchmark(num_clips, num_videos, output_folder):
+    """
+    Run the editing stages on a timeline that ends up with about `num_clips` clips after RemoveSilence.
+    Returns the (number of clips, duration) of each stage.
+    """
+    # Each loud part creates a loud and a silent clip
+    loud_parts_per_video = max(1, num_clips // (2 * num_videos))
+    timeline = create_timeline(output_folder, num_videos, loud_parts_per_video)
+    timings = {}
+
+    # Remove Silence
+    remove_silence = RemoveSilence(timeline, output_folder)
+    loud_map = get_loud_map(loud_parts_per_video)
+    remove_silence.get_loud_map = lambda filename: loud_map
+    start_time = time.perf_counter()
+    remove_silence.cut_clips()
+    timings['remove_silence'] = (count_clips(timeline), time.perf_counter() - start_time)
+
+    # Remove Wordless
+    remove_wordless = RemoveWordless(timeline, output_folder)
+    transcriptions = [get_transcription(loud_parts_per_video)] * num_videos
+    start_time = time.perf_counter()
+    remove_wordless.filter_wordless_clips(transcriptions)
+    timings['remove_wordless'] = (count_clips(timeline), time.perf_counter() - start_time)
+
+    # J-Cut
+    jcut = JCut(timeline)
+    start_time = time.perf_counter()
+    jcut.jcut_timeline()
+    timings['jcut'] = (count_clips(timeline), time.perf_counter() - start_time)
+
+    # All stages in a single pass
+    timeline = create_timeline(output_folder, num_videos, loud_parts_per_video)
+    remove_silence = RemoveSilence(timeline, output_folder)
+    remove_silence.get_loud_map = lambda filename: loud_map
+    remove_wordless = RemoveWordless(timeline, output_folder)
+    remove_wordless.transcriptions_by_ref = dict(zip(timeline.video_assets_refs, transcriptions))
+    jcut = JCut(timeline)
+    start_time = time.perf_counter()
+    timeline.run_edit_pipeline([remove_silence.split_clips, remove_wordless.filter_clips, jcut.jcut_clips])
+    timings['fused'] = (count_clips(timeline), time.perf_counter() - start_time)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how timeline editing stages scale with the number of clips.')
+    parser.add_argument('--clips', type=int, nargs='+', default=[1000, 10000, 100000], help='Number of clips after removing silence.')
+    parser.add_argument('--videos', type=int, default=10, help='Number of source videos.')
+    args = parser.parse_args()
+
+    print(f"{'clips':>8} {'stage':>16} {'clips out':>10} {'seconds':>9} {'us/clip':>9}")
+    with tempfile.TemporaryDirectory() as output_folder:
+        for num_clips in args.clips:
+            for stage, (clips_out, duration) in benchmark(num_clips, args.videos, output_folder).items():
+                print(f"{num_clips:>8} {stage:>16} {clips_out:>10} {duration:>9.3f} {duration / num_clips * 1e6:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""
+This script edits many project folders in a single process, so Python, torch and the Whisper models are loaded
+once for all of them instead of once per project.
+
+Usage:
+    python video_editor/batch.py project_1 project_2 --orchestrator-args "--skip-jcut"
+    python video_editor/batch.py --watch drop_folder --max-projects 3 --cpu-budget 12 --memory-budget 24
+    python video_editor/batch.py --status
+
+Projects are added to a persistent job queue, where the status of each job (current stage, duration of each
+stage, errors, ...) is saved to its own JSON file. Projects run at the same time share a CPU and memory budget,
+and the number of steps of each kind (encodes, audio analysis, transcriptions) running at once is limited.
+
+NOTE:
+    - Jobs run with --resume, so a job interrupted by a crash continues from its last checkpoint when the
+      runner starts again.
+    - After Ctrl+C, no new job is started and the runner stops once the running jobs finish.
+"""
+import argparse
+import os
+import shlex
+import threading
+import time
+import traceback
+from contextlib import contextmanager, nullcontext
+from typing import List, Tuple
+
+from orchestrator import Orchestrator
+from utils.artifact_store import ArtifactStore, DEFAULT_CACHE_FOLDER, DEFAULT_MAX_SIZE
+from utils.checkpoints import get_sources_signature
+from utils.concurrency import ResourceBudget, get_cpu_count
+from utils.files import get_video_files
+from utils.job_queue import DONE, FAILED, JobQueue, RUNNING
+from utils.resources import format_bytes, get_available_memory
+from utils.transcription import get_model_memory
+from utils.whisper_models import whisper_models
+
+
+# Kind of each step whose concurrency is limited. Other steps are light and always run right away
+STAGE_KINDS = {
+    'preprocess_videos': 'encode',
+    'generate_proxies': 'encode',
+    'concatenate_files': 'analysis',
+    'remove_silence': 'analysis',
+    'determine_subtitles_video': 'analysis',
+    'remove_wordless_clips': 'transcription',
+    'add_subtitles': 'transcription',
+}
+
+# Kind of each node of the per-file graph (--scheduler dag) whose resources are limited. The graph step itself
+# isn't limited, as its nodes are
+NODE_KINDS = {
+    'encode': 'encode',
+    'analysis': 'analysis',
+    'whisper': 'transcription',
+}
+
+# Estimated memory of each concurrent job (video) of the encode and analysis steps
+STAGE_JOB_MEMORY = {
+    'encode': 512 * 1024 ** 2,
+    'analysis': 256 * 1024 ** 2,
+}
+
+DEFAULT_SLOTS = {'encode': 2, 'analysis': 2, 'transcription': 1}
+
+
+def get_input_signature(input_path) -> list:
+    """
+    Get the signature of the source videos of a project folder (or of a single video).
+    """
+    if os.path.isfile(input_path):
+        return get_sources_signature([input_path])
+
+    return get_sources_signature([video for video in get_video_files(input_path) if os.path.isfile(video)])
+
+
+class FolderWatcher:
+    """
+    Find project folders in a drop folder. A project is ready once its videos stopped changing for
+    `settle_time` seconds, so folders that are still being copied are not edited.
+    """
+    def __init__(self, folder, settle_time=30.0):
+        self.folder = folder
+        self.settle_time = settle_time
+        self.pending = {}   # Last signature of each project folder and when it was first seen
+
+    def get_ready_folders(self) -> List[Tuple[str, list]]:
+        """
+        Get the (path, signature) of the project folders that are ready.
+        """
+        ready = []
+        now = time.time()
+        for name in sorted(os.listdir(self.folder)):
+            path = os.path.join(self.folder, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+
+            signature = get_input_signature(path)
+            if not signature:
+                continue
+
+            # Wait until the videos didn't change for a while
+            previous = self.pending.get(path)
+            if previous is None or previous[0] != signature:
+                self.pending[path] = (signature, now)
+                continue
+
+            if now - previous[1] >= self.settle_time:
+                ready.append((path, signature))
+
+        return ready
+
+
+class BatchRunner:
+    def __init__(
+            self,
+            queue: JobQueue,
+            max_projects=2,
+            cpu_budget=None,
+            memory_budget=None,
+            slots=None,
+            artifact_store=None,
+            poll_interval=5.0
+        ):
+        self.queue = queue
+        self.max_projects = max(1, max_projects)
+        self.artifact_store = artifact_store
+        self.poll_interval = poll_interval
+
+        # Resources shared by all projects. When unknown, the memory budget doesn't limit anything
+        cpus = cpu_budget or get_cpu_count()
+        memory = memory_budget or int(get_available_memory() * 0.8) or 1024 ** 4
+        self.budget = ResourceBudget(cpus, memory)
+
+        # Max number of steps of each kind running at the same time, across projects
+        self.slots = {
+            kind: threading.BoundedSemaphore(count)
+            for kind, count in {**DEFAULT_SLOTS, **(slots or {})}.items()
+        }
+
+        # Whisper models stay reserved while the runner is alive, so they're loaded once for all projects
+        self.reserved_models = set()
+        self.lock = threading.Lock()
+
+        self.watching = False
+        self.stop_event = threading.Event()
+
+    def configure_job(self, args):
+        """
+        Set the concurrency of a job that didn't set it, so it fits in its share of the budget.
+        """
+        if args.jobs is None:
+            args.jobs = max(1, self.budget.cpus // self.max_projects)
+
+        # Transcribe in this process, with the model shared by all projects
+        if args.transcription_jobs is None:
+            args.transcription_jobs = 1
+
+    def reserve_models(self, args):
+        """
+        Reserve the Whisper model of a job for the lifetime of the runner.
+        """
+        key = (args.whisper_model, args.whisper_device)
+        with self.lock:
+            if key in self.reserved_models:
+                return
+            self.reserved_models.add(key)
+
+        whisper_models.reserve(*key)
+
+    def release_models(self):
+        with self.lock:
+            keys, self.reserved_models = self.reserved_models, set()
+
+        for key in keys:
+            whisper_models.release(*key)
+
+    def get_stage_resources(self, kind, args, videos=None) -> Tuple[int, int]:
+        """
+        Get the CPUs and memory (estimates) a step of a job holds while it runs. `videos` is the number of videos
+        the step works on at the same time, the jobs of the job by default.
+        """
+        if kind == 'transcription':
+            return max(1, self.budget.cpus // 2), get_model_memory(args.whisper_model) * args.transcription_jobs
+
+        videos = args.jobs if videos is None else videos
+        return videos, videos * STAGE_JOB_MEMORY[kind]
+
+    @contextmanager
+    def limit_stage(self, job, args, name):
+        """
+        Wait for a slot of its kind and for its share of the budget before running a step of a job.
+        """
+        kind = STAGE_KINDS.get(name)
+        slot = self.slots[kind] if kind is not None else nullcontext()
+        budget = self.budget.reserve(*self.get_stage_resources(kind, args)) if kind is not None else nullcontext()
+
+        self.queue.update(job, stage=name, stage_status='waiting')
+        with slot, budget:
+            self.queue.update(job, stage_status='running')
+            start_time = time.perf_counter()
+            try:
+                yield
+            finally:
+                stages = {**job['stages'], name: round(time.perf_counter() - start_time, 3)}
+                self.queue.update(job, stages=stages)
+
+    @contextmanager
+    def limit_node(self, args, kind):
+        """
+        Wait for its share of the budget before running a node of the per-file graph of a job (--scheduler dag).
+
+        NOTE:
+            - Each node works on a single video. Transcription nodes also wait for a transcription slot, like
+              the transcription steps. The other nodes don't take slots, as the graph already runs at most
+              `jobs` of them of each kind.
+        """
+        kind = NODE_KINDS.get(kind)
+        if kind is None:
+            yield
+            return
+
+        slot = self.slots['transcription'] if kind == 'transcription' else nullcontext()
+        with slot, self.budget.reserve(*self.get_stage_resources(kind, args, videos=1)):
+            yield
+
+    def run_job(self, job):
+        """
+        Run the pipeline of a job and save its result in its status file.
+        """
+        print(f"Starting job {job['id']} ({job['input']})...")
+        orchestrator = Orchestrator()
+        try:
+            orchestrator.parse_arguments([job['input'], *job['argv'], '--resume'], artifact_store=self.artifact_store)
+            self.configure_job(orchestrator.args)
+            self.reserve_models(orchestrator.args)
+
+            args = orchestrator.args
+            orchestrator.stage_context = lambda name: self.limit_stage(job, args, name)
+            orchestrator.node_context = lambda kind: self.limit_node(args, kind)
+            orchestrator.run_pipeline()
+        except (Exception, SystemExit) as e:
+            # A failed job never stops the other ones
+            self.queue.update(job, status=FAILED, finished=time.time(), error=f"{e!r}\n{traceback.format_exc()}")
+            print(f"Job {job['id']} failed: {e!r}")
+            return
+
+        output = orchestrator.timeline.fcpxml_filename if orchestrator.timeline is not None else None
+        self.queue.update(job, status=DONE, finished=time.time(), stage=None, stage_status=None, output=output)
+        print(f"Job {job['id']} done in {job['finished'] - job['started']:.1f}s")
+
+    def work(self):
+        """
+        Run queued jobs until the queue is empty (or until the runner stops, when watching a folder).
+        """
+        while not self.stop_event.is_set():
+            job = self.queue.claim()
+            if job is not None:
+                self.run_job(job)
+            elif self.watching:
+                self.stop_event.wait(self.poll_interval)
+            else:
+                return
+
+    def enqueue(self, input_path, argv, signature=None):
+        if signature is None:
+            signature = get_input_signature(input_path)
+
+        job = self.queue.enqueue(input_path, argv, signature)
+        if job is not None:
+            print(f"Queued job {job['id']} ({job['input']})")
+
+    def run(self, watcher: FolderWatcher = None, argv=()):
+        """
+        Run the queued jobs, `max_projects` at a time. With a watcher, ready project folders are queued until
+        the runner is interrupted.
+        """
+        # Jobs left running by a runner that stopped continue from their checkpoints
+        interrupted = self.queue.requeue([RUNNING])
+        if interrupted:
+            print(f"Queued {interrupted} interrupted jobs again")
+
+        self.watching = watcher is not None
+        workers = [threading.Thread(target=self.work, name=f"project-{index}") for index in range(self.max_projects)]
+        for worker in workers:
+            worker.start()
+
+        print(
+            f"Running up to {self.max_projects} projects at a time "
+            f"(budget: {self.budget.cpus} CPUs, {format_bytes(self.budget.memory)})..."
+        )
+        try:
+            while any(worker.is_alive() for worker in workers):
+                if watcher is not None:
+                    for path, signature in watcher.get_ready_folders():
+                        self.enqueue(path, argv, signature)
+
+                self.stop_event.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            print("Stopping after the running jobs finish...")
+        finally:
+            self.stop_event.set()
+            for worker in workers:
+                worker.join()
+            self.release_models()
+
+
+def print_status(queue: JobQueue):
+    """
+    Print the status of every job of the queue.
+    """
+    print(f"{'job':<16} {'status':<8} {'stage':<26} {'attempts':>8} {'time (s)':>9}  input")
+    for job in queue.get_jobs():
+        stage = f"{job['stage']} ({job['stage_status']})" if job['stage'] else '-'
+        duration = sum(job['stages'].values())
+        print(f"{job['id']:<16} {job['status']:<8} {stage:<26} {job['attempts']:>8} {duration:>9.1f}  {job['input']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Edit many project folders with a persistent job queue.')
+    parser.add_argument('inputs', nargs='*', help='Project folders (or videos) to add to the queue.')
+    parser.add_argument('--watch', type=str, default=None, help='Drop folder where each new subfolder is queued as a project.')
+    parser.add_argument('--settle-time', type=float, default=30.0, help='Seconds a dropped project must stay unchanged before it is queued.')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds between scans of the drop folder and the queue.')
+    parser.add_argument('--queue-dir', type=str, default=os.path.join(DEFAULT_CACHE_FOLDER, 'queue'), help='Folder of the job queue and of the job status files.')
+    parser.add_argument('--status', action='store_true', help='Print the status of the queued jobs and exit.')
+    parser.add_argument('--retry-failed', action='store_true', help='Queue the failed jobs again.')
+    parser.add_argument('--max-projects', type=int, default=2, help='Number of projects edited at the same time.')
+    parser.add_argument('--cpu-budget', type=int, default=None, help='CPUs shared by all projects. Defaults to all CPUs.')
+    parser.add_argument('--memory-budget', type=float, default=None, help='Memory in GB shared by all projects. Defaults to 80%% of the available memory.')
+    parser.add_argument('--encode-slots', type=int, default=DEFAULT_SLOTS['encode'], help='Max preprocessing and proxy steps running at the same time.')
+    parser.add_argument('--analysis-slots', type=int, default=DEFAULT_SLOTS['analysis'], help='Max probing and silence detection steps running at the same time.')
+    parser.add_argument('--transcription-slots', type=int, default=DEFAULT_SLOTS['transcription'], help='Max transcription steps running at the same time.')
+    parser.add_argument('--orchestrator-args', type=str, default='', help='Arguments of the jobs added by this run (e.g. "--skip-jcut").')
+    parser.add_argument('--no-cache', action='store_true', help='Don\'t reuse probes, loud maps and transcriptions from previous runs.')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Folder of the artifact store shared by all projects.')
+    parser.add_argument('--cache-size', type=float, default=DEFAULT_MAX_SIZE / 1024 ** 3, help='Size cap of the artifact store in GB.')
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queue_dir)
+    if args.status:
+        print_status(queue)
+        return
+
+    if args.retry_failed:
+        print(f"Queued {queue.requeue([FAILED])} failed jobs again")
+
+    runner = BatchRunner(
+        queue,
+        max_projects=args.max_projects,
+        cpu_budget=args.cpu_budget,
+        memory_budget=int(args.memory_budget * 1024 ** 3) if args.memory_budget else None,
+        slots={'encode': args.encode_slots, 'analysis': args.analysis_slots, 'transcription': args.transcription_slots},
+        artifact_store=None if args.no_cache else ArtifactStore(args.cache_dir, max_size=int(args.cache_size * 1024 ** 3)),
+        poll_interval=args.poll_interval
+    )
+
+    # Add the given projects to the queue
+    argv = shlex.split(args.orchestrator_args) + (['--no-cache'] if args.no_cache else [])
+    for input_path in args.inputs:
+        runner.enqueue(input_path, argv)
+
+    watcher = FolderWatcher(args.watch, args.settle_time) if args.watch else None
+    runner.run(watcher, argv)
+    print_status(queue)
+
+
+if __name__ == '__main__':
+    main()
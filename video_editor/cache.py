@@ -0,0 +1,52 @@
+"""
+This script inspects and prunes the local artifact store used to skip repeated work between runs.
+
+Usage:
+    python video_editor/cache.py info
+    python video_editor/cache.py prune --max-size 2
+    python video_editor/cache.py clear
+"""
+import argparse
+
+from utils.artifact_store import ArtifactStore, DEFAULT_MAX_SIZE
+
+
+def format_size(size):
+    """
+    Format a size in bytes to a human readable string.
+    """
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def main():
+    # Get arguments
+    parser = argparse.ArgumentParser(description='Inspect or prune the artifact store.')
+    parser.add_argument('command', choices=['info', 'prune', 'clear'], help='Action to run on the artifact store.')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Artifact store folder.')
+    parser.add_argument('--max-size', type=float, default=DEFAULT_MAX_SIZE / 1024 ** 3, help='Size cap in GB used by prune.')
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.cache_dir)
+
+    if args.command == 'info':
+        stats = store.get_stats()
+        print(f"Artifact store: {stats['root']}")
+        print(f"Artifacts: {stats['count']} ({format_size(stats['size'])})")
+        for kind, kind_stats in sorted(stats['kinds'].items()):
+            print(f"    {kind}: {kind_stats['count']} ({format_size(kind_stats['size'])})")
+
+    elif args.command == 'prune':
+        removed_count, removed_size = store.prune(int(args.max_size * 1024 ** 3))
+        print(f"Evicted {removed_count} artifacts ({format_size(removed_size)}).")
+
+    elif args.command == 'clear':
+        store.clear()
+        print("Artifact store cleared.")
+
+
+if __name__ == "__main__":
+    main()
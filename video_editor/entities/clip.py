@@ -0,0 +1,111 @@
+"""
+This entity represents a clip in the timeline.
+
+NOTE:
+    - Clips are plain records. Times are stored as integer ticks of the timeline timebase (see utils.rational_time),
+      so stages never need to parse FCPXML time strings (e.g. "123/30s") and videos with different frame rates
+      (e.g. 30000/1001 and 25) can be mixed without rounding. They're only converted to FCPXML elements when
+      the file is written.
+"""
+from lxml import etree
+
+from utils.rational_time import format_ticks
+
+
+class Clip:
+    __slots__ = (
+        'ref',
+        'name',
+        'lane',
+        'start',
+        'offset',
+        'duration',
+        'fps',
+        'format',
+        'include_audio',
+        'silent',
+        'position',
+        'scale',
+    )
+
+    def __init__(self, ref, name, duration, start, offset, fps, lane=0, format='r0', include_audio=True, silent=False):
+        self.ref = ref
+        self.name = name
+        self.lane = lane
+        self.start = start          # Start of the clip in the source video (in ticks)
+        self.offset = offset        # Start of the clip in the timeline (in ticks)
+        self.duration = duration    # Duration of the clip (in ticks)
+        self.fps = fps              # Exact frame rate of the source video (Fraction)
+        self.format = format
+        self.include_audio = include_audio
+        self.silent = silent        # Whether the clip is a silent part of the video
+        self.position = (0, 0)
+        self.scale = (1, 1)
+
+    @property
+    def end(self):
+        """
+        End of the clip in the source video (in ticks).
+        """
+        return self.start + self.duration
+
+    @property
+    def timeline_end(self):
+        """
+        End of the clip in the timeline (in ticks).
+        """
+        return self.offset + self.duration
+
+    def copy(self) -> 'Clip':
+        """
+        Create a copy of the clip.
+        """
+        clip = Clip.__new__(Clip)
+        for slot in Clip.__slots__:
+            setattr(clip, slot, getattr(self, slot))
+        return clip
+
+    def to_element(self, timebase, parent=None) -> etree.Element:
+        """
+        Create the FCPXML element of the clip, as a child of `parent` when given.
+        """
+        duration = format_ticks(self.duration, timebase, self.fps)
+
+        # Define Element type
+        element_type = 'asset-clip' if self.include_audio else 'clip'
+
+        # Create Asset Clip element
+        element = etree.Element(element_type) if parent is None else etree.SubElement(parent, element_type)
+        element.attrib.update({
+            'ref': self.ref,
+            'duration': duration,
+            'tcFormat': 'NDF',
+            'enabled': '1',
+            'offset': format_ticks(self.offset, timebase, self.fps),
+            'start': format_ticks(self.start, timebase, self.fps),
+            'format': self.format,
+            'name': self.name,
+            'lane': f"{self.lane}",
+        })
+        if self.silent:
+            element.set('ave_silent', 'true')
+
+        # Create Adjust Transform element
+        adjust_transform = etree.SubElement(element, 'adjust-transform')
+        adjust_transform.attrib.update({
+            'position': f"{self.position[0]} {self.position[1]}",
+            'anchor': '0 0',
+            'scale': f"{self.scale[0]} {self.scale[1]}",
+        })
+
+        # Create Visual element for mute clips
+        if not self.include_audio:
+            video = etree.SubElement(element, 'video')
+            video.attrib.update({
+                'ref': self.ref,
+                'start': '0/1s',
+                'offset': '0/1s',
+                'duration': duration,
+            })
+
+        return element
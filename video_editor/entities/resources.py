@@ -0,0 +1,82 @@
+"""
+These entities represent the resources (formats and media assets) referenced by the clips of the timeline.
+
+NOTE:
+    - Like clips, resources are plain records that are only converted to FCPXML elements when the file is written.
+"""
+from lxml import etree
+
+from utils.rational_time import format_frame_duration, format_frames
+
+
+class Format:
+    __slots__ = ('id', 'fps', 'width', 'height', 'name')
+
+    def __init__(self, id, fps, width, height, name):
+        self.id = id
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.name = name
+
+    def to_element(self, parent=None) -> etree.Element:
+        """
+        Create the FCPXML element of the format, as a child of `parent` when given.
+        """
+        format_element = etree.Element('format') if parent is None else etree.SubElement(parent, 'format')
+        format_element.set('id', self.id)
+        format_element.set('frameDuration', format_frame_duration(self.fps))
+        format_element.set('width', str(self.width))
+        format_element.set('height', str(self.height))
+        format_element.set('name', self.name)
+
+        return format_element
+
+
+class Asset:
+    __slots__ = ('id', 'fps', 'num_frames', 'audio_channels', 'filename', 'filepath', 'format', 'proxy_filepath')
+
+    def __init__(self, id, fps, num_frames, audio_channels, filename, filepath, format='r0', proxy_filepath=None):
+        self.id = id
+        self.fps = fps
+        self.num_frames = num_frames
+        self.audio_channels = audio_channels
+        self.filename = filename
+        self.filepath = filepath
+        self.format = format
+        self.proxy_filepath = proxy_filepath    # Low resolution copy of the media, used while editing
+
+    def to_element(self, parent=None) -> etree.Element:
+        """
+        Create the FCPXML element of the asset, as a child of `parent` when given.
+
+        NOTE:
+            - The duration is an exact number of frames of the asset frame rate, so NTSC rates (e.g. 30000/1001)
+              are no longer truncated to an integer FPS.
+        """
+        # Create the asset element
+        asset_element = etree.Element('asset') if parent is None else etree.SubElement(parent, 'asset')
+        asset_element.attrib.update({
+            'duration': format_frames(self.num_frames, self.fps),
+            'hasVideo': '1',
+            'id': self.id,
+            'audioSources': '1',  # Placeholder for audio sources
+            'hasAudio': '1' if self.audio_channels > 0 else '0',
+            'start': '0/1s',  # Placeholder start
+            'name': self.filename,
+            'audioChannels': str(self.audio_channels),
+            'format': self.format,
+        })
+
+        # Create the media element
+        media = etree.SubElement(asset_element, 'media-rep')
+        media.set('src', self.filepath)
+        media.set('kind', 'original-media')
+
+        # Create the proxy media element
+        if self.proxy_filepath is not None:
+            proxy_media = etree.SubElement(asset_element, 'media-rep')
+            proxy_media.set('src', self.proxy_filepath)
+            proxy_media.set('kind', 'proxy-media')
+
+        return asset_element
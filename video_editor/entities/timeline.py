@@ -1,56 +1,185 @@
 """
 This entity represents the final timeline.
 """
+from contextlib import contextmanager
+from fractions import Fraction
+import gzip
 from lxml import etree
 import os
-from typing import Any, Dict, List
-from copy import deepcopy
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from entities.clip import Clip
+from entities.resources import Asset, Format
+from utils.rational_time import format_ticks, get_frame_ticks, get_timebase, seconds_to_ticks, to_frame_rate
+
+
+INDENT = '    '
+
+# A clip transform is a generator that takes clips and yields the clips that replace them (see `Timeline.run_edit_pipeline`)
+ClipTransform = Callable[[Iterator[Clip]], Iterator[Clip]]
+
+
+class TimelineEdit():
+    """
+    Changes to the clips of a timeline that are applied all at once by `commit`.
+
+    NOTE:
+        - Stages build the new clip list of each video and replace the old one in a single step, instead of
+          appending clips and removing the old ones one by one. Every edit is linear in the number of clips.
+        - Nothing changes in the timeline until `commit` is called, so a stage that fails halfway leaves the
+          timeline untouched.
+    """
+    def __init__(self, timeline: 'Timeline'):
+        self.timeline = timeline
+        self.staged_clips: Dict[str, List[Clip]] = {}
+
+    def get_clips(self, video_ref) -> List[Clip]:
+        """
+        Get the current (not staged) clips of a video.
+        """
+        return self.timeline.video_assets.get(video_ref, [])
+
+    def replace_clips(self, video_ref, clips: Iterable[Clip]):
+        """
+        Stage the new clips of a video. They replace all its current clips on commit.
+        """
+        self.staged_clips[video_ref] = list(clips)
+
+    def add_clip(self, clip: Clip):
+        """
+        Stage a clip to be added to its video. The first clip staged for a video replaces all its current clips.
+        """
+        self.staged_clips.setdefault(clip.ref, []).append(clip)
+
+    def commit(self):
+        """
+        Apply the staged clips to the timeline and update the sequence duration.
+        """
+        for video_ref, clips in self.staged_clips.items():
+            self.timeline.video_assets[video_ref] = clips
+        self.staged_clips = {}
+
+        # Update sequence duration
+        self.timeline.update_sequence_duration()
 
 
 class Timeline():
-    def __init__(self, videos_folder):
-        self.fcpxml = etree.Element('fcpxml', version="1.11")
-        self.resources = etree.SubElement(self.fcpxml, 'resources')
-        self.tree = etree.ElementTree(self.fcpxml)
-        self.spine = None
-        self.sequence = None
+    def __init__(self, videos_folder, pretty_print=True, compress=False):
+        self.resources: List[Union[Format, Asset]] = []
+        self.sequence: Optional[Dict[str, str]] = None
+        self.sequence_duration = 0
         self.video_assets_refs: List[str] = []
-        self.video_assets: Dict[str, Any] = {}
+        self.video_assets: Dict[str, List[Clip]] = {}
         self.resource_id = 0
         self.height = None
         self.width = None
+        self.fps = Fraction(1)
+
+        # Ticks per second of all clip times. It grows when a resource with a new frame rate is added
+        self.timebase = 1
 
         self.output_folder = os.path.join(videos_folder, 'timeline')
         self.fcpxml_filename = os.path.join(self.output_folder, 'timeline.fcpxml')
 
+        # FCPXML file settings
+        self.pretty_print = pretty_print
+        self.compress = compress
+
     def create_timeline_structure(self):
         """
         Create the basic timeline structure.
-        """
-        # Create the library element
-        library = etree.SubElement(self.fcpxml, 'library')
-
-        # Create the event element
-        event = etree.SubElement(library, 'event')
-        event.set('name', 'Timeline 1')
-
-        # Create the project element
-        project = etree.SubElement(event, 'project')
-        project.set('name', 'Timeline 1')
 
-        # Create the sequence element
-        self.sequence = etree.SubElement(project, 'sequence')
-        self.sequence.attrib.update({
+        NOTE:
+            - The timeline is stored as plain records (see `Clip`). The FCPXML elements are only created
+              when the file is written (see `write_fcpxml`).
+        """
+        self.sequence = {
             'duration': '0/1s', # Placeholder for durations
             'tcFormat': 'NDF',
             'tcStart': '0/1s',
             'format': 'r0'
-        })
+        }
 
-        # Create the spine element
-        spine = etree.SubElement(self.sequence, 'spine')
-        self.spine = spine
+    def write_newline(self, xml_file, level):
+        """
+        Write a line break followed by the indentation of the given level (only when pretty printing).
+        """
+        if self.pretty_print:
+            xml_file.write('\n' + INDENT * level)
+
+    def write_child_element(self, xml_file, element, level):
+        """
+        Write a small, fully built element (e.g. a clip) at the given level.
+        """
+        self.write_newline(xml_file, level)
+        if self.pretty_print:
+            etree.indent(element, space=INDENT, level=level)
+        xml_file.write(element)
+
+    @contextmanager
+    def open_child_element(self, xml_file, tag, attrib, level):
+        """
+        Open an element at the given level. Its children can be streamed inside the block.
+        """
+        self.write_newline(xml_file, level)
+        with xml_file.element(tag, attrib):
+            yield
+            self.write_newline(xml_file, level)
+
+    def write_resources(self, xml_file, level):
+        """
+        Stream the resources elements.
+        """
+        if not self.resources:
+            self.write_child_element(xml_file, etree.Element('resources'), level)
+            return
+
+        with self.open_child_element(xml_file, 'resources', {}, level):
+            for resource in self.resources:
+                self.write_child_element(xml_file, resource.to_element(), level + 1)
+
+    def write_spine(self, xml_file, level):
+        """
+        Stream the spine clips, one element at a time.
+        """
+        if not any(self.video_assets.get(ref) for ref in self.video_assets_refs):
+            self.write_child_element(xml_file, etree.Element('spine'), level)
+            return
+
+        with self.open_child_element(xml_file, 'spine', {}, level):
+            for ref in self.video_assets_refs:
+                for clip in self.video_assets.get(ref, []):
+                    self.write_child_element(xml_file, clip.to_element(self.timebase), level + 1)
+
+    def write_fcpxml(self, file):
+        """
+        Stream the timeline to an FCPXML file object.
+
+        NOTE:
+            - Clips are converted to elements and written one by one, so the whole document is never held in
+              memory. The output is the same as indenting and writing the full tree at once.
+        """
+        # Write default configuration in file
+        self.add_default_header(file)
+
+        with etree.xmlfile(file, encoding='UTF-8') as xml_file:
+            with xml_file.element('fcpxml', {'version': '1.11'}):
+                # Add the resources
+                self.write_resources(xml_file, 1)
+
+                # Add the library, event, project and sequence elements
+                if self.sequence is not None:
+                    with self.open_child_element(xml_file, 'library', {}, 1):
+                        with self.open_child_element(xml_file, 'event', {'name': 'Timeline 1'}, 2):
+                            with self.open_child_element(xml_file, 'project', {'name': 'Timeline 1'}, 3):
+                                with self.open_child_element(xml_file, 'sequence', self.get_sequence_attributes(), 4):
+                                    self.write_spine(xml_file, 5)
 
+                self.write_newline(xml_file, 0)
+
+        # Pretty printed documents end with a line break
+        if self.pretty_print:
+            file.write(b'\n')
 
     def add_default_header(self, file):
         """
@@ -62,22 +191,57 @@ class Timeline():
 
     def generate_fcpxml_file(self):
         """
-        Create the FCPXML file.
+        Create the FCPXML file (gzip compressed when `compress` is set).
         """
         os.makedirs(self.output_folder, exist_ok=True)
+        fcpxml_filename = f"{self.fcpxml_filename}.gz" if self.compress else self.fcpxml_filename
 
-        with open(self.fcpxml_filename, 'wb') as file:
-            # Write default configuration in file
-            self.add_default_header(file)
-
-            # Indent the tree to 4 spaces
-            etree.indent(self.tree, space='    ')
-
-            # Add FCPXML tree to the file
-            self.tree.write(file, encoding='UTF-8', pretty_print=True)
+        with (gzip.open if self.compress else open)(fcpxml_filename, 'wb') as file:
+            self.write_fcpxml(file)
 
         print("FCPXML file created successfully.")
     
+    @contextmanager
+    def edit(self):
+        """
+        Edit the clips of the timeline. Staged changes are committed when the block exits without errors.
+
+        Usage:
+            with timeline.edit() as timeline_edit:
+                timeline_edit.replace_clips(ref, new_clips)
+        """
+        timeline_edit = TimelineEdit(self)
+        yield timeline_edit
+        timeline_edit.commit()
+
+    def iter_clips(self) -> Iterator[Clip]:
+        """
+        Iterate over all clips in timeline order (video by video).
+        """
+        for ref in self.video_assets_refs:
+            yield from self.video_assets.get(ref, [])
+
+    def run_edit_pipeline(self, transforms: Iterable[ClipTransform]):
+        """
+        Stream the clips of the timeline through clip transforms and replace them by the result in a single step.
+
+        NOTE:
+            - Transforms are chained, so each clip flows through every stage before the next one is read. Running
+              many stages this way takes a single pass, without building the timeline between each of them.
+        """
+        with self.edit() as timeline_edit:
+            # Every video is replaced, even when the transforms don't yield any clip for it
+            for ref in self.video_assets_refs:
+                timeline_edit.replace_clips(ref, [])
+
+            # Chain the transforms
+            clips = self.iter_clips()
+            for transform in transforms:
+                clips = transform(clips)
+
+            for clip in clips:
+                timeline_edit.add_clip(clip)
+
     def store_video_ref(self, video_ref):
         """
         Add video reference to an array.
@@ -87,7 +251,7 @@ class Timeline():
         """
         self.video_assets_refs.append(video_ref)
     
-    def store_video_asset(self, video_ref, video_asset):
+    def store_video_asset(self, video_ref, video_asset: Clip):
         """
         Add video asset to the timeline.
         """
@@ -97,223 +261,160 @@ class Timeline():
         else:
             self.video_assets[video_ref] = [video_asset]
 
-    def get_stored_video_asset(self, video_ref, index):
+    def get_stored_video_asset(self, video_ref, index) -> Clip:
         """
         Get video asset from the timeline.
         """
         return self.video_assets[video_ref][index]
     
-    def remove_stored_video_asset(self, video_ref, index):
+    def register_frame_rate(self, fps):
         """
-        Remove video asset from the timeline.
+        Make sure every frame of the given frame rate is an exact number of ticks, rescaling existing times if needed.
         """
-        asset_clip = self.video_assets[video_ref].pop(index)
-        self.spine.remove(asset_clip)
+        timebase = get_timebase(self.timebase, fps)
+        if timebase == self.timebase:
+            return
+
+        # Rescale all times to the new timebase
+        scale = timebase // self.timebase
+        for clips in self.video_assets.values():
+            for clip in clips:
+                clip.start *= scale
+                clip.offset *= scale
+                clip.duration *= scale
+        self.sequence_duration *= scale
+        self.timebase = timebase
+
+    def get_frame_ticks(self, fps) -> int:
+        """
+        Get the duration of one frame of the given frame rate in ticks.
+        """
+        return get_frame_ticks(self.timebase, fps)
+
+    def get_formats(self) -> List[Format]:
+        """
+        Get all format resources.
+        """
+        return [resource for resource in self.resources if isinstance(resource, Format)]
+
+    def get_assets(self) -> List[Asset]:
+        """
+        Get all asset resources.
+        """
+        return [resource for resource in self.resources if isinstance(resource, Asset)]
     
-    def add_format_element(self, fps, width, height, name) -> etree.Element:
+    def add_format_element(self, fps, width, height, name) -> Format:
         """
         Add format element to the resources.
         """
-        # Set up project dimenstions if it's the first format element
+        fps = to_frame_rate(fps)
+
+        # Set up project dimenstions and frame rate if it's the first format element
         if self.resource_id == 0:
             self.height = height
             self.width = width
+            self.fps = fps
 
-        # Create the format element
-        format_element = etree.SubElement(self.resources, 'format')
-        format_element.set('id', f"r{self.resource_id}")
-        format_element.set('frameDuration', f"1/{fps}s")  # Placeholder for frame duration
-        format_element.set('width', str(width))
-        format_element.set('height', str(height))
-        format_element.set('name', name)
-        self.fps = fps
+        # Create the format resource
+        format_resource = Format(f"r{self.resource_id}", fps, width, height, name)
+        self.resources.append(format_resource)
+        self.register_frame_rate(fps)
         self.resource_id += 1
 
-        return format_element
+        return format_resource
 
-    def add_asset_element(self, fps, num_frames, audio_channels, filename, filepath, format='r0') -> etree.Element:
+    def add_asset_element(self, fps, num_frames, audio_channels, filename, filepath, format='r0', proxy_filepath=None) -> Asset:
         """
         Add asset element to the resources.
         """
-        asset_element = etree.SubElement(self.resources, 'asset')
         asset_ref = f"r{self.resource_id}"
+        fps = to_frame_rate(fps)
 
-        """
-        Note:
-            Duration calculations are currently not very precise. It's differing from Davinci `.fcpxml` file
-            for the same videos. We need to find a better way to calculate the duration. Although, it doesn't
-            seem to visually affect the final video.
-        """
-        # Create the asset element
-        asset_element.attrib.update({
-            'duration': f"{num_frames}/{fps}s",
-            'hasVideo': '1',
-            'id': asset_ref,
-            'audioSources': '1',  # Placeholder for audio sources
-            'hasAudio': '1' if audio_channels > 0 else '0',
-            'start': '0/1s',  # Placeholder start
-            'name': filename,
-            'audioChannels': str(audio_channels),
-            'format': format,
-        })
-
-        # Create the media element
-        media = etree.SubElement(asset_element, 'media-rep')
-        media.set('src', filepath)
-        media.set('kind', 'original-media')
+        # Create the asset resource
+        asset = Asset(asset_ref, fps, num_frames, audio_channels, filename, filepath, format=format, proxy_filepath=proxy_filepath)
+        self.resources.append(asset)
+        self.register_frame_rate(fps)
         self.resource_id += 1
 
         # Store asset reference
         self.store_video_ref(asset_ref)
 
-        return asset_element
+        return asset
 
-    def add_adjust_transform_element(self, clip) -> etree.Element:
-        """
-        Add adjust-transform element to the clip.
+    def create_clip(self, video_ref, num_frames, start, offset, fps, filename, lane=0, silent=False, format='r0', include_audio=True) -> Clip:
         """
-        adjust_transform = etree.SubElement(clip, 'adjust-transform')
-        adjust_transform.attrib.update({
-            'position': '0 0',
-            'anchor': '0 0',
-            'scale': '1 1',
-        })
+        Create a video clip without adding it to the timeline (see `edit`).
 
-        return adjust_transform
-
-    def add_clip_to_timeline(self, video_ref, num_frames, start, offset, fps, filename, lane=0, custom_attrib={}, format='r0', include_audio=True) -> etree.Element:
+        NOTE:
+            - `num_frames` and `start` are frames of the video (at `fps`). `offset` is the exact position of the
+              clip in the timeline, in seconds (e.g. Fraction(1001, 30000)).
+        """
+        fps = to_frame_rate(fps)
+        frame_ticks = self.get_frame_ticks(fps)
+
+        return Clip(
+            ref=video_ref,
+            name=filename,
+            duration=int(num_frames) * frame_ticks,
+            start=int(start) * frame_ticks,
+            offset=seconds_to_ticks(offset, self.timebase),
+            fps=fps,
+            lane=int(lane),
+            format=format,
+            include_audio=include_audio,
+            silent=silent,
+        )
+
+    def add_clip_to_timeline(self, video_ref, num_frames, start, offset, fps, filename, lane=0, silent=False, format='r0', include_audio=True) -> Clip:
         """
         Add video clip to the timeline.
         """
-        # Define Element type
-        element_type = 'asset-clip' if include_audio else 'clip'
-
-        # Create Asset Clip element
-        asset_clip = etree.SubElement(self.spine, element_type)
-        asset_clip_attributes = {
-            'ref': video_ref,
-            'duration': f"{num_frames}/{fps}s",
-            'tcFormat': 'NDF',
-            'enabled': '1',
-            'offset':  f"{offset}/{fps}s",
-            'start': f"{start}/{fps}s",
-            'format': format,
-            'name': filename,
-            'lane': f"{lane}",
-            **custom_attrib,
-        }
-        asset_clip.attrib.update(asset_clip_attributes)
-
-        self.store_video_asset(video_ref, asset_clip)
-
-        # Create Adjust Transform element
-        self.add_adjust_transform_element(asset_clip)
-
-        # Create Visual element for mute clips
-        if not include_audio:
-            video = etree.SubElement(asset_clip, 'video')
-            video.attrib.update({
-                'ref': video_ref,
-                'start': '0/1s',
-                'offset': '0/1s',
-                'duration': f"{num_frames}/{fps}s",
-            })
-
-        return asset_clip
-    
-    def add_clip_to_timeline_based_on_clip(self, clip):
-        """
-        Add video clip to the timeline based on another clip.
-        """
-        clip_copy = deepcopy(clip)
-        video_ref = clip_copy.get('ref')
-
-        self.store_video_asset(video_ref, clip_copy)
-        self.spine.append(clip_copy)
-        return clip_copy
-    
-    def get_clip_attributes(self, clip) -> Dict[str, Any]:
-        """
-        Get clip parameters.
-        """
-        # Get Davinci tags
-        num_frames, fps = clip.get('duration')[0:-1].split('/')
-        start_frames = clip.get('start')[0:-1].split('/')[0]
-        offset_frames = clip.get('offset')[0:-1].split('/')[0]
+        clip = self.create_clip(video_ref, num_frames, start, offset, fps, filename, lane, silent, format, include_audio)
+        self.store_video_asset(video_ref, clip)
 
-        # Get custom tags
-        ave_silent = clip.get('ave_silent', 'false').lower() == 'true'
-
-        attributes = {
-            'num_frames': int(num_frames),
-            'fps': int(fps),
-            'start_frames': int(start_frames),
-            'offset_frames': int(offset_frames),
-            'ave_silent': ave_silent,
-        }
-
-        return attributes
+        return clip
     
     def update_sequence_duration(self):
         """
-        Iterate over clips and get the last frame of the sequence to update the sequence duration.
+        Iterate over clips and get the end of the last one to update the sequence duration.
         """
-        last_frame = 0
-        fps = 0
+        last_tick = 0
 
         # Iterate over all video assets
         for ref in self.video_assets_refs:
-            for clip in self.video_assets[ref]:
+            for clip in self.video_assets.get(ref, []):
 
-                # Get the last frame possible in the sequence
-                clip_attributes = self.get_clip_attributes(clip)
-                last_frame = max(last_frame, clip_attributes['offset_frames'] + clip_attributes['num_frames'])
-                fps = clip_attributes['fps']
+                # Get the last tick possible in the sequence
+                last_tick = max(last_tick, clip.timeline_end)
                 
         # Update sequence duration
-        self.sequence.attrib.update({
-            'duration': f"{last_frame}/{fps}s",
-        })
+        self.sequence_duration = last_tick
     
-    def get_sequence_duration(self):
+    def get_sequence_duration(self) -> Fraction:
         """
-        Get the sequence duration and its fps.
+        Get the exact sequence duration in seconds.
         """
-        return self.sequence.attrib['duration'][0:-1].split('/')[0], self.sequence.attrib['duration'][0:-1].split('/')[1]
+        return Fraction(self.sequence_duration, self.timebase)
 
-    def zoom_clip(self, clip: etree.Element, ratio: float):
+    def get_sequence_attributes(self) -> Dict[str, str]:
         """
-        Zoom clip to the given ratio.
+        Get the attributes of the sequence element.
         """
-        # Get adjust-transform element from the clip
-        adjust_transform = clip.find('adjust-transform')
-
-        # Create if it doesn't exist
-        if adjust_transform is None:
-            adjust_transform = self.add_adjust_transform_element(clip)
-            return
+        return {**self.sequence, 'duration': format_ticks(self.sequence_duration, self.timebase, self.fps)}
 
-        # Update scale attribute
-        adjust_transform.set('scale', f"{ratio} {ratio}")
+    def zoom_clip(self, clip: Clip, ratio: float):
+        """
+        Zoom clip to the given ratio.
+        """
+        clip.scale = (ratio, ratio)
 
-    def move_clip(self, clip: etree.Element, x: float=None, y: float=None):
+    def move_clip(self, clip: Clip, x: float=None, y: float=None):
         """
         Move clip based on relative x and y values.
         """
-        # Get adjust-transform element from the clip
-        adjust_transform = clip.find('adjust-transform')
-
-        # Create if it doesn't exist
-        if adjust_transform is None:
-            adjust_transform = self.add_adjust_transform_element(clip)
-            return
-        
-        # Get current position
-        current_position = adjust_transform.get('position').split(' ')
-
         # Get x and y values
-        x = current_position[0] if x is None else x
-        y = current_position[1] if y is None else y
+        x = clip.position[0] if x is None else x
+        y = clip.position[1] if y is None else y
 
-        # Update position attribute
-        adjust_transform.set('position', f"{x} {y}")
+        # Update position
+        clip.position = (x, y)
@@ -2,22 +2,30 @@
 This class get all the video files in the input folder and concatenate them into the Timeline.
 """
 import os
+from fractions import Fraction
+from typing import Dict, List, Tuple
 
-from utils.files import get_video_files, get_video_file_specs
+from utils.files import get_video_files
+from utils.probe import VideoSpecs, probe_videos
+from utils.rational_time import to_frame_rate
 from entities.timeline import Timeline
 
 
 class Concatenate:
-    def __init__(self, timeline: Timeline, videos_folder):
+    def __init__(self, timeline: Timeline, videos_folder, artifact_store=None, jobs=None):
         self.timeline = timeline
         self.videos_folder = videos_folder
-        self.fps = 0
+        self.artifact_store = artifact_store
+        self.jobs = jobs
         
         # This will hold all video data, such as: width, height, fps, ...
         self.videos_data = []
 
-        # This variables are cumulative as we add elements to the timeline
-        self.cumulative_duration = (0, 0)
+        # Format resource ID of each distinct (fps, width, height)
+        self.format_ids: Dict[Tuple[Fraction, int, int], str] = {}
+
+        # This variables are cumulative as we add elements to the timeline (exact duration in seconds)
+        self.cumulative_duration = Fraction(0)
 
 
     def get_video_data(self, index, data_type):
@@ -27,21 +35,30 @@ class Concatenate:
         return self.videos_data[index][data_type]
     
 
-    def create_format_element(self, index):
+    def create_format_element(self, index) -> str:
         """
-        Create the format element for the video file.
+        Create the format element for the video file, or reuse the one of a video with the same format.
         """
         # Get video data
-        fps = int(self.get_video_data(index, 'fps'))
+        fps = self.get_video_data(index, 'fps')
         width = self.get_video_data(index, 'width')
         height = self.get_video_data(index, 'height')
-        name = 'DefaultVideoFormat'
+
+        # Reuse format of previous videos
+        format_key = (fps, width, height)
+        if format_key in self.format_ids:
+            return self.format_ids[format_key]
+
+        # The first format is the format of the project
+        name = 'DefaultVideoFormat' if not self.format_ids else f"VideoFormat{len(self.format_ids)}"
 
         # Create the format element
-        self.timeline.add_format_element(fps, width, height, name)
+        format_resource = self.timeline.add_format_element(fps, width, height, name)
+        self.format_ids[format_key] = format_resource.id
+        return format_resource.id
 
 
-    def create_asset_element(self, index):
+    def create_asset_element(self, index, format_id) -> str:
         """
         Create the asset element for the video file.
         """
@@ -50,70 +67,61 @@ class Concatenate:
         filename = self.get_video_data(index, 'filename')
         filepath = self.get_video_data(index, 'filepath')
         num_frames = self.get_video_data(index, 'num_frames')
-        fps = int(self.get_video_data(index, 'fps'))
+        fps = self.get_video_data(index, 'fps')
 
         # Create the asset element
-        self.timeline.add_asset_element(fps, num_frames, audio_channels, filename, filepath)
+        asset = self.timeline.add_asset_element(fps, num_frames, audio_channels, filename, filepath, format=format_id)
+        return asset.id
 
 
-    def store_video_data(self, video_path, resource_id):
+    def store_video_data(self, video_specs: VideoSpecs):
         """
         Store video data for later use.
         """
-        # Get video specs
-        video_specs = get_video_file_specs(video_path)
-
         self.videos_data.append({
-            "width": video_specs['width'],
-            "height": video_specs['height'],
-            "audio_channels": video_specs['audio_channels'],
-            "filename": video_specs['filename'],
-            "filepath": video_specs['localhost_path'],
-            "fps": video_specs['fps'],
-            "num_frames": video_specs['num_frames'],
-            "resource_id": resource_id,
+            "width": video_specs.width,
+            "height": video_specs.height,
+            "audio_channels": video_specs.audio_channels,
+            "filename": video_specs.filename,
+            "filepath": video_specs.localhost_path,
+            "fps": to_frame_rate(video_specs.fps),
+            "num_frames": video_specs.num_frames,
         })
 
 
-    def add_resource(self, video_path, index):
+    def add_resource(self, video_specs: VideoSpecs, index):
         """
         Add resource to the FCPXML object.
+
+        NOTE:
+            - Videos with the same frame rate and dimensions share a format element. Videos with different ones
+              (e.g. 29.97 and 25 FPS cameras) get their own format, so they don't need to be re-encoded.
         """
         # Store video data
-        self.store_video_data(video_path, index+1)
-
-        # Get resources element from Timeline
-        resources = self.timeline.resources
-
-        # Get format element
-        format_element = resources.find('format')
-        if format_element is None:
-            # Create the format element
-            """
-            Note:
-                For now we'll use the same format for all the videos. But this may need to be changed to handle
-                multiple different formats.
-            """
-            self.create_format_element(index)
+        self.store_video_data(video_specs)
+
+        # Create the format element
+        format_id = self.create_format_element(index)
 
         # Create the asset element
-        self.create_asset_element(index)
+        self.videos_data[index]['format_id'] = format_id
+        self.videos_data[index]['resource_id'] = self.create_asset_element(index, format_id)
 
     def add_clip_to_timeline(self, index):
         """
         Add the clip to the timeline.
         """
         # Get video data
-        video_id = self.get_video_data(index, 'resource_id')
+        video_ref = self.get_video_data(index, 'resource_id')
+        format_id = self.get_video_data(index, 'format_id')
         num_frames = self.get_video_data(index, 'num_frames')
         filename = self.get_video_data(index, 'filename')
-        fps = int(self.get_video_data(index, 'fps'))
-        video_ref = f"r{video_id}"
+        fps = self.get_video_data(index, 'fps')
 
         # Create the clip element
-        self.timeline.add_clip_to_timeline(video_ref, num_frames, 0, self.cumulative_duration[0], fps, filename)
+        self.timeline.add_clip_to_timeline(video_ref, num_frames, 0, self.cumulative_duration, fps, filename, format=format_id)
 
-        self.cumulative_duration = (self.cumulative_duration[0] + num_frames, fps)
+        self.cumulative_duration += num_frames / fps
 
 
     def add_timeline(self):
@@ -131,18 +139,23 @@ class Concatenate:
         self.timeline.update_sequence_duration()
 
 
-    def concatenate_video_files(self):
+    def concatenate_video_files(self, videos_specs: List[VideoSpecs] = None):
         """
         Concatenate all the video files in the input folder.
+        The specs of the videos (in alphabetical order) can be given when they were already probed.
         """
         print("Concatenating files...")
-        # Get all the video files in alphabetical order from the input folder
-        video_files = get_video_files(self.videos_folder)
+        if videos_specs is None:
+            # Get all the video files in alphabetical order from the input folder
+            video_files = get_video_files(self.videos_folder)
+
+            # Probe all the video files in parallel
+            videos_specs = probe_videos(video_files, jobs=self.jobs, artifact_store=self.artifact_store)
 
         # Concatenate the video files
-        for index, video_file in enumerate(video_files):
-            self.add_resource(video_file, index)
-            print(f"Resource created for file: {video_file}")
+        for index, video_specs in enumerate(videos_specs):
+            self.add_resource(video_specs, index)
+            print(f"Resource created for file: {video_specs.path}")
 
         # Add the timeline elements
         self.add_timeline()
@@ -1,12 +1,17 @@
 """
 This class is responsible for generating subtitles for the final video.
 """
-import stable_whisper
+import bisect
 import os
 import re
 import srt
 from datetime import timedelta
 
+from utils.audio import CACHE_SAMPLE_RATE, load_audio
+from utils.tracing import tracer
+from utils.transcription import to_whisper_audio
+from utils.whisper_models import whisper_models
+
 
 class GenerateSubtitles():
     def __init__(
@@ -14,12 +19,16 @@ class GenerateSubtitles():
             videos_folder,
             preview_video,
             model='small',
+            device=None,
             language=None,
             word_level=True,
             words_by_group=1,
-            min_dur=0.01
+            min_dur=0.01,
+            artifact_store=None
         ):
-        self.model = stable_whisper.load_model(model)
+        self.model_name = model
+        self.device = device
+        self.artifact_store = artifact_store
         self.output_folder = os.path.join(videos_folder, 'timeline')
         self.subtitles_file = os.path.join(self.output_folder, 'subtitles.srt')
         self.preview_video = preview_video
@@ -132,15 +141,24 @@ class GenerateSubtitles():
         with open(self.subtitles_file, 'w', encoding='utf-8') as f:
             f.write(srt.compose(subtitles))
 
-    def generate_subtitles(self):
+    def generate_subtitles(self, audio=None):
         """
-        Add subtitles to the final video.
+        Add subtitles to the final video. `audio` are the 16-bit PCM samples of the video, when already decoded
+        (e.g. the audio preview of the timeline).
         """
         # Create the output folder if it doesn't exist
         os.makedirs(self.output_folder, exist_ok=True)
 
-        # Generate subtitles
-        self.transcribe_result = self.model.transcribe(self.preview_video)  
+        # Generate subtitles, reusing the audio decoded by other stages when possible
+        if audio is None:
+            audio = load_audio(self.preview_video, self.artifact_store)
+        try:
+            model = whisper_models.get(self.model_name, self.device)
+            with tracer.span('whisper transcribe', 'whisper', input=self.preview_video, media_duration=len(audio) / CACHE_SAMPLE_RATE):
+                self.transcribe_result = model.transcribe(to_whisper_audio(audio))
+        finally:
+            # This stage doesn't need the model anymore, even when transcribing failed
+            whisper_models.release(self.model_name, self.device)
 
         # Save subtitles
         self.transcribe_result.to_srt_vtt(
@@ -157,3 +175,100 @@ class GenerateSubtitles():
         self.remove_punctuation()
 
         print("Subtitles generated successfully!")
+
+    def get_audio_clips(self, timeline, ref):
+        """
+        Get the source range and the timeline offset (in seconds) of every clip of a video that has audio.
+        Clips are sorted by their start in the source video.
+        """
+        audio_clips = []
+        for clip in timeline.video_assets.get(ref, []):
+            # Mute clips (e.g. Subway Surfers) don't have speech
+            if not clip.include_audio:
+                continue
+
+            audio_clips.append((clip.start / timeline.timebase, clip.end / timeline.timebase, clip.offset / timeline.timebase))
+
+        return sorted(audio_clips)
+
+    def map_words_to_timeline(self, audio_clips, transcription):
+        """
+        Map the words of a source video transcription to the timeline.
+        Returns one (start, end, text, segment index) tuple per word that is kept in the timeline.
+        """
+        clip_starts = [clip_start for clip_start, _, _ in audio_clips]
+        timeline_words = []
+
+        for segment_index, segment in enumerate(transcription.segments):
+            for word in segment.words:
+                # Find the clip where the middle of the word is
+                word_middle = (word.start + word.end) / 2
+                clip_index = bisect.bisect_right(clip_starts, word_middle) - 1
+                if clip_index < 0:
+                    continue
+
+                clip_start, clip_end, clip_offset = audio_clips[clip_index]
+                if word_middle >= clip_end:
+                    continue
+
+                # Words partially cut from the clip are clamped to it
+                start = clip_offset + max(word.start, clip_start) - clip_start
+                end = clip_offset + min(word.end, clip_end) - clip_start
+                if end - start < self.min_dur:
+                    continue
+
+                timeline_words.append((start, end, word.word.strip(), segment_index))
+
+        return timeline_words
+
+    def group_words_by_segment(self, timeline_words):
+        """
+        Join all words of the same transcription segment in a single subtitle.
+        """
+        segments = {}
+        for start, end, text, segment_index in timeline_words:
+            if segment_index not in segments:
+                segments[segment_index] = [start, end, text, segment_index]
+                continue
+
+            segment = segments[segment_index]
+            segment[0] = min(segment[0], start)
+            segment[1] = max(segment[1], end)
+            segment[2] = f"{segment[2]} {text}"
+
+        return [tuple(segment) for segment in segments.values()]
+
+    def generate_subtitles_from_timeline(self, timeline, transcriptions_by_ref):
+        """
+        Add subtitles to the final video by mapping the transcriptions of the source videos through the
+        timeline clips. This doesn't need the final video to be rendered nor transcribed again.
+
+        NOTE:
+            - `transcriptions_by_ref` maps each video reference (e.g. r1) to the transcription of its source video,
+              which must have word timestamps. J-Cut lanes are supported, as every clip with audio is mapped.
+        """
+        # Create the output folder if it doesn't exist
+        os.makedirs(self.output_folder, exist_ok=True)
+
+        # Map the words of each source video to the timeline
+        timeline_words = []
+        for ref, transcription in transcriptions_by_ref.items():
+            audio_clips = self.get_audio_clips(timeline, ref)
+            words = self.map_words_to_timeline(audio_clips, transcription)
+            timeline_words.extend(words if self.word_level else self.group_words_by_segment(words))
+
+        # Save subtitles
+        subtitles = [
+            srt.Subtitle(index=index + 1, start=timedelta(seconds=start), end=timedelta(seconds=end), content=text)
+            for index, (start, end, text, _) in enumerate(sorted(timeline_words))
+        ]
+        with open(self.subtitles_file, 'w', encoding='utf-8') as f:
+            f.write(srt.compose(subtitles))
+
+        # Group subtitles by number of words
+        self.group_subtitles_by_number_of_words()
+
+        # Remove punctuation from srt file
+        self.remove_punctuation()
+
+        print("Subtitles generated successfully!")
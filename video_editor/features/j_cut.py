@@ -7,7 +7,10 @@ Note:
         and any room for distraction. Since we're making the most addictive videos on the internet, we're going
         to overdo this technique.
 """
-from copy import deepcopy
+from typing import List
+
+from entities.clip import Clip
+
 
 class JCut:
     def __init__(self, timeline):
@@ -19,110 +22,83 @@ class JCut:
         self.fps = 0
         self.timeline = timeline
     
-    def cut_clip_in_half(self, clip):
+    def cut_clip_in_half(self, clip: Clip):
         """
         Cut the clip in half.
         """
         # Duplicate clips
-        first_half_clip = deepcopy(clip)
-        second_half_clip = deepcopy(clip)
-
-        # Get the duration of the clip
-        attributes = self.timeline.get_clip_attributes(clip)
-        num_frames = attributes['num_frames']
-        fps = attributes['fps']
-        start_frames = attributes['start_frames']
+        first_half_clip = clip.copy()
+        second_half_clip = clip.copy()
 
-        # Cut the clip in half
-        first_half_duration = num_frames // 2
-        second_half_duration = num_frames - first_half_duration
+        # Cut the clip in half, on a frame of the video
+        frame_ticks = self.timeline.get_frame_ticks(clip.fps)
+        first_half_duration = (clip.duration // frame_ticks // 2) * frame_ticks
+        second_half_duration = clip.duration - first_half_duration
 
         # Update clips duration
-        first_half_clip.attrib.update({'duration': f"{first_half_duration}/{fps}s"})
-        second_half_clip.attrib.update({'duration': f"{second_half_duration}/{fps}s"})
+        first_half_clip.duration = first_half_duration
+        second_half_clip.duration = second_half_duration
 
         # Update first half offset
-        first_half_clip.attrib.update({'offset': f"{self.last_frame_lane_0}/{fps}s"})
+        first_half_clip.offset = self.last_frame_lane_0
 
         # Update second half start and offset
-        second_half_clip.attrib.update({'start': f"{start_frames + first_half_duration}/{fps}s"})
-        second_half_clip.attrib.update({'offset': f"{self.last_frame_lane_0 + first_half_duration}/{fps}s"})
+        second_half_clip.start = clip.start + first_half_duration
+        second_half_clip.offset = self.last_frame_lane_0 + first_half_duration
 
         return first_half_clip, second_half_clip
     
-    def jcut_clip(self, base_clip, base_clip_attributes):
+    def jcut_clip(self, base_clip: Clip) -> List[Clip]:
         """
-        Apply J-Cut to a video clip.
+        Apply J-Cut to a video clip. Returns the clips that replace it.
         """
         # Cut the clip in half
         first_half_clip, second_half_clip = self.cut_clip_in_half(base_clip)
 
         # Change second half lane to Video 2 track
-        second_half_clip.attrib.update({'lane': '1'})
-
-        # Add clips to timeline
-        self.timeline.add_clip_to_timeline_based_on_clip(first_half_clip)
-        self.timeline.add_clip_to_timeline_based_on_clip(second_half_clip)
-
-        # Get attributes of first half clip
-        second_half_clip_attributes = self.timeline.get_clip_attributes(second_half_clip)
+        second_half_clip.lane = 1
 
         # Update last_frame_lane_0 and last_frame_lane_1
-        self.last_frame_lane_1 = second_half_clip_attributes['offset_frames'] + second_half_clip_attributes['num_frames']
-        self.last_frame_lane_0 = self.last_frame_lane_1 - int(base_clip_attributes['fps'] * self.jcut_duration)
+        self.last_frame_lane_1 = second_half_clip.timeline_end
+        jcut_frames = int(base_clip.fps * self.jcut_duration)
+        self.last_frame_lane_0 = self.last_frame_lane_1 - jcut_frames * self.timeline.get_frame_ticks(base_clip.fps)
+
+        return [first_half_clip, second_half_clip]
     
-    def append_small_clip(self, base_clip, base_clip_attributes):
+    def append_small_clip(self, base_clip: Clip) -> List[Clip]:
         """
-        Append small clip to Video 1 track.
+        Append small clip to Video 1 track. Returns the clip that replaces it.
         """
         # Shift clip in Video 1 track to possible frame
-        clip = self.timeline.add_clip_to_timeline_based_on_clip(base_clip)
-        clip.attrib.update({'offset': f"{self.last_frame_lane_0}/{base_clip_attributes['fps']}s"})
+        clip = base_clip.copy()
+        clip.offset = self.last_frame_lane_0
 
         # Update Last Frame in Video 1 track
-        self.last_frame_lane_0 += base_clip_attributes['num_frames']
+        self.last_frame_lane_0 += base_clip.duration
+
+        return [clip]
 
     def jcut_timeline(self):
         """
         Apply J-Cut to all clips in the timeline that are longer than the min_duration.
 
-        This method applies a FIFO logic:
+        This method applies a bulk edit:
             - It iterates over all clips in the timeline and creates a copy of it applying the J-Cut technique.
-              The original clip is removed from the timeline and the new one is added to the end of the list.
+              The new clips of each video replace the original ones in a single step.
+        """
+        self.timeline.run_edit_pipeline([self.jcut_clips])
+
+    def jcut_clips(self, clips):
         """
-        # For elem in video assets (all already cutted clips)
+        Clip transform that applies J-Cut to the clips that are longer than the min_duration.
         """
-        NOTE:
-            - Iterating over a copy of the videos assets list is necessary, because as you add and remove clips,
-              list size will change affecting the for loop.
-        """ 
-        video_assets_refs = deepcopy(self.timeline.video_assets_refs)
-        video_assets = deepcopy(self.timeline.video_assets)
-
-        # For each video reference
-        for ref in video_assets_refs:
-
-            # For each clip for a video reference
-            for _ in range(len(video_assets[ref])):
-
-                # Get the Asset Clip
-                base_clip = self.timeline.get_stored_video_asset(ref, 0)
-
-                # Get base clip attributes
-                base_clip_attributes = self.timeline.get_clip_attributes(base_clip)
-                num_frames = base_clip_attributes['num_frames']
-                fps = base_clip_attributes['fps']
-
-                # If clip has enough duration, apply J-Cut
-                if num_frames/fps >= self.min_duration:
-                    self.jcut_clip(base_clip, base_clip_attributes)
-
-                # If clip don't have enough duration, don't apply J-Cut, just add it to Video 1 track
-                else:
-                    self.append_small_clip(base_clip, base_clip_attributes)
-                
-                # Remove the base clip from timeline
-                self.timeline.remove_stored_video_asset(ref, 0)
-
-        # Update sequence duration
-        self.timeline.update_sequence_duration()
+        # For each clip (all already cutted clips)
+        for base_clip in clips:
+
+            # If clip has enough duration, apply J-Cut
+            if base_clip.duration >= self.min_duration * self.timeline.timebase:
+                yield from self.jcut_clip(base_clip)
+
+            # If clip don't have enough duration, don't apply J-Cut, just add it to Video 1 track
+            else:
+                yield from self.append_small_clip(base_clip)
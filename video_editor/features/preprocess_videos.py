@@ -2,81 +2,294 @@
 This class preprocess the videos to standardize the video files to be used in the Timeline.
 """
 import ffmpeg
+import json
 import os
+from dataclasses import dataclass
+from typing import Any, Dict
+
+from utils.concurrency import get_default_jobs, get_threads_per_job, run_jobs
+from utils.probe import probe_videos
+from utils.tracing import tracer
+
+
+@dataclass
+class PreprocessPlan:
+    """
+    How the videos of a folder must be preprocessed (see `PreprocessVideos.plan_preprocessing`).
+    """
+    lowest_avg_fps: float
+    target_fps: Any
+    manifest: Dict[str, Any]
+    modes: Dict[str, str]   # Preprocess mode of each video, by path
+    jobs: int               # Number of conversions running at the same time
 
 
 class PreprocessVideos:
-    def __init__(self, videos_folder):
+    def __init__(self, videos_folder, jobs=None, artifact_store=None, native_frame_rates=False):
         self.videos_folder = videos_folder
-        self.preprocessed_folder = os.path.join(self.videos_folder, 'preprocessed')
+        self.artifact_store = artifact_store
 
+        # The timeline supports mixed frame rates, so CFR videos can keep their own frame rate
+        self.native_frame_rates = native_frame_rates
+        self.preprocessed_folder = os.path.join(self.videos_folder, 'preprocessed')
+        self.manifest_file = os.path.join(self.preprocessed_folder, 'preprocess_manifest.json')
 
-    def get_average_fps(self, video_path):
-        """Extract and calculate the average frame rate (FPS) of a video."""
-        try:
-            # Probe the video to get stream info
-            probe = ffmpeg.probe(video_path, select_streams='v:0')
-            fps_info = probe['streams'][0]['avg_frame_rate']
-
-            # Handle fractional FPS (e.g., '30000/1001')
-            num, denom = map(int, fps_info.split('/'))
-            avg_fps = num / denom
-            return avg_fps
-        except ffmpeg.Error as e:
-            raise RuntimeError(f"FFmpeg error: {e.stderr}")
+        # Concurrency settings. When `jobs` is None, it's chosen based on the number of CPUs
+        self.jobs = jobs
+        self.threads_per_job = None
 
 
     def convert_to_cfr(self, video_path, output_path, target_fps):
         """Convert a VFR video to CFR using the specified target FPS."""
-        try:
-            """
-            Note:
-                Is better to make this preprocessing in async mode to make it faster. We must use run_async() instead of run()
-                and create a while loop to check the end of each process execution.
-            """
-            (
-                ffmpeg
-                .input(video_path)
-                .output(output_path, fps_mode='cfr', r=target_fps)  # Convert to CFR
-                .run(overwrite_output=True)
-            )
-            print(f"Successfully converted to {target_fps} FPS CFR. Video path: {video_path}")
-        except ffmpeg.Error as e:
-            raise RuntimeError(f"FFmpeg error: {e.stderr}")
+        """
+        Note:
+            Many conversions run at the same time (see `preprocess_all_videos_in_folder`), so the output is
+            captured instead of being printed, and the ffmpeg thread count is limited to this job's share of CPUs.
+        """
+        output_options = {'fps_mode': 'cfr', 'r': target_fps}
+        if self.threads_per_job is not None:
+            output_options['threads'] = self.threads_per_job
+
+        with tracer.span('ffmpeg encode', 'ffmpeg', input=video_path):
+            try:
+                (
+                    ffmpeg
+                    .input(video_path)
+                    .output(output_path, **output_options)  # Convert to CFR
+                    .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+                )
+                print(f"Successfully converted to {target_fps} FPS CFR. Video path: {video_path}")
+            except ffmpeg.Error as e:
+                raise RuntimeError(f"FFmpeg error: {e.stderr.decode(errors='replace') if e.stderr else e}")
+
+    def remux_video(self, video_path, output_path):
+        """Copy the streams of a video that is already CFR at the target FPS, without re-encoding it."""
+        with tracer.span('ffmpeg remux', 'ffmpeg', input=video_path):
+            try:
+                (
+                    ffmpeg
+                    .input(video_path)
+                    .output(output_path, c='copy')
+                    .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+                )
+                print(f"Successfully remuxed. Video path: {video_path}")
+            except ffmpeg.Error as e:
+                raise RuntimeError(f"FFmpeg error: {e.stderr.decode(errors='replace') if e.stderr else e}")
+
+    def get_target_fps(self, lowest_avg_fps):
+        """
+        Round to the closest common frame rate (e.g., 30, 60, 24).
+        """
+        return round(lowest_avg_fps / 10) * 10  # Round to nearest multiple of 10
+
+    def get_video_target_fps(self, video_specs, target_fps):
+        """
+        Get the frame rate of the preprocessed version of a video. With native frame rates, CFR videos keep their own.
+        """
+        if self.native_frame_rates and video_specs.is_cfr:
+            return video_specs.avg_frame_rate
+
+        return target_fps
 
     def preprocess_video(self, video_path, output_path, lowest_avg_fps):
-        # Round to the closest common frame rate (e.g., 30, 60, 24)
-        target_fps = round(lowest_avg_fps / 10) * 10  # Round to nearest multiple of 10
+        target_fps = self.get_target_fps(lowest_avg_fps)
         print(f"Converting to {target_fps} FPS CFR...")
 
         self.convert_to_cfr(video_path, output_path, target_fps)
     
 
+    def get_video_paths(self):
+        """
+        Get all files in the videos folder that should be preprocessed.
+        """
+        video_paths = []
+        for video_file in sorted(os.listdir(self.videos_folder)):
+            # Skip non-video files
+            video_path = os.path.join(self.videos_folder, video_file)
+            if not os.path.isfile(video_path):
+                continue
+
+            video_paths.append(video_path)
+
+        return video_paths
+
+    def get_output_path(self, video_path):
+        """
+        Get the path of the preprocessed version of a video.
+        """
+        return os.path.join(self.preprocessed_folder, f"preprocessed_{os.path.basename(video_path)}")
+
+    def load_manifest(self):
+        """
+        Load the manifest with how each preprocessed video was built.
+        """
+        if not os.path.exists(self.manifest_file):
+            return {}
+
+        try:
+            with open(self.manifest_file, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        """
+        Save the manifest with how each preprocessed video was built.
+        """
+        with open(self.manifest_file, 'w') as file:
+            json.dump(manifest, file, indent=4)
+
+    def get_preprocess_mode(self, video_path, video_specs, target_fps, manifest):
+        """
+        Decide how a video should be preprocessed:
+            - skip: the preprocessed video is newer than the source and was built with the same target FPS.
+            - remux: the source is already CFR at the target FPS, so its streams can just be copied.
+            - encode: the source must be re-encoded to CFR.
+
+        NOTE:
+            - Target frame rates are compared as strings, since they may be fractions (e.g. 30000/1001).
+        """
+        output_path = self.get_output_path(video_path)
+        build_info = manifest.get(os.path.basename(output_path))
+        target_fps = self.get_video_target_fps(video_specs, target_fps)
+
+        if (
+            build_info is not None
+            and str(build_info['target_fps']) == str(target_fps)
+            and os.path.exists(output_path)
+            and os.path.getmtime(output_path) >= os.path.getmtime(video_path)
+        ):
+            return 'skip'
+
+        if video_specs.is_cfr and video_specs.avg_frame_rate == target_fps:
+            return 'remux'
+
+        return 'encode'
+
+    def get_encode_speed(self, manifest):
+        """
+        Get how many seconds it takes to encode one second of video, based on the videos encoded so far.
+        """
+        encodes = [build_info for build_info in manifest.values() if build_info['mode'] == 'encode' and build_info['duration'] > 0]
+        if not encodes:
+            return None
+
+        return sum(build_info['elapsed'] for build_info in encodes) / sum(build_info['duration'] for build_info in encodes)
+
+    def print_summary(self, results, modes, videos_specs, manifest):
+        """
+        Print the result of each preprocessing job in a stable order, followed by how many videos fell in each mode.
+        """
+        print("Preprocessing summary:")
+        for result, mode in zip(results, modes):
+            status = mode if result.ok else f"FAILED ({result.error})"
+            print(f"    {os.path.basename(result.item)}: {status} [{result.elapsed:.1f}s]")
+
+        # Count videos by mode
+        counts = {mode: sum(1 for result, video_mode in zip(results, modes) if result.ok and video_mode == mode) for mode in ['encode', 'remux', 'skip']}
+        print(f"Encoded: {counts['encode']} | Remuxed: {counts['remux']} | Skipped: {counts['skip']} | Failed: {sum(1 for result in results if not result.ok)}")
+
+        # Estimate how much encoding time was saved by skipping and remuxing videos
+        encode_speed = self.get_encode_speed(manifest)
+        if encode_speed is None:
+            return
+
+        saved_time = sum(
+            video_specs.duration * encode_speed - result.elapsed
+            for result, mode, video_specs in zip(results, modes, videos_specs)
+            if result.ok and mode != 'encode'
+        )
+        print(f"Estimated encode time saved: {max(saved_time, 0):.1f}s")
+
+    def plan_preprocessing(self, video_paths, videos_specs) -> PreprocessPlan:
+        """
+        Decide how each video must be preprocessed, based on the lowest average FPS of all videos, and split the
+        CPU budget across the concurrent conversions.
+        """
+        # Get lowest avg_fps from all videos
+        lowest_avg_fps = min(
+            (float(video_specs.avg_frame_rate or video_specs.r_frame_rate) for video_specs in videos_specs),
+            default=float('inf')
+        )
+        target_fps = self.get_target_fps(lowest_avg_fps) if videos_specs else None
+
+        if self.native_frame_rates:
+            print(f"Lowest Average FPS: {lowest_avg_fps}\nKeeping the frame rate of CFR videos, encoding VFR videos to {target_fps} FPS CFR...")
+        else:
+            print(f"Lowest Average FPS: {lowest_avg_fps}\nEncoding all videos to {target_fps} FPS CFR...")
+
+        # Decide which videos must really be re-encoded
+        manifest = self.load_manifest()
+        modes = {
+            video_path: self.get_preprocess_mode(video_path, video_specs, target_fps, manifest)
+            for video_path, video_specs in zip(video_paths, videos_specs)
+        }
+
+        # Split the CPU budget across the concurrent conversions
+        num_encodes = list(modes.values()).count('encode')
+        jobs = get_default_jobs(max(num_encodes, 1), threads_per_job=2) if self.jobs is None else self.jobs
+        self.threads_per_job = get_threads_per_job(jobs)
+        print(f"Running {jobs} conversions at a time with {self.threads_per_job} threads each...")
+
+        return PreprocessPlan(lowest_avg_fps, target_fps, manifest, modes, jobs)
+
+    def preprocess_planned_video(self, video_path, plan: PreprocessPlan):
+        """
+        Preprocess a video as decided by the plan.
+        """
+        output_path = self.get_output_path(video_path)
+        if plan.modes[video_path] == 'encode':
+            self.preprocess_video(video_path, output_path, plan.lowest_avg_fps)
+        elif plan.modes[video_path] == 'remux':
+            self.remux_video(video_path, output_path)
+
+    def finish_preprocessing(self, plan: PreprocessPlan, results, videos_specs):
+        """
+        Record how each preprocessed video was built and print the summary. Fails if any video failed.
+        """
+        modes = [plan.modes[result.item] for result in results]
+        manifest = plan.manifest
+
+        # Record how each preprocessed video was built
+        for result, mode, video_specs in zip(results, modes, videos_specs):
+            output_name = os.path.basename(self.get_output_path(result.item))
+
+            # A failed job may leave a broken output behind, so it must never be skipped
+            if not result.ok:
+                manifest.pop(output_name, None)
+                continue
+
+            if mode == 'skip':
+                continue
+
+            manifest[output_name] = {
+                'target_fps': str(self.get_video_target_fps(video_specs, plan.target_fps)),
+                'mode': mode,
+                'duration': video_specs.duration,
+                'elapsed': result.elapsed,
+            }
+        self.save_manifest(manifest)
+
+        self.print_summary(results, modes, videos_specs, manifest)
+
+        # Fail only after all the other videos had the chance to be preprocessed
+        failed = [result for result in results if not result.ok]
+        if failed:
+            failed_files = ', '.join(os.path.basename(result.item) for result in failed)
+            raise RuntimeError(f"Failed to preprocess {len(failed)} of {len(results)} videos: {failed_files}")
+
     def preprocess_all_videos_in_folder(self):
         # Create output folder for preprocessed videos
         os.makedirs(os.path.join(self.videos_folder, 'preprocessed'), exist_ok=True)
         self.preprocessed_folder = os.path.join(self.videos_folder, 'preprocessed')
 
-        # Get lowest avg_fps from all videos
-        lowest_avg_fps = float('inf')
-        for video_file in os.listdir(self.videos_folder):
-            # Skip non-video files
-            if not os.path.isfile(os.path.join(self.videos_folder, video_file)):
-                continue
-
-            # Get average FPS of video
-            video_path = os.path.join(self.videos_folder, video_file)
-            lowest_avg_fps = min(lowest_avg_fps, self.get_average_fps(video_path))
+        video_paths = self.get_video_paths()
 
-        print(f"Lowest Average FPS: {lowest_avg_fps}\nEncoding all videos to {lowest_avg_fps} FPS CFR...")
+        # Probe all videos in parallel and decide how each one must be preprocessed
+        videos_specs = probe_videos(video_paths, jobs=self.jobs, artifact_store=self.artifact_store)
+        plan = self.plan_preprocessing(video_paths, videos_specs)
 
         # Preprocess all videos in the input folder
-        for video_file in os.listdir(self.videos_folder):
-            # Skip non-video files
-            if not os.path.isfile(os.path.join(self.videos_folder, video_file)):
-                continue
+        results = run_jobs(lambda video_path: self.preprocess_planned_video(video_path, plan), video_paths, jobs=plan.jobs)
 
-            # Preprocess video
-            video_path = os.path.join(self.videos_folder, video_file)
-            output_path = os.path.join(self.videos_folder, 'preprocessed', f"preprocessed_{video_file}")
-            self.preprocess_video(video_path, output_path, lowest_avg_fps)
+        self.finish_preprocessing(plan, results, videos_specs)
@@ -0,0 +1,95 @@
+"""
+This class renders an audio-only preview of the timeline. It can be transcribed to generate subtitles without
+rendering the final video.
+"""
+import os
+import wave
+
+import numpy as np
+
+from entities.timeline import Timeline
+from utils.audio import CACHE_SAMPLE_RATE, load_audio
+
+
+class PreviewAudio:
+    def __init__(self, timeline: Timeline, videos_folder, artifact_store=None):
+        self.timeline = timeline
+        self.videos_folder = videos_folder
+        self.artifact_store = artifact_store
+        self.sample_rate = CACHE_SAMPLE_RATE
+        self.preview_file = os.path.join(videos_folder, 'timeline', 'preview.wav')
+
+    def get_audio_segments(self, ref):
+        """
+        Get the source start, timeline start and length (in samples) of every clip of a video that has audio.
+        """
+        clips = [clip for clip in self.timeline.video_assets.get(ref, []) if clip.include_audio]
+        if not clips:
+            return np.empty((0, 3), dtype=np.int64)
+
+        # Convert clip times from ticks to samples
+        starts = np.fromiter((clip.start for clip in clips), dtype=np.int64, count=len(clips))
+        ends = np.fromiter((clip.end for clip in clips), dtype=np.int64, count=len(clips))
+        offsets = np.fromiter((clip.offset for clip in clips), dtype=np.int64, count=len(clips))
+        source_starts = starts * self.sample_rate // self.timeline.timebase
+        source_ends = ends * self.sample_rate // self.timeline.timebase
+        timeline_starts = offsets * self.sample_rate // self.timeline.timebase
+
+        return np.column_stack((source_starts, timeline_starts, source_ends - source_starts))
+
+    def mix_segments(self, preview: np.ndarray, audio: np.ndarray, segments: np.ndarray):
+        """
+        Add the segments of the audio of a video to the preview.
+
+        NOTE:
+            - Clips of different lanes may overlap (e.g. with J-Cuts, the audio of the next clip starts before
+              the end of the previous one), so their audio is mixed like in the editor, saturating at 16 bits.
+        """
+        for source_start, timeline_start, length in segments.tolist():
+            # The audio stream may be a bit shorter than the video
+            length = min(length, audio.size - source_start, preview.size - timeline_start)
+            if length <= 0:
+                continue
+
+            mixed = preview[timeline_start:timeline_start + length].astype(np.int32)
+            mixed += audio[source_start:source_start + length]
+            preview[timeline_start:timeline_start + length] = np.clip(mixed, -32768, 32767)
+
+    def write_wav(self, preview: np.ndarray):
+        """
+        Write the preview as a mono 16-bit WAV file.
+        """
+        os.makedirs(os.path.dirname(self.preview_file), exist_ok=True)
+        with wave.open(self.preview_file, 'wb') as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(self.sample_rate)
+            file.writeframes(preview.astype('<i2').tobytes())
+
+    def render_preview(self) -> np.ndarray:
+        """
+        Render the audio of the timeline to a WAV file and return its samples.
+
+        NOTE:
+            - Only the audio of the kept parts is sliced from the decoded audio of each source video (memory-mapped
+              from the artifact store when available), so no video is rendered nor encoded.
+            - Videos are mixed one at a time, so only one decoded source is held in memory.
+        """
+        print("Rendering audio preview...")
+        self.timeline.update_sequence_duration()
+        num_samples = self.timeline.sequence_duration * self.sample_rate // self.timeline.timebase
+        preview = np.zeros(num_samples, dtype=np.int16)
+
+        # Mix the kept parts of each video
+        for asset in self.timeline.get_assets():
+            segments = self.get_audio_segments(asset.id)
+            if len(segments) == 0:
+                continue
+
+            audio = load_audio(os.path.join(self.videos_folder, asset.filename), self.artifact_store)
+            self.mix_segments(preview, audio, segments)
+
+        self.write_wav(preview)
+        print(f"Audio preview rendered successfully! Output: {self.preview_file}")
+
+        return preview
@@ -0,0 +1,135 @@
+"""
+This class generates low resolution proxies of the timeline videos, so editors can scrub long timelines with
+many cuts smoothly. The proxies are linked from the FCPXML assets next to the original media.
+"""
+import hashlib
+import os
+
+import ffmpeg
+
+from entities.timeline import Timeline
+from utils.concurrency import get_default_jobs, get_threads_per_job, run_jobs
+from utils.files import format_localhost_filepath
+from utils.tracing import tracer
+
+
+HASH_CHUNK_SIZE = 4 * 1024 ** 2  # 4 MB
+
+
+class ProxyMedia:
+    def __init__(self, timeline: Timeline, videos_folder, height=540, jobs=None, artifact_store=None):
+        self.timeline = timeline
+        self.videos_folder = videos_folder
+        self.artifact_store = artifact_store
+        self.proxies_folder = os.path.join(videos_folder, 'proxies')
+
+        # Proxy settings. ProRes Proxy is intra-frame, so every frame can be decoded on its own while scrubbing
+        self.height = height
+        self.codec = 'prores_ks'
+        self.profile = 0    # ProRes Proxy
+
+        # Concurrency settings. When `jobs` is None, it's chosen based on the number of CPUs
+        self.jobs = jobs
+        self.threads_per_job = None
+
+    def get_source_hash(self, video_path) -> str:
+        """
+        Get the content hash of a video, memoized by the artifact store when available.
+        """
+        if self.artifact_store is not None:
+            return self.artifact_store.get_source_fingerprint(video_path)
+
+        file_hash = hashlib.blake2b(digest_size=20)
+        with open(video_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                file_hash.update(chunk)
+
+        return file_hash.hexdigest()
+
+    def get_proxy_path(self, video_path) -> str:
+        """
+        Get the path of the proxy of a video.
+
+        NOTE:
+            - Proxies are named by the content hash of their source, so they're reused across runs, renames and
+              re-encodes that produce the same bytes (e.g. preprocessed videos that are built again).
+        """
+        return os.path.join(self.proxies_folder, f"{self.get_source_hash(video_path)}_{self.height}p.mov")
+
+    def transcode_proxy(self, video_path, proxy_path):
+        """
+        Transcode a video to a low resolution intra-frame proxy. The frame rate and audio are kept.
+        """
+        output_options = {
+            'vf': f"scale=-2:{self.height}",
+            'vcodec': self.codec,
+            'profile:v': self.profile,
+            'acodec': 'pcm_s16le',
+        }
+        if self.threads_per_job is not None:
+            output_options['threads'] = self.threads_per_job
+
+        # Write to a temporary file, so an interrupted encode is never taken for a cached proxy
+        temporary_path = f"{proxy_path}.{os.getpid()}.tmp.mov"
+        try:
+            with tracer.span('ffmpeg proxy', 'ffmpeg', input=video_path):
+                (
+                    ffmpeg
+                    .input(video_path)
+                    .output(temporary_path, **output_options)
+                    .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+                )
+            os.replace(temporary_path, proxy_path)
+        except ffmpeg.Error as e:
+            raise RuntimeError(f"FFmpeg error: {e.stderr.decode(errors='replace') if e.stderr else e}")
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def generate_proxy(self, asset):
+        """
+        Generate the proxy of an asset, unless it's already cached. Returns its path and whether it was transcoded.
+        """
+        video_path = os.path.join(self.videos_folder, asset.filename)
+        proxy_path = self.get_proxy_path(video_path)
+        if os.path.exists(proxy_path):
+            return proxy_path, False
+
+        self.transcode_proxy(video_path, proxy_path)
+        return proxy_path, True
+
+    def generate_proxies(self):
+        """
+        Generate the proxies of all assets of the timeline in parallel and link them from the assets.
+        """
+        os.makedirs(self.proxies_folder, exist_ok=True)
+        assets = self.timeline.get_assets()
+
+        # Split the CPU budget across the concurrent encodes
+        jobs = get_default_jobs(max(len(assets), 1), threads_per_job=2) if self.jobs is None else self.jobs
+        self.threads_per_job = get_threads_per_job(jobs)
+        print(f"Generating {len(assets)} proxies, {jobs} at a time with {self.threads_per_job} threads each...")
+
+        results = run_jobs(self.generate_proxy, assets, jobs=jobs)
+        self.link_proxies(results)
+
+    def link_proxies(self, results):
+        """
+        Link the generated proxies from their assets, given the results of `generate_proxy` for each asset.
+        """
+        # Link the proxies from the assets
+        for result in results:
+            if not result.ok:
+                continue
+
+            proxy_path, transcoded = result.value
+            result.item.proxy_filepath = format_localhost_filepath(proxy_path)
+            print(f"    {result.item.filename}: {'transcoded' if transcoded else 'cached'} [{result.elapsed:.1f}s]")
+
+        # Fail only after all the other proxies had the chance to be generated
+        failed = [result for result in results if not result.ok]
+        if failed:
+            failed_files = ', '.join(f"{result.item.filename} ({result.error})" for result in failed)
+            raise RuntimeError(f"Failed to generate {len(failed)} of {len(results)} proxies: {failed_files}")
+
+        print("Proxies generated successfully!")
@@ -4,32 +4,66 @@ This class is used to remove all silence parts from video timeline.
 import subprocess
 import os
 import json
-import ffmpeg
+from fractions import Fraction
+import numpy as np
 
+from entities.clip import Clip
+from utils.concurrency import run_jobs
 from utils.files import get_video_files
+from utils.loudness import generate_loud_map
+from utils.probe import probe_video
+from utils.tracing import tracer
 
 
 class RemoveSilence:
-    def __init__(self, timeline, videos_folder, margin=0.2):
+    def __init__(self, timeline, videos_folder, margin=0.2, artifact_store=None, backend='auto-editor', threshold_db=-28.0, jobs=None, timeout=None):
         self.timeline = timeline
+        self.artifact_store = artifact_store
+
+        # Concurrency settings. `timeout` is the max duration (in seconds) of each auto-editor call, or of each
+        # audio decode with the native backend
+        self.jobs = jobs
+        self.timeout = timeout
+
+        # Loud maps can be generated by the auto-editor CLI or by the native engine (see utils.loudness)
+        self.backend = backend
+        self.threshold_db = threshold_db
 
         # Loud maps settings
         self.videos_folder = videos_folder
         self.loud_maps_folder = os.path.join(videos_folder, 'remove_silence')
         self.loud_map_sufix = '_loud_map.json'
 
-        # Preview video settings
-        self.loud_video_preview_sufix = '_preview.mp4'
-        self.preview_videos_list_file = os.path.join(self.loud_maps_folder, 'videos.txt')
-        self.preview_final_video = os.path.join(self.loud_maps_folder, 'final_preview.mp4')
-
         # General settings
         self.cumulative_duration = 0        
+        self.margin_seconds = margin
         self.margin = f"{margin}sec"
 
-    def generate_video_loud_map(self, video_path, video_name):
+    def get_loud_map_params(self):
         """
-        This detect all parts of the video with sound louder than the threshold.
+        Get the parameters that change the loud map of a video. They're used as key in the artifact store.
+        """
+        if self.backend == 'native':
+            return {'backend': self.backend, 'margin': self.margin, 'threshold_db': self.threshold_db}
+
+        return {'margin': self.margin}
+
+    def run_auto_editor(self, command, video_path):
+        """
+        Run an auto-editor command and return its output.
+        """
+        try:
+            with tracer.span('auto-editor', 'subprocess', input=video_path):
+                result = subprocess.run(command, check=True, text=True, capture_output=True, timeout=self.timeout)
+            return result.stdout
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"auto-editor failed for {video_path}:\n{e.stderr}")
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(f"auto-editor timed out after {self.timeout}s for {video_path}")
+
+    def run_auto_editor_loud_map(self, video_path, loud_map_path):
+        """
+        Generate the loud map of a video with the auto-editor CLI.
         """
         # Define the path to your video file
         command = [
@@ -39,56 +73,100 @@ class RemoveSilence:
             "--margin",
             self.margin,
             "--output-file",
-            os.path.join(self.loud_maps_folder, f"{video_name}{self.loud_map_sufix}")
+            loud_map_path
         ]
 
         # Execute the command
-        try:
-            result = subprocess.run(command, check=True, text=True, capture_output=True)
-            print(result.stdout)  # Output from the command
-            print(f"Loud Map generated successfully! Input: {video_path}")
-        except subprocess.CalledProcessError as e:
-            print("An error occurred:", e.stderr)  # Error output
-
+        return self.run_auto_editor(command, video_path)
 
-    def generate_loud_video_preview(self, video_path, video_name):
+    def run_native_loud_map(self, video_path, loud_map_path):
         """
-        This method generate preview videos for all videos in the folder.
+        Generate the loud map of a video with the in-process NumPy engine.
         """
-        command = [
-            "auto-editor",
+        video_specs = probe_video(video_path, self.artifact_store)
+        loud_map = generate_loud_map(
             video_path,
-            "--margin",
-            self.margin,
-            "--output-file",
-            os.path.join(self.loud_maps_folder, f"{video_name}{self.loud_video_preview_sufix}"),
-            "--no-open"
-        ]
-        
-        # Execute the command
-        try:
-            result = subprocess.run(command, check=True, text=True, capture_output=True)
-            print(result.stdout)  # Output from the command
-            print(f"Loud Video preview generated successfully! Input: {video_path}")
-        except subprocess.CalledProcessError as e:
-            print("An error occurred:", e.stderr)  # Error output
+            video_specs.fps,
+            margin=self.margin_seconds,
+            threshold_db=self.threshold_db,
+            num_frames=video_specs.num_frames,
+            artifact_store=self.artifact_store,
+            timeout=self.timeout
+        )
 
+        with open(loud_map_path, 'w') as file:
+            json.dump(loud_map, file)
+        return ''
 
-    def generate_loud_map_for_each_video_in_folder(self):
+    def generate_video_loud_map(self, video_path, video_name):
         """
-        This method remove all silence parts from video timeline.
+        This detect all parts of the video with sound louder than the threshold.
+
+        NOTE:
+            - Many loud maps are generated at the same time, so the output is returned instead of printed.
+        """
+        loud_map_path = os.path.join(self.loud_maps_folder, f"{video_name}{self.loud_map_sufix}")
+        loud_map_params = self.get_loud_map_params()
+
+        # Reuse the loud map of a previous run if the video and the loud map parameters didn't change
+        if self.artifact_store is not None:
+            loud_map = self.artifact_store.get_json('loud_map', video_path, **loud_map_params)
+            if loud_map is not None:
+                with open(loud_map_path, 'w') as file:
+                    json.dump(loud_map, file)
+                return f"Loud Map loaded from cache! Input: {video_path}"
+
+        if self.backend == 'native':
+            output = self.run_native_loud_map(video_path, loud_map_path)
+        else:
+            output = self.run_auto_editor_loud_map(video_path, loud_map_path)
+
+        # Store the loud map for the next runs
+        if self.artifact_store is not None:
+            with open(loud_map_path, 'r') as file:
+                self.artifact_store.put_json('loud_map', video_path, json.load(file), **loud_map_params)
+
+        return f"{output}\nLoud Map generated successfully! Input: {video_path}".strip()
+
+
+    def get_video_name(self, video_path):
+        """
+        Get the name of a video, used to name its loud map.
+        """
+        return os.path.basename(video_path).split('.')[0]
+
+    def run_for_each_video_in_folder(self, function):
         """
-        video_files = get_video_files(self.videos_folder)
+        Run `function(video_path, video_name)` for all videos in the folder using a pool of workers.
+
+        NOTE:
+            - The output of each video is printed in alphabetical order once all videos are done, so outputs
+              of different videos are never interleaved.
+            - If any video fails, the whole step fails after the other videos are done.
+        """
+        video_files = [video for video in sorted(get_video_files(self.videos_folder)) if os.path.isfile(video)]
 
         os.makedirs(self.loud_maps_folder, exist_ok=True)
 
-        for video in sorted(video_files):
-            if not os.path.isfile(video):
-                continue
+        def run(video_path):
+            return function(video_path, self.get_video_name(video_path))
+
+        results = run_jobs(run, video_files, jobs=self.jobs)
+
+        # Print outputs in order
+        for result in results:
+            print(result.value if result.ok else f"An error occurred: {result.error}")
+
+        failed = [result for result in results if not result.ok]
+        if failed:
+            failed_files = ', '.join(os.path.basename(result.item) for result in failed)
+            raise RuntimeError(f"Failed for {len(failed)} of {len(results)} videos: {failed_files}")
 
-            video_path = video
-            video_name = os.path.basename(video_path).split('.')[0]
-            self.generate_video_loud_map(video_path, video_name)
+    def generate_loud_map_for_each_video_in_folder(self):
+        """
+        This method remove all silence parts from video timeline.
+        """
+        self.run_for_each_video_in_folder(self.generate_video_loud_map)
     
 
     def get_loud_map(self, video_name):
@@ -99,150 +177,134 @@ class RemoveSilence:
         with open(loud_map_path, 'r') as file:
             return json.load(file)
 
+    def get_loud_maps(self):
+        """
+        This method return the loud maps of all videos by file name (e.g. to save them in a checkpoint).
+        """
+        if not os.path.isdir(self.loud_maps_folder):
+            return {}
+
+        return {
+            filename: self.get_loud_map(filename[:-len(self.loud_map_sufix)])
+            for filename in sorted(os.listdir(self.loud_maps_folder))
+            if filename.endswith(self.loud_map_sufix)
+        }
+
+    def restore_loud_maps(self, loud_maps):
+        """
+        This method writes the loud maps that are missing from the loud maps folder (e.g. when resuming from a checkpoint).
+        """
+        os.makedirs(self.loud_maps_folder, exist_ok=True)
+        for filename, loud_map in loud_maps.items():
+            loud_map_path = os.path.join(self.loud_maps_folder, filename)
+            if os.path.exists(loud_map_path):
+                continue
+
+            with open(loud_map_path, 'w') as file:
+                json.dump(loud_map, file)
+
 
     def cut_clips(self):
         """
         This method remove all silence parts from video timeline.
 
-        This method applies a FIFO logic:
+        This method applies a bulk edit:
             - It iterates over all clips in the timeline and create a Loud Map for each. The Loud Map shows
-              which parts of the clip has sound. Based on the Loud Map, many clips are created and added to
-              the end of the timeline. Finally, the original clip is removed from the timeline.
+              which parts of the clip has sound. Based on the Loud Map, many clips are created and replace
+              the original clip in the timeline in a single step.
         """
-        for ref in self.timeline.video_assets_refs:
-            # Get loud map for the video
-            base_asset_clip = self.timeline.get_stored_video_asset(ref, 0)
-            filename_without_extension = base_asset_clip.attrib['name'].split('.')[0]
-            base_clip_attrib = self.timeline.get_clip_attributes(base_asset_clip)
-            base_clip_duration = base_clip_attrib['num_frames']
+        self.timeline.run_edit_pipeline([self.split_clips])
 
+    def split_clips(self, clips):
+        """
+        Clip transform that splits each clip of the timeline in its loud and silent parts.
+        """
+        for base_asset_clip in clips:
+            # Get loud map for the video
+            filename_without_extension = base_asset_clip.name.split('.')[0]
             loud_map_json = self.get_loud_map(filename_without_extension)
-            loud_map = loud_map_json['v'][0]
-            timebase = loud_map_json['timebase'].split('/')[0]
-
-            previous_video_duration = self.cumulative_duration
-            previous_loud_clip_offset = 0
-            previous_loud_clip_start = 0
-            previous_loud_clip_duration = 0
-            
-            # Split asset clip in loud parts
-            for loud_part in loud_map:
-                # Create new asset clip
-                # NOTE: auto-editor returns start and offset element switched (I hate this so fucking much...)
-                loud_clip_start = loud_part['offset']
-
-                silent_clip_start = previous_loud_clip_start + previous_loud_clip_duration
-                silent_clip_duration = loud_clip_start - silent_clip_start
-                silent_clip_offset = previous_loud_clip_offset + previous_loud_clip_duration
-
-                # Add the silent part
-                if silent_clip_duration > 0:
-                    self.timeline.add_clip_to_timeline(
-                        video_ref=base_asset_clip.get('ref'),
-                        num_frames=silent_clip_duration,
-                        start=silent_clip_offset,
-                        offset=previous_video_duration + silent_clip_start,
-                        fps=timebase,
-                        filename=base_asset_clip.get('name'),
-                        custom_attrib={'ave_silent': 'true'}
-                    )
-                
-                loud_clip_offset = silent_clip_offset + silent_clip_duration
-
-                # Add the loud part
-                self.timeline.add_clip_to_timeline(
-                    video_ref=base_asset_clip.get('ref'),
-                    num_frames=loud_part['dur'],
-                    start=loud_clip_start,
-                    offset=previous_video_duration + loud_clip_offset,
-                    fps=timebase,
-                    filename=base_asset_clip.get('name')
-                )
-
-                previous_loud_clip_start = loud_clip_start
-                previous_loud_clip_offset = loud_clip_offset
-                previous_loud_clip_duration = loud_part['dur']
-            
-            # Add the last silent part
-            if previous_loud_clip_start + previous_loud_clip_duration < base_clip_duration:
-                silent_clip_start = previous_loud_clip_start + previous_loud_clip_duration
-                silent_clip_duration = base_clip_duration - silent_clip_start
-                silent_clip_offset = previous_loud_clip_offset + previous_loud_clip_duration
-
-                # Add the last silent part
-                self.timeline.add_clip_to_timeline(
-                    video_ref=base_asset_clip.get('ref'),
-                    num_frames=silent_clip_duration,
-                    start=silent_clip_offset,
-                    offset=previous_video_duration + silent_clip_start,
-                    fps=timebase,
-                    filename=base_asset_clip.get('name'),
-                    custom_attrib={'ave_silent': 'true'}
-                )
+
+            # Replace the base asset clip by its loud and silent parts
+            yield from self.split_clip(base_asset_clip, loud_map_json)
 
             # Update base clip duration
-            self.cumulative_duration += base_clip_duration
-            
-            # Remove the base asset clip
-            self.timeline.remove_stored_video_asset(ref, 0)
-        
-        # Update sequence duration
-        self.timeline.update_sequence_duration()
+            self.cumulative_duration += base_asset_clip.duration
 
-    def remove_silence(self):
-        """
-        TODO: This method remove all silence parts from video timeline.
+    def get_split_intervals(self, loud_map, base_clip_duration):
         """
-        pass
-
+        Get the source start, duration and silent flag of the loud and silent parts of a clip, in order.
 
-    def generate_previews_for_videos(self):
+        NOTE:
+            - The whole Loud Map is processed with array operations: the silent part before each loud part is
+              the gap between the end of the previous loud part and its start. Silent parts without frames
+              are dropped, and the rest of the clip after the last loud part is also silent.
         """
-        This method generate preview videos for all videos in the folder.
+        # NOTE: auto-editor returns start and offset element switched (I hate this so fucking much...)
+        loud_starts = np.fromiter((loud_part['offset'] for loud_part in loud_map), dtype=np.int64, count=len(loud_map))
+        loud_durations = np.fromiter((loud_part['dur'] for loud_part in loud_map), dtype=np.int64, count=len(loud_map))
+        loud_ends = loud_starts + loud_durations
+
+        # Get the silent part before each loud part
+        silent_starts = np.concatenate(([0], loud_ends))[:-1]
+        silent_durations = loud_starts - silent_starts
+
+        # Interleave silent and loud parts
+        starts = np.column_stack((silent_starts, loud_starts)).ravel()
+        durations = np.column_stack((silent_durations, loud_durations)).ravel()
+        silent = np.tile([True, False], len(loud_map))
+
+        # Add the last silent part
+        last_frame = int(loud_ends[-1]) if len(loud_map) else 0
+        if last_frame < base_clip_duration:
+            starts = np.append(starts, last_frame)
+            durations = np.append(durations, base_clip_duration - last_frame)
+            silent = np.append(silent, True)
+
+        # Remove empty silent parts
+        keep = ~silent | (durations > 0)
+        return starts[keep], durations[keep], silent[keep]
+
+    def split_clip(self, base_asset_clip, loud_map_json):
         """
-        video_files = get_video_files(self.videos_folder)
+        Split a clip in its loud and silent parts based on the Loud Map of its video.
 
-        os.makedirs(self.loud_maps_folder, exist_ok=True)
-
-        for video in sorted(video_files):
-            if not os.path.isfile(video):
-                continue
-
-            video_path = video
-            video_name = os.path.basename(video_path).split('.')[0]
-            self.generate_loud_video_preview(video_path, video_name)
-    
-    def join_all_preview_videos(self):
-        """
-        This method join all preview videos in a single video.
+        NOTE:
+            - The Loud Map is in frames of its own timebase, while clip times are timeline ticks. Loud Maps with
+              another frame rate than the video (e.g. old ones generated with the rate truncated to an integer)
+              are rescaled to the frames of the video.
         """
-        # Delete final preview file if it already exists
-        if os.path.exists(self.preview_final_video):
-            os.remove(self.preview_final_video)
-
-        # Get all preview videos
-        preview_videos = [
-            os.path.join(self.loud_maps_folder, f) for f in sorted(os.listdir(self.loud_maps_folder))
-            if f.endswith(self.loud_video_preview_sufix)
+        loud_map = loud_map_json['v'][0]
+        loud_map_fps = Fraction(loud_map_json['timebase'])
+        fps = base_asset_clip.fps
+        frame_ticks = self.timeline.get_frame_ticks(fps)
+        num_frames = base_asset_clip.duration // frame_ticks
+        if loud_map_fps == fps:
+            starts, durations, silent = self.get_split_intervals(loud_map, num_frames)
+        else:
+            # Rescale the parts to the frames of the video, dropping the ones left without frames
+            scale = float(fps / loud_map_fps)
+            starts, durations, silent = self.get_split_intervals(loud_map, round(num_frames / scale))
+            ends = np.minimum(np.rint((starts + durations) * scale).astype(np.int64), num_frames)
+            starts = np.minimum(np.rint(starts * scale).astype(np.int64), num_frames)
+            durations = ends - starts
+            keep = durations > 0
+            starts, durations, silent = starts[keep], durations[keep], silent[keep]
+
+        # Parts keep their position relative to the start of the video in the timeline
+        starts, durations = starts * frame_ticks, durations * frame_ticks
+        offsets = starts + self.cumulative_duration
+
+        # Create all clips at once
+        ref, name, format = base_asset_clip.ref, base_asset_clip.name, base_asset_clip.format
+        return [
+            Clip(ref, name, duration, start, offset, fps, format=format, silent=is_silent)
+            for start, duration, offset, is_silent in zip(
+                starts.tolist(), durations.tolist(), offsets.tolist(), silent.tolist()
+            )
         ]
 
-        with open(self.preview_videos_list_file, 'w') as f:
-            for video in preview_videos:
-                f.write(f"file '{video}'\n")
-
-        # Run the ffmpeg concat command
-        (
-            ffmpeg
-            .input(self.preview_videos_list_file, format='concat', safe=0)
-            .output(self.preview_final_video, c='copy')
-            .run(overwrite_output=True)  # Overwrite if output exists
-        )
-
-    def generate_final_preview_video(self):
+    def remove_silence(self):
         """
-        This method generate the final preview video. This can be used to generate subtitles.
+        TODO: This method remove all silence parts from video timeline.
         """
-        print("Generating final preview video...")
-        self.generate_previews_for_videos()
-        self.join_all_preview_videos()
-        print("Final preview video generated successfully!")
+        pass
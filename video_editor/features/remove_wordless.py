@@ -1,11 +1,18 @@
 """
 This class remove wordless clips from video.
 """
+from itertools import compress, groupby
 import stable_whisper
+import numpy as np
 import os
-from copy import deepcopy
+import torch
 
+from utils.audio import get_audio_file
+from utils.concurrency import run_jobs
 from utils.files import get_video_files
+from utils.intervals import get_coverage_ratio, seconds_to_frame_intervals
+from utils.transcription import get_loud_regions, get_transcription_workers, transcribe_source, transcribe_sources
+from utils.whisper_models import whisper_models
 
 
 class RemoveWordless:
@@ -13,102 +20,242 @@ class RemoveWordless:
     NOTE:
         - Using a model worst than 'small' can work very badly in some cases. The model may understand noises as words...
     """
-    def __init__(self, timeline, videos_folder, model='small'):
+    def __init__(self, timeline, videos_folder, model='small', device=None, artifact_store=None, remove_silence=None, padding=0.2, workers=None, min_speech_ratio=0.0):
         self.timeline = timeline
         self.videos_folder = videos_folder
-        self.model = stable_whisper.load_model(model)
+        self.model_name = model
+        self.device = device
+        self.artifact_store = artifact_store
+
+        # Number of videos transcribed at the same time. When None, it's chosen based on CPUs and available memory
+        self.workers = workers
+
+        # When the loud maps of RemoveSilence are available, only loud regions (plus padding, in seconds) are transcribed
+        self.remove_silence = remove_silence
+        self.padding = padding
         self.transcriptions = []
-    
-    def convert_seconds_to_frames(self, seconds, fps):
+        self.transcriptions_by_ref = {}
+
+        # Min ratio of a clip that must be covered by speech for it to be kept, and the ratio of every clip
+        self.min_speech_ratio = min_speech_ratio
+        self.speech_ratios_by_ref = {}
+
+    def get_transcription_params(self):
         """
-        Convert seconds to frames.
+        Get the parameters that change the transcription of a video. They're used as key in the artifact store.
         """
-        return int(seconds * fps)
+        if self.remove_silence is None:
+            return {'model': self.model_name}
 
-    def segment_is_inside_clip(self, segment_start_frame, segment_end_frame, clip_start_frame, clip_end_frame):
+        return {
+            'model': self.model_name,
+            'loud_map': self.remove_silence.get_loud_map_params(),
+            'padding': self.padding,
+        }
+
+    def get_cached_transcription(self, video_path):
         """
-        Verify if the segment is inside the clip. In other words, if the clip has speech.
+        Get the transcription of a previous run, if the video and the transcription parameters didn't change.
         """
-        return (
-            segment_start_frame >= clip_start_frame and segment_start_frame <= clip_end_frame
-        ) or (
-            segment_end_frame >= clip_start_frame and segment_end_frame <= clip_end_frame
-        ) or (
-            segment_start_frame < clip_start_frame and segment_end_frame > clip_end_frame
-        )
+        if self.artifact_store is None:
+            return None
 
-    def remove_wordless_clips(self):
+        return self.artifact_store.get_json('transcription', video_path, **self.get_transcription_params())
+
+    def get_transcription_job(self, video_path):
         """
-        Remove wordless clips from the video timeline.
+        Get the job that transcribes a video (see `utils.transcription.transcribe_source`).
+
+        NOTE:
+            - Silent parts are never kept in the timeline, so when loud maps are available only the loud regions
+              are transcribed. Timestamps are mapped back to the source video.
+        """
+        regions = None
+        if self.remove_silence is not None:
+            video_name = os.path.basename(video_path).split('.')[0]
+            regions = get_loud_regions(self.remove_silence.get_loud_map(video_name), self.padding)
+
+        # Reuse the audio decoded by the other stages. It's pinned in the store until the job is released
+        audio_path = get_audio_file(video_path, self.artifact_store, pin=True) if self.artifact_store is not None else None
+
+        return (self.model_name, self.device, video_path, audio_path, regions)
+
+    def release_transcription_job(self, job):
+        """
+        Let the audio of a transcription job be evicted from the artifact store again.
+        """
+        audio_path = job[3]
+        if audio_path is not None:
+            self.artifact_store.unpin(audio_path)
+
+    def get_workers(self, num_videos):
+        """
+        Get how many videos can be transcribed at the same time.
+        """
+        if self.workers is not None:
+            return self.workers
+
+        # A GPU is shared by all transcriptions, so they run in this process
+        if self.device not in [None, 'cpu'] or (self.device is None and torch.cuda.is_available()):
+            return 1
+
+        return get_transcription_workers(num_videos, self.model_name)
+
+    def transcribe_videos(self, video_files):
+        """
+        Transcribe all videos, reusing the transcriptions of previous runs when possible.
+        Transcriptions are returned in the same order as `video_files`.
+        """
+        transcriptions = {video_path: self.get_cached_transcription(video_path) for video_path in video_files}
+        for video_path, transcription in transcriptions.items():
+            if transcription is not None:
+                print(f"Transcription loaded from cache! Input: {video_path}")
+
+        # Transcribe the videos that were not cached
+        missing_videos = [video_path for video_path, transcription in transcriptions.items() if transcription is None]
+        job_results = run_jobs(self.get_transcription_job, missing_videos)
+        jobs = [result.value for result in job_results if result.ok]
+        try:
+            results = transcribe_sources(jobs, self.get_workers(len(missing_videos)))
+        finally:
+            for job in jobs:
+                self.release_transcription_job(job)
+
+        failed = [(result.item, result.error) for result in job_results if not result.ok]
+        failed += [(result.item[2], result.error) for result in results if not result.ok]
+        if failed:
+            errors = '\n'.join(f"    {video_path}: {error}" for video_path, error in failed)
+            raise RuntimeError(f"Failed to transcribe {len(failed)} of {len(missing_videos)} videos:\n{errors}")
+
+        for video_path, result in zip(missing_videos, results):
+            transcriptions[video_path] = result.value
+
+            if self.artifact_store is not None:
+                self.artifact_store.put_json('transcription', video_path, result.value, **self.get_transcription_params())
+
+        return [stable_whisper.WhisperResult(transcriptions[video_path]) for video_path in video_files]
+
+    def transcribe_video(self, video_path):
+        """
+        Transcribe a single video in this process, reusing the transcription of a previous run when possible.
+        """
+        transcription = self.get_cached_transcription(video_path)
+        if transcription is not None:
+            print(f"Transcription loaded from cache! Input: {video_path}")
+            return transcription
+
+        job = self.get_transcription_job(video_path)
+        try:
+            transcription = transcribe_source(job)
+        finally:
+            self.release_transcription_job(job)
+        if self.artifact_store is not None:
+            self.artifact_store.put_json('transcription', video_path, transcription, **self.get_transcription_params())
+
+        return transcription
+    
+    def get_speech_coverage(self, clips, transcription) -> np.ndarray:
+        """
+        Get the ratio (between 0 and 1) of each clip that is covered by the speech segments of its video.
 
         NOTE:
-            - This script works in a FIFO logic. It iterates through all clips in the timeline and just
-              add the clips that are not wordless to the end of the timeline. Then, for each iteration, the
-              clip analyzed clip is removed from the timeline.
+            - Clip and segment boundaries are converted to frame arrays, so the overlap of every clip with all
+              segments is computed at once, including clips that span several segments.
+            - Clip times are timeline ticks, so the frames touched by the segments are converted to ticks too.
+        """
+        if not clips:
+            return np.zeros(0)
+
+        # Get clips start and end ticks
+        fps = clips[0].fps
+        frame_ticks = self.timeline.get_frame_ticks(fps)
+        clip_starts = np.fromiter((clip.start for clip in clips), dtype=np.int64, count=len(clips))
+        clip_ends = np.fromiter((clip.end for clip in clips), dtype=np.int64, count=len(clips))
+
+        # Get the frames touched by each transcription segment
+        segments = transcription.segments
+        segment_starts, segment_ends = seconds_to_frame_intervals(
+            [segment.start for segment in segments],
+            [segment.end for segment in segments],
+            float(fps)
+        )
+
+        return get_coverage_ratio(clip_starts, clip_ends, segment_starts * frame_ticks, segment_ends * frame_ticks)
+
+    def transcribe_all_videos(self):
+        """
+        Transcribe all videos in the folder.
         """
         # Get all video files in the folder
         video_files = get_video_files(self.videos_folder)
 
         # Transcribe each video in the folder
-        for video in sorted(video_files):
-            if not os.path.isfile(video):
-                continue
+        video_files = [video for video in sorted(video_files) if os.path.isfile(video)]
+        try:
+            self.set_transcriptions(self.transcribe_videos(video_files))
+        finally:
+            self.release_model()
 
-            transcription = self.model.transcribe(video)
-            self.transcriptions.append(transcription)
-        
+    def release_model(self):
+        """
+        Release the Whisper model reserved for this stage, even when transcribing failed.
+        """
+        whisper_models.release(self.model_name, self.device)
+
+    def set_transcriptions(self, transcriptions):
+        """
+        Keep the transcriptions of all videos (in the same order as the timeline videos).
+        """
+        self.transcriptions = transcriptions
+
+        # Keep transcriptions by video reference, so they can be reused to generate subtitles
+        self.transcriptions_by_ref = dict(zip(self.timeline.video_assets_refs, self.transcriptions))
+
+    def remove_wordless_clips(self):
+        """
+        Remove wordless clips from the video timeline.
+        """
+        self.transcribe_all_videos()
+
+        # Keep only the clips with speech
+        self.timeline.run_edit_pipeline([self.filter_clips])
+
+    def filter_wordless_clips(self, transcriptions):
+        """
+        Keep only the clips that have speech, based on the transcription of each video (in the same order as the
+        timeline videos).
+        """
+        self.transcriptions_by_ref = dict(zip(self.timeline.video_assets_refs, transcriptions))
+        self.timeline.run_edit_pipeline([self.filter_clips])
+
+    def filter_clips(self, clips):
+        """
+        Clip transform that keeps only the clips that have speech, based on the transcription of each video.
+
+        NOTE:
+            - A clip is kept when it isn't silent and at least `min_speech_ratio` of it is covered by speech
+              (any speech at all, by default).
+            - Clips are evaluated video by video, so the speech coverage of all clips of a video is computed at once.
+        """
         # Offset to append video clips to the timeline
         current_offset = 0
 
-        # Make copy of video assets references
-        video_assets_copy = deepcopy(self.timeline.video_assets)
-
         # Iterate through all videos
-        for ref_idx, ref in enumerate(self.timeline.video_assets_refs):
-            transcription = self.transcriptions[ref_idx]
-            segment_index = 0
-            segment = transcription[segment_index]
-
-            # Iterate through all clips cutted from video
-            for _ in video_assets_copy[ref]:
-                # Get clip attributes
-                asset_clip = self.timeline.get_stored_video_asset(ref, 0)
-                clip_attrib = self.timeline.get_clip_attributes(asset_clip)
-                fps = clip_attrib['fps']
-                ave_silent = clip_attrib['ave_silent']
-                clip_start_frame = clip_attrib['start_frames']
-                clip_end_frame = clip_attrib['start_frames'] + clip_attrib['num_frames']
-                
-                # Get segments start and end frames
-                segment_start_frame = self.convert_seconds_to_frames(segment.start, fps)
-                segment_end_frame = self.convert_seconds_to_frames(segment.end, fps)
-
-                # Move segment pointer to next segment closer to current clip
-                while segment_end_frame < clip_start_frame and segment_index < len(transcription):
-                    segment = transcription[segment_index]
-                    segment_index += 1
-
-                    # Get transcription segment start and end frame
-                    segment_start_frame = self.convert_seconds_to_frames(segment.start, fps)
-                    segment_end_frame = self.convert_seconds_to_frames(segment.end, fps)
-
-                # Verify if the clip is inside transcription segment, which means it has speech
-                if self.segment_is_inside_clip(
-                    segment_start_frame,
-                    segment_end_frame,
-                    clip_start_frame,
-                    clip_end_frame
-                # Verify if the clip is not silent
-                ) and not ave_silent:
-                    added_clip = self.timeline.add_clip_to_timeline_based_on_clip(asset_clip)
-
-                    # Update clip offset
-                    added_clip.attrib.update({'offset': f"{current_offset}/{fps}s"})
-                    current_offset += clip_attrib['num_frames']
-
-                # Remove base clip from timeline
-                self.timeline.remove_stored_video_asset(ref, 0)
-
-        # Update timeline duration
-        self.timeline.update_sequence_duration()
-            
\ No newline at end of file
+        for ref, video_clips in groupby(clips, key=lambda clip: clip.ref):
+            video_clips = list(video_clips)
+
+            # Get the speech coverage of all clips cutted from video
+            speech_ratios = self.get_speech_coverage(video_clips, self.transcriptions_by_ref[ref])
+            self.speech_ratios_by_ref[ref] = speech_ratios
+
+            # Verify if the clips have speech and are not silent
+            silent = np.fromiter((clip.silent for clip in video_clips), dtype=bool, count=len(video_clips))
+            has_speech = (speech_ratios > 0) & (speech_ratios >= self.min_speech_ratio) & ~silent
+
+            for asset_clip in compress(video_clips, has_speech):
+                kept_clip = asset_clip.copy()
+
+                # Update clip offset
+                kept_clip.offset = current_offset
+                current_offset += asset_clip.duration
+                yield kept_clip
@@ -3,16 +3,72 @@ This class orchestrate the video editing process based on the provided arguments
 """
 import argparse
 import os
+from contextlib import nullcontext
+from functools import partial
+
+import stable_whisper
 
 from features.concatenate import Concatenate
 from features.generate_subtitles import GenerateSubtitles
 from features.j_cut import JCut
 from features.preprocess_videos import PreprocessVideos
+from features.preview_audio import PreviewAudio
+from features.proxy_media import ProxyMedia
 from features.remove_silence import RemoveSilence
 from features.remove_wordless import RemoveWordless
 from features.subway_surfers import SubwaySurfers
 
 from entities.timeline import Timeline
+from utils.artifact_store import ArtifactStore, DEFAULT_MAX_SIZE
+from utils.checkpoints import CheckpointStore, get_fingerprint, get_sources_signature
+from utils.concurrency import get_default_jobs, get_threads_per_job
+from utils.files import get_video_files, is_video_file
+from utils.probe import probe_video
+from utils.scheduler import DagScheduler
+from utils.tracing import profile, tracer
+from utils.whisper_models import whisper_models
+
+
+# Arguments that change the result of each step. A checkpoint is only reused when they didn't change
+STAGE_PARAMETERS = {
+    'preprocess_videos': ['skip_preprocess', 'already_preprocessed', 'native_frame_rates', 'just_subtitles'],
+    'determine_input_folder': ['input', 'skip_preprocess', 'just_subtitles'],
+    'create_timeline': ['compact_fcpxml', 'gzip_fcpxml'],
+    'generate_proxies': ['proxies', 'proxy_height', 'relink_originals'],
+    'remove_silence': ['silence_backend', 'silence_threshold'],
+    'remove_wordless_clips': ['just_remove_silence', 'whisper_model', 'min_speech_ratio'],
+    'jcut_timeline': ['skip_jcut'],
+    'determine_subtitles_video': ['skip_subtitles'],
+    'add_subtitles': ['skip_subtitles', 'words_by_subtitle', 'whisper_model'],
+}
+
+# The graph of per-file work replaces the steps from preprocess_videos to remove_wordless_clips
+STAGE_PARAMETERS['process_files'] = sorted({
+    arg
+    for stage in ['preprocess_videos', 'determine_input_folder', 'create_timeline', 'generate_proxies', 'remove_silence', 'remove_wordless_clips']
+    for arg in STAGE_PARAMETERS[stage]
+})
+
+# Steps that always run when resuming, so their outputs are written again even if they were removed
+ALWAYS_RUN_STAGES = ['generate_fcpxml_file']
+
+# Attributes of the Orchestrator saved in each checkpoint
+CHECKPOINT_ATTRIBUTES = [
+    'input_folder',
+    'input_video',
+    'subtitles_video',
+    'preprocess_feat',
+    'concatenate_feat',
+    'remove_silence_feat',
+    'remove_wordless_feat',
+    'jcut_feat',
+    'subway_surfers_feat',
+    'preview_audio_feat',
+    'proxy_media_feat',
+    'generate_subtitles_feat',
+    'timeline',
+    'edit_transforms',
+]
 
 
 class Orchestrator:
@@ -21,6 +77,7 @@ class Orchestrator:
         self.input_folder = None
         self.input_video = None
         self.subtitles_video = None
+        self.subtitles_audio = None
 
         # Features
         self.preprocess_feat: PreprocessVideos = None
@@ -29,29 +86,323 @@ class Orchestrator:
         self.remove_wordless_feat: RemoveWordless = None
         self.jcut_feat: JCut = None
         self.subway_surfers_feat: SubwaySurfers = None
+        self.preview_audio_feat: PreviewAudio = None
+        self.proxy_media_feat: ProxyMedia = None
         self.generate_subtitles_feat: GenerateSubtitles = None
 
         # Entities
         self.timeline = None
+        self.artifact_store: ArtifactStore = None
+
+        # Clip transforms of the editing stages, applied to the timeline in a single pass (see edit_timeline)
+        self.edit_transforms = []
+
+        # Checkpoints
+        self.checkpoint_store: CheckpointStore = None
+        self.last_fingerprint = None
+        self.resuming = False
+        self.resume_stage = None    # Last stage skipped while resuming, whose checkpoint is loaded
+
+        # Called with the name of each step that runs, returns a context manager around it (e.g. to wait for
+        # the resources of the step when many projects run at the same time)
+        self.stage_context = None
 
-    def parse_arguments(self):
+        # Same as stage_context, for the kind of each node of the per-file graph (--scheduler dag)
+        self.node_context = None
+
+    def parse_arguments(self, argv=None, artifact_store=None):
         """
-        Parse the arguments.
+        Parse the arguments (from the command line when `argv` is None).
+        An artifact store can be given to share it with other Orchestrators (e.g. the jobs of a batch).
         """
         # Get arguments
         parser = argparse.ArgumentParser(description='Create FCPXML file.')
         parser.add_argument('input', type=str, help='Folder with the video files to be edited or a specific file.')
         parser.add_argument('--skip-preprocess', '-sp', action='store_true', help='Skip the preprocessing step.')
         parser.add_argument('--already-preprocessed', '-ap', action='store_true', help='Use this flag if the videos are already preprocessed.')
+        parser.add_argument('--native-frame-rates', action='store_true', help='Keep the frame rate of CFR videos (e.g. 29.97) when preprocessing, instead of re-encoding all videos to a common one.')
         parser.add_argument('--just-subtitles', '-js', action='store_true', help='Just add subtitles to video.')
         parser.add_argument('--skip-subtitles', '-ss', action='store_true', help='Skip the subtitles step.')
         parser.add_argument('--skip-jcut', '-sj', action='store_true', help='Skip the J-Cut step.')
         parser.add_argument('--just-remove-silence', '-jrs', action='store_true', help='Remove only silent clips from video instead of all wordless clips.')
+        parser.add_argument('--min-speech-ratio', type=float, default=0.0, help='Min ratio (0 to 1) of a clip that must have speech for it to be kept. By default, any speech keeps the clip.')
         parser.add_argument('--words-by-subtitle', '-wbs', type=int, default=1, help='Number of words by subtitle group.')
+        parser.add_argument('--whisper-model', type=str, default='small', help='Whisper model used to transcribe the videos. "stub" marks loud audio as speech without loading a model (for benchmarks).')
+        parser.add_argument('--whisper-device', type=str, default=None, help='Device where the Whisper model is loaded (e.g. cpu, cuda). Defaults to a GPU when available.')
+        parser.add_argument('--transcription-jobs', type=int, default=None, help='Number of videos transcribed at the same time. Defaults to a value based on CPUs and available memory.')
+        parser.add_argument('--jobs', '-j', type=int, default=None, help='Number of videos processed at the same time. Defaults to a value based on the number of CPUs.')
+        parser.add_argument('--job-timeout', type=float, default=None, help='Max duration in seconds of each auto-editor call (or audio decode with --silence-backend native) of the silence detection.')
+        parser.add_argument('--silence-backend', choices=['auto-editor', 'native'], default='auto-editor', help='Engine used to detect silent parts. "native" analyses the audio in-process with NumPy.')
+        parser.add_argument('--silence-threshold', type=float, default=-28.0, help='Loudness threshold in dB relative to the loudest frame. Used by the native silence backend.')
+        parser.add_argument('--proxies', action='store_true', help='Generate low resolution proxies (in the proxies folder) and link them from the FCPXML file for smoother editing.')
+        parser.add_argument('--proxy-height', type=int, default=540, help='Height in pixels of the proxies.')
+        parser.add_argument('--relink-originals', action='store_true', help='Link only the original media, e.g. for the final export of a timeline edited with proxies.')
+        parser.add_argument('--compact-fcpxml', action='store_true', help='Write the FCPXML file without indentation (smaller and faster for very large timelines).')
+        parser.add_argument('--gzip-fcpxml', action='store_true', help='Write the FCPXML file gzip compressed (timeline.fcpxml.gz), e.g. for archives.')
+        parser.add_argument('--no-cache', action='store_true', help='Don\'t reuse probes, loud maps and transcriptions from previous runs.')
+        parser.add_argument('--cache-dir', type=str, default=None, help='Folder of the artifact store. Defaults to ~/.cache/video_editor.')
+        parser.add_argument('--cache-size', type=float, default=DEFAULT_MAX_SIZE / 1024 ** 3, help='Size cap of the artifact store in GB.')
+        parser.add_argument('--trace', type=str, default=None, help='Record a span for each stage and external call (ffmpeg, Whisper, ...), save them to this Chrome trace / Perfetto JSON file and print a summary.')
+        parser.add_argument('--profile-stage', type=str, default=None, help='Profile a stage, by the name of its orchestrator step (e.g. remove_silence).')
+        parser.add_argument('--profiler', choices=['cprofile', 'sampling'], default='cprofile', help='Profiler used by --profile-stage. "sampling" has almost no overhead on long stages.')
+        parser.add_argument('--scheduler', choices=['sequential', 'dag'], default='sequential', help='How the steps run. "dag" runs the per-file work (preprocessing, probes, proxies, loud maps and transcriptions) as a dependency graph, so the work of different files overlaps.')
+        parser.add_argument('--resume', action='store_true', help='Skip the stages whose checkpoint (in the checkpoints folder) is still valid and continue from the last one.')
+        parser.add_argument('--no-checkpoints', action='store_true', help='Don\'t save the pipeline state after each stage.')
 
         # Parse the arguments
-        self.args = parser.parse_args()
+        self.args = parser.parse_args(argv)
+
+        # Create the artifact store shared by all features
+        if artifact_store is not None:
+            self.artifact_store = artifact_store
+        elif not self.args.no_cache:
+            self.artifact_store = ArtifactStore(self.args.cache_dir, max_size=int(self.args.cache_size * 1024 ** 3))
+
+        # Create the checkpoint store, next to the input videos
+        if not self.args.no_checkpoints:
+            self.checkpoint_store = CheckpointStore(
+                os.path.join(self.get_input_root(), 'checkpoints'),
+                artifact_store=self.artifact_store
+            )
+            self.resuming = self.args.resume
+        elif self.args.resume:
+            print("Checkpoints are disabled (--no-checkpoints), so all stages will run.")
     
+    def start_tracing(self):
+        """
+        Start recording spans when a trace file is requested.
+        """
+        if self.args.trace is None: return
+
+        tracer.start()
+
+    def finish_tracing(self):
+        """
+        Save the trace and print its summary.
+        """
+        if self.args is None or self.args.trace is None: return
+
+        tracer.stop()
+        tracer.export_chrome_trace(self.args.trace)
+        tracer.print_summary()
+        print(f"Trace saved to {self.args.trace}")
+
+    def get_timeline_stats(self):
+        """
+        Get the duration of the source media (in seconds) and the number of clips of the timeline.
+        """
+        if self.timeline is None:
+            return {}
+
+        return {
+            'media_duration': float(sum(asset.num_frames / asset.fps for asset in self.timeline.get_assets())),
+            'clips': sum(len(clips) for clips in self.timeline.video_assets.values()),
+        }
+
+    def get_input_root(self):
+        """
+        Get the folder of the input videos (or of the input file).
+        """
+        if os.path.isfile(self.args.input):
+            return os.path.dirname(os.path.abspath(self.args.input))
+
+        return self.args.input
+
+    def get_source_files(self):
+        """
+        Get the source videos of the pipeline.
+        """
+        if os.path.isfile(self.args.input):
+            return [self.args.input]
+
+        return [video for video in get_video_files(self.args.input) if os.path.isfile(video)]
+
+    def get_stage_fingerprint(self, name):
+        """
+        Get the fingerprint of a step, chained to the fingerprint of the previous one.
+        """
+        params = {arg: getattr(self.args, arg) for arg in STAGE_PARAMETERS.get(name, [])}
+
+        # The first step also depends on the source videos
+        if self.last_fingerprint is None:
+            params['sources'] = get_sources_signature(self.get_source_files())
+
+        return get_fingerprint(self.last_fingerprint, name, params)
+
+    def get_checkpoint_state(self):
+        """
+        Get the state of the pipeline saved in a checkpoint.
+        """
+        state = {attribute: getattr(self, attribute) for attribute in CHECKPOINT_ATTRIBUTES}
+
+        # Loud maps are files, so they're saved too in case the remove_silence folder is removed
+        if self.remove_silence_feat is not None:
+            state['loud_maps'] = self.remove_silence_feat.get_loud_maps()
+
+        return state
+
+    def restore_checkpoint_state(self, state):
+        """
+        Restore the state of the pipeline from a checkpoint.
+        """
+        for attribute in CHECKPOINT_ATTRIBUTES:
+            setattr(self, attribute, state[attribute])
+
+        if self.remove_silence_feat is not None:
+            self.remove_silence_feat.restore_loud_maps(state.get('loud_maps', {}))
+
+    def run_stage(self, step):
+        """
+        Run an orchestrator step (e.g. self.remove_silence) as a traced stage, profiling it when requested.
+        """
+        """
+        NOTE:
+            - The state is saved after each step. With --resume, steps are skipped while their checkpoint is
+              still valid, and the checkpoint of the last skipped step is loaded before running the next one.
+        """
+        name = step.__name__
+        fingerprint = None
+        if self.checkpoint_store is not None:
+            fingerprint = self.get_stage_fingerprint(name)
+
+            # Skip the step while its checkpoint is still valid
+            if (
+                self.resuming
+                and name not in ALWAYS_RUN_STAGES
+                and self.checkpoint_store.has_checkpoint(name, fingerprint)
+            ):
+                print(f"Skipping {name} (checkpoint is up to date)")
+                self.resume_stage = name
+                self.last_fingerprint = fingerprint
+                return
+
+            # Load the state of the last skipped step before running the first stale one
+            if self.resuming:
+                self.resuming = False
+                if self.resume_stage is not None:
+                    print(f"Resuming from the checkpoint of {self.resume_stage}...")
+                    with tracer.span('checkpoint load', 'checkpoint', stage=self.resume_stage):
+                        self.restore_checkpoint_state(self.checkpoint_store.load(self.resume_stage))
+
+        stage_context = self.stage_context(name) if self.stage_context is not None else nullcontext()
+        with stage_context, tracer.span(name, 'stage') as span_args:
+            if self.args.profile_stage == name:
+                with profile(name, self.args.profiler):
+                    step()
+            else:
+                step()
+
+            span_args.update(self.get_timeline_stats())
+
+        # Save the state after the step
+        if self.checkpoint_store is not None:
+            with tracer.span('checkpoint save', 'checkpoint', stage=name):
+                self.checkpoint_store.save(name, fingerprint, self.get_checkpoint_state())
+            self.last_fingerprint = fingerprint
+
+    def run_pipeline(self):
+        """
+        Run all steps, from preprocessing the videos to creating the FCPXML file.
+        """
+        # Reserve Whisper models for the stages that will use them
+        self.reserve_whisper_models()
+
+        if self.args.scheduler == 'dag' and not self.args.just_subtitles:
+            # Run the per-file work of the steps below as a dependency graph
+            self.run_stage(self.process_files)
+        else:
+            # Preprocess videos
+            self.run_stage(self.preprocess_videos)
+
+            # Determine input folder
+            self.run_stage(self.determine_input_folder)
+
+            # Create the Timeline object
+            self.run_stage(self.create_timeline)
+
+            # Concatenate files
+            self.run_stage(self.concatenate_files)
+
+            # Generate proxies of the videos
+            self.run_stage(self.generate_proxies)
+
+            # Remove silent parts
+            self.run_stage(self.remove_silence)
+
+            # Remove Wordless clips
+            self.run_stage(self.remove_wordless_clips)
+
+        # Apply J-Cut to the timeline
+        self.run_stage(self.jcut_timeline)
+
+        # Apply the editing stages to the timeline in a single pass
+        self.run_stage(self.edit_timeline)
+
+        # Add Subway Surfers to the video
+        self.run_stage(self.add_subway_surfers)
+
+        # Add subtitles
+        self.run_stage(self.determine_subtitles_video)
+        self.run_stage(self.add_subtitles)
+
+        # Create the FCPXML file
+        self.run_stage(self.generate_fcpxml_file)
+
+    def reserve_whisper_models(self):
+        """
+        Reserve the Whisper model for every stage that will use it, so it's loaded once and shared by them.
+        """
+        # Remove wordless clips stage
+        if not self.args.just_subtitles and not self.args.just_remove_silence:
+            whisper_models.reserve(self.args.whisper_model, self.args.whisper_device)
+
+        # Add subtitles stage (it transcribes the given video or the audio preview of the timeline)
+        if (self.args.just_subtitles or self.args.just_remove_silence) and not self.args.skip_subtitles:
+            whisper_models.reserve(self.args.whisper_model, self.args.whisper_device)
+
+    def create_preprocess_feat(self) -> PreprocessVideos:
+        return PreprocessVideos(
+            self.args.input,
+            jobs=self.args.jobs,
+            artifact_store=self.artifact_store,
+            native_frame_rates=self.args.native_frame_rates
+        )
+
+    def create_concatenate_feat(self) -> Concatenate:
+        return Concatenate(self.timeline, self.input_folder, artifact_store=self.artifact_store, jobs=self.args.jobs)
+
+    def create_proxy_media_feat(self) -> ProxyMedia:
+        return ProxyMedia(
+            self.timeline,
+            self.input_folder,
+            height=self.args.proxy_height,
+            jobs=self.args.jobs,
+            artifact_store=self.artifact_store
+        )
+
+    def create_remove_silence_feat(self) -> RemoveSilence:
+        return RemoveSilence(
+            self.timeline,
+            self.input_folder,
+            artifact_store=self.artifact_store,
+            backend=self.args.silence_backend,
+            threshold_db=self.args.silence_threshold,
+            jobs=self.args.jobs,
+            timeout=self.args.job_timeout
+        )
+
+    def create_remove_wordless_feat(self) -> RemoveWordless:
+        return RemoveWordless(
+            self.timeline,
+            self.input_folder,
+            model=self.args.whisper_model,
+            device=self.args.whisper_device,
+            artifact_store=self.artifact_store,
+            remove_silence=self.remove_silence_feat,
+            workers=self.args.transcription_jobs,
+            min_speech_ratio=self.args.min_speech_ratio
+        )
+
     def preprocess_videos(self):
         """
         Preprocess the videos.
@@ -59,7 +410,7 @@ class Orchestrator:
         if self.args.just_subtitles: return
         if self.args.skip_preprocess: return 
 
-        self.preprocess_feat = PreprocessVideos(self.args.input)
+        self.preprocess_feat = self.create_preprocess_feat()
 
         if self.args.already_preprocessed: return
 
@@ -89,7 +440,11 @@ class Orchestrator:
         """
         if self.args.just_subtitles: return
 
-        self.timeline = Timeline(self.input_folder)
+        self.timeline = Timeline(
+            self.input_folder,
+            pretty_print=not self.args.compact_fcpxml,
+            compress=self.args.gzip_fcpxml
+        )
     
     def concatenate_files(self):
         """
@@ -97,22 +452,201 @@ class Orchestrator:
         """
         if self.args.just_subtitles: return
 
-        self.concatenate_feat = Concatenate(self.timeline, self.input_folder)
+        self.concatenate_feat = self.create_concatenate_feat()
         self.concatenate_feat.concatenate_video_files()
         
+    def generate_proxies(self):
+        """
+        Generate proxies of the videos and link them from the timeline.
+        """
+        if not self.args.proxies: return
+        if self.args.just_subtitles: return
+
+        # Proxies are kept in the proxies folder, so they're reused when the timeline is linked to them again
+        if self.args.relink_originals:
+            print("Linking original media only...")
+            return
+
+        print("Generating proxies...")
+        self.proxy_media_feat = self.create_proxy_media_feat()
+        self.proxy_media_feat.generate_proxies()
+
     def remove_silence(self):
         """
         Remove silent parts.
         """
         if self.args.just_subtitles: return
 
-        self.remove_silence_feat = RemoveSilence(self.timeline, self.input_folder)
+        self.remove_silence_feat = self.create_remove_silence_feat()
         self.remove_silence_feat.generate_loud_map_for_each_video_in_folder()
-        self.remove_silence_feat.cut_clips()
+        self.edit_transforms.append(self.remove_silence_feat.split_clips)
         # TODO: Implement the following method
         # This should remove silent parts from the video when remove wordless clips will be skipped
         # self.remove_silence_feat.remove_silence()
     
+    def process_files(self):
+        """
+        Preprocess, probe and concatenate the videos and generate their proxies, loud maps and transcriptions as a
+        dependency graph of per-file nodes (see utils/scheduler.py), so the work of different files overlaps.
+        """
+        """
+        NOTE:
+            - A video is encoded while the previous ones are loud mapped and transcribed, and probes run as soon as
+              their video exists. Only planning the preprocessing (it needs the frame rates of all videos) and
+              concatenating (it needs the probes of all videos) wait for all files.
+            - Transcriptions run in this process, one at a time, with the shared model.
+            - The timeline is the same as with the sequential steps.
+        """
+        # Create the features of the per-file work
+        source_paths = []
+        if not self.args.skip_preprocess:
+            self.preprocess_feat = self.create_preprocess_feat()
+            if not self.args.already_preprocessed:
+                source_paths = self.preprocess_feat.get_video_paths()
+
+        self.determine_input_folder()
+        self.create_timeline()
+        self.concatenate_feat = self.create_concatenate_feat()
+        self.remove_silence_feat = self.create_remove_silence_feat()
+        if not self.args.just_remove_silence:
+            self.remove_wordless_feat = self.create_remove_wordless_feat()
+        if self.args.proxies and not self.args.relink_originals:
+            self.proxy_media_feat = self.create_proxy_media_feat()
+
+        # Get the videos of the timeline, including the ones that will only exist once they're preprocessed
+        if source_paths:
+            os.makedirs(self.preprocess_feat.preprocessed_folder, exist_ok=True)
+        sources_by_output = {os.path.abspath(self.preprocess_feat.get_output_path(path)): path for path in source_paths}
+        video_files = set(path for path in sources_by_output if is_video_file(path))
+        video_files.update(video for video in get_video_files(self.input_folder) if os.path.isfile(video))
+        video_files = sorted(video_files)
+
+        # Build the graph
+        graph = DagScheduler(slots=self.get_graph_slots(max(len(source_paths), len(video_files))), node_context=self.node_context)
+        if source_paths:
+            self.add_preprocess_nodes(graph, source_paths)
+        self.add_file_nodes(graph, video_files, sources_by_output)
+
+        print(f"Processing {len(video_files)} videos as a graph of {len(graph.nodes)} nodes...")
+        try:
+            graph.run()
+        finally:
+            # The transcriptions are done, even when some of them failed
+            if self.remove_wordless_feat is not None:
+                self.remove_wordless_feat.release_model()
+
+        # Print the output of the loud maps in the order of the videos, as the sequential step does
+        for video in video_files:
+            node = f"loud map {os.path.basename(video)}"
+            if graph.succeeded(node):
+                print(graph.get_value(node))
+        graph.print_timings()
+
+        # Record the preprocessed videos, even when some of them failed
+        if source_paths and graph.succeeded('plan preprocessing'):
+            self.preprocess_feat.finish_preprocessing(
+                graph.get_value('plan preprocessing'),
+                [graph.get_job_result(f"preprocess {os.path.basename(path)}", path) for path in source_paths],
+                [graph.get_value(f"probe source {os.path.basename(path)}") for path in source_paths]
+            )
+        graph.raise_for_errors()
+
+        # Link the proxies from the assets
+        if self.proxy_media_feat is not None:
+            self.proxy_media_feat.link_proxies([
+                graph.get_job_result(f"proxy {asset.filename}", asset) for asset in self.timeline.get_assets()
+            ])
+
+        # Prepare the clip transforms, in the same order as the sequential steps
+        self.edit_transforms.append(self.remove_silence_feat.split_clips)
+        if self.remove_wordless_feat is not None:
+            self.remove_wordless_feat.set_transcriptions([
+                stable_whisper.WhisperResult(graph.get_value(f"transcribe {os.path.basename(video)}")) for video in video_files
+            ])
+            self.edit_transforms.append(self.remove_wordless_feat.filter_clips)
+
+    def get_graph_slots(self, num_files):
+        """
+        Get how many nodes of each kind of the per-file graph can run at the same time.
+        """
+        return {
+            'probe': self.args.jobs or get_default_jobs(num_files),
+            'encode': self.args.jobs or get_default_jobs(num_files, threads_per_job=2),
+            'analysis': self.args.jobs or get_default_jobs(num_files),
+            'whisper': 1,
+        }
+
+    def add_preprocess_nodes(self, graph: DagScheduler, source_paths):
+        """
+        Add the nodes that probe the source videos, plan their preprocessing and preprocess each one of them.
+        """
+        probe_nodes = [
+            graph.add(f"probe source {os.path.basename(path)}", partial(probe_video, path, self.artifact_store), kind='probe')
+            for path in source_paths
+        ]
+        graph.add(
+            'plan preprocessing',
+            lambda: self.preprocess_feat.plan_preprocessing(source_paths, [graph.get_value(node) for node in probe_nodes]),
+            probe_nodes
+        )
+
+        for path in source_paths:
+            graph.add(
+                f"preprocess {os.path.basename(path)}",
+                lambda path=path: self.preprocess_feat.preprocess_planned_video(path, graph.get_value('plan preprocessing')),
+                ['plan preprocessing'],
+                kind='encode'
+            )
+
+    def add_file_nodes(self, graph: DagScheduler, video_files, sources_by_output):
+        """
+        Add the nodes that probe, loud map, transcribe and generate the proxy of each video, and the node that
+        concatenates all videos in the timeline.
+        """
+        os.makedirs(self.remove_silence_feat.loud_maps_folder, exist_ok=True)
+
+        probe_nodes = []
+        for video_path in video_files:
+            name = os.path.basename(video_path)
+
+            # Videos that are preprocessed in this run can only be used once they're written
+            dependencies = []
+            if video_path in sources_by_output:
+                dependencies.append(f"preprocess {os.path.basename(sources_by_output[video_path])}")
+
+            probe_nodes.append(graph.add(f"probe {name}", partial(probe_video, video_path, self.artifact_store), dependencies, kind='probe'))
+            graph.add(f"loud map {name}", partial(self.generate_loud_map, video_path), dependencies, kind='analysis')
+            if self.remove_wordless_feat is not None:
+                graph.add(f"transcribe {name}", partial(self.remove_wordless_feat.transcribe_video, video_path), [f"loud map {name}"], kind='whisper')
+
+        # Build the timeline once all videos are probed
+        graph.add(
+            'concatenate',
+            lambda: self.concatenate_feat.concatenate_video_files([graph.get_value(node) for node in probe_nodes]),
+            probe_nodes
+        )
+
+        # Proxies need the assets of the timeline
+        if self.proxy_media_feat is not None:
+            os.makedirs(self.proxy_media_feat.proxies_folder, exist_ok=True)
+            self.proxy_media_feat.threads_per_job = get_threads_per_job(graph.slots['encode'])
+            for video_path in video_files:
+                name = os.path.basename(video_path)
+                graph.add(f"proxy {name}", partial(self.generate_proxy, name), ['concatenate'], kind='encode')
+
+    def generate_loud_map(self, video_path):
+        """
+        Generate the loud map of a video (a node of the per-file graph) and return its output.
+        """
+        return self.remove_silence_feat.generate_video_loud_map(video_path, self.remove_silence_feat.get_video_name(video_path))
+
+    def generate_proxy(self, filename):
+        """
+        Generate the proxy of the asset of a video (a node of the per-file graph).
+        """
+        asset = next(asset for asset in self.timeline.get_assets() if asset.filename == filename)
+        return self.proxy_media_feat.generate_proxy(asset)
+
     def jcut_timeline(self):
         """
         Apply J-Cut to the timeline.
@@ -121,17 +655,40 @@ class Orchestrator:
         if self.args.just_subtitles: return
 
         self.jcut_feat = JCut(self.timeline)
-        self.jcut_feat.jcut_timeline()
+        self.edit_transforms.append(self.jcut_feat.jcut_clips)
+
+    def edit_timeline(self):
+        """
+        Apply the editing stages (remove silence, remove wordless clips and J-Cut) to the timeline.
+
+        NOTE:
+            - Each stage only prepares its data (loud maps, transcriptions, ...) and a clip transform. The
+              transforms are chained here, so every clip flows through all stages in a single pass and the
+              timeline is only rebuilt once.
+        """
+        if self.args.just_subtitles: return
+
+        print("Editing timeline...")
+        self.timeline.run_edit_pipeline(self.edit_transforms)
 
     def determine_subtitles_video(self):
         """
         Determine the video to add subtitles.
         """
+        """
+        NOTE:
+            - Without source transcriptions (--just-remove-silence), the audio preview of the timeline is
+              rendered and transcribed instead.
+        """
         if self.args.just_subtitles:
             self.subtitles_video = self.input_video
             return
 
-        self.subtitles_video = self.remove_silence_feat.preview_final_video
+        if self.args.skip_subtitles or self.remove_wordless_feat is not None: return
+
+        self.preview_audio_feat = PreviewAudio(self.timeline, self.input_folder, artifact_store=self.artifact_store)
+        self.subtitles_audio = self.preview_audio_feat.render_preview()
+        self.subtitles_video = self.preview_audio_feat.preview_file
     
     def remove_wordless_clips(self):
         """
@@ -141,8 +698,9 @@ class Orchestrator:
         if self.args.just_subtitles: return
 
         print("Removing wordless clips...")
-        self.remove_wordless_feat = RemoveWordless(self.timeline, self.input_folder)
-        self.remove_wordless_feat.remove_wordless_clips()
+        self.remove_wordless_feat = self.create_remove_wordless_feat()
+        self.remove_wordless_feat.transcribe_all_videos()
+        self.edit_transforms.append(self.remove_wordless_feat.filter_clips)
     
     def add_subway_surfers(self):
         """
@@ -151,7 +709,7 @@ class Orchestrator:
         if self.args.just_subtitles: return
 
         print("Adding Subway Surfers...")
-        self.subway_surfers_feat = SubwaySurfers(self.timeline)
+        self.subway_surfers_feat = SubwaySurfers(self.timeline, artifact_store=self.artifact_store)
         self.subway_surfers_feat.add_subway_surfers()
     
     def add_subtitles(self):
@@ -160,18 +718,33 @@ class Orchestrator:
         """
         """
         NOTE:
-            - Subtitles to a jcutted video is not implemented yet. To add subtitles to a jcutted video, you need to
-              generate the final final video in the video editor and then run the program with the --just-subtitles flag.
+            - With the --just-subtitles flag, the given (already rendered) video is transcribed.
+            - Otherwise, subtitles are built from the transcriptions of the source videos made while removing
+              wordless clips, mapped through the final timeline clips (J-Cut included). So no video needs to
+              be rendered nor transcribed again.
+            - With the --just-remove-silence flag, the audio preview of the timeline is transcribed.
         """
-        if not self.args.just_subtitles: return
         if self.args.skip_subtitles: return
 
-        if not self.args.just_subtitles:
-            self.remove_silence_feat.generate_final_preview_video()
-
         print("Adding subtitles...")
-        self.generate_subtitles_feat = GenerateSubtitles(self.input_folder, self.subtitles_video, words_by_group=self.args.words_by_subtitle)
-        self.generate_subtitles_feat.generate_subtitles()
+        self.generate_subtitles_feat = GenerateSubtitles(
+            self.input_folder,
+            self.subtitles_video,
+            model=self.args.whisper_model,
+            device=self.args.whisper_device,
+            words_by_group=self.args.words_by_subtitle,
+            artifact_store=self.artifact_store
+        )
+
+        # Transcribe the given video or the audio preview of the timeline
+        if self.args.just_subtitles or self.remove_wordless_feat is None:
+            self.generate_subtitles_feat.generate_subtitles(audio=self.subtitles_audio)
+            return
+
+        self.generate_subtitles_feat.generate_subtitles_from_timeline(
+            self.timeline,
+            self.remove_wordless_feat.transcriptions_by_ref
+        )
     
     def generate_fcpxml_file(self):
         """
@@ -0,0 +1,363 @@
+"""
+Local content-addressed store for artifacts that are expensive to compute (probes, loud maps, transcriptions, ...).
+
+Artifacts are keyed by the content hash of the source file plus the parameters used to produce them, so they
+survive re-runs, renames and re-encodes that produce the same bytes. Hashing a large video is slow, so the
+content hash of each file is memoized by its (path, size, mtime, inode) and only recomputed when one of them changes.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+
+DEFAULT_CACHE_FOLDER = os.path.join(os.path.expanduser('~'), '.cache', 'video_editor')
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3  # 10 GB
+HASH_CHUNK_SIZE = 4 * 1024 ** 2  # 4 MB
+
+
+class ArtifactStore:
+    def __init__(self, root=None, max_size=DEFAULT_MAX_SIZE):
+        self.root = root or os.environ.get('VIDEO_EDITOR_CACHE', DEFAULT_CACHE_FOLDER)
+        self.objects_folder = os.path.join(self.root, 'objects')
+        self.fingerprints_file = os.path.join(self.root, 'fingerprints.json')
+        self.max_size = max_size
+
+        # Stages may use the store from many threads at the same time
+        self.lock = threading.Lock()
+        self.fingerprints: Dict[str, str] = self.load_fingerprints()
+
+        # Running total of the size of the artifacts, so the store is only walked when it's over the cap.
+        # It's computed on the first write and recomputed on every prune
+        self.prune_lock = threading.RLock()
+        self.size: Optional[int] = None
+
+        # Number of users of each pinned artifact. Pinned artifacts are in use (e.g. audio read by a transcription)
+        # and are never evicted
+        self.pins: Dict[str, int] = {}
+
+    def load_fingerprints(self) -> Dict[str, str]:
+        """
+        Load the memoized content hashes of the source files.
+        """
+        if not os.path.exists(self.fingerprints_file):
+            return {}
+
+        try:
+            with open(self.fingerprints_file, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            # A corrupted index only costs rehashing the files
+            return {}
+
+    def save_fingerprints(self):
+        """
+        Save the memoized content hashes of the source files.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        self.write_atomically(self.fingerprints_file, json.dumps(self.fingerprints).encode('utf-8'))
+
+    def write_atomically(self, path, data: bytes):
+        """
+        Write a file without ever leaving a partially written version behind.
+        """
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+
+    def get_file_hash(self, file_path) -> str:
+        """
+        Hash the whole content of a file.
+        """
+        file_hash = hashlib.blake2b(digest_size=20)
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+                file_hash.update(chunk)
+
+        return file_hash.hexdigest()
+
+    def get_source_fingerprint(self, source_path) -> str:
+        """
+        Get the content hash of a source file.
+
+        NOTE:
+            - The hash is memoized by path, size, mtime and inode. This is the fast path used on every run, so
+              the file is only read again when it changes.
+            - Only the hash of the current version of each file is kept (see `prune_fingerprints`).
+        """
+        source_path = os.path.abspath(source_path)
+        stat = os.stat(source_path)
+        stat_key = f"{source_path}|{stat.st_size}|{stat.st_mtime_ns}|{stat.st_ino}"
+
+        with self.lock:
+            if stat_key in self.fingerprints:
+                return self.fingerprints[stat_key]
+
+        fingerprint = self.get_file_hash(source_path)
+
+        with self.lock:
+            # Forget the hashes of the previous versions of the file
+            self.fingerprints = {
+                key: value for key, value in self.fingerprints.items() if self.get_fingerprint_path(key) != source_path
+            }
+            self.fingerprints[stat_key] = fingerprint
+            self.save_fingerprints()
+
+        return fingerprint
+
+    def get_fingerprint_path(self, stat_key) -> str:
+        """
+        Get the source path of a memoized hash from its (path, size, mtime, inode) key.
+        """
+        return stat_key.rsplit('|', 3)[0]
+
+    def prune_fingerprints(self) -> int:
+        """
+        Forget the memoized hashes of source files that don't exist anymore. Returns the number of forgotten hashes.
+        """
+        with self.lock:
+            fingerprints = {
+                key: value for key, value in self.fingerprints.items()
+                if os.path.exists(self.get_fingerprint_path(key))
+            }
+            removed_count = len(self.fingerprints) - len(fingerprints)
+            if removed_count:
+                self.fingerprints = fingerprints
+                self.save_fingerprints()
+
+        return removed_count
+
+    def get_artifact_key(self, kind, source_path, params: Dict[str, Any]) -> str:
+        """
+        Get the key of an artifact based on its source content and the parameters used to produce it.
+        """
+        key_data = json.dumps({
+            'kind': kind,
+            'source': self.get_source_fingerprint(source_path),
+            'params': params,
+        }, sort_keys=True, default=str)
+
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get_artifact_path(self, kind, key, extension='.json') -> str:
+        """
+        Get the path of an artifact inside the store.
+        """
+        return os.path.join(self.objects_folder, kind, key[:2], f"{key}{extension}")
+
+    def get_json(self, kind, source_path, **params) -> Optional[Any]:
+        """
+        Get a JSON artifact, or None if it was never stored.
+        """
+        key = self.get_artifact_key(kind, source_path, params)
+        artifact_path = self.get_artifact_path(kind, key)
+
+        try:
+            with open(artifact_path, 'r', encoding='utf-8') as file:
+                artifact = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            # Mark the artifact as recently used (LRU eviction is based on mtime)
+            os.utime(artifact_path)
+        except FileNotFoundError:
+            # Evicted by another thread or process after it was read, the content is still valid
+            pass
+
+        return artifact
+
+    def put_json(self, kind, source_path, artifact, **params):
+        """
+        Store a JSON artifact.
+        """
+        key = self.get_artifact_key(kind, source_path, params)
+        artifact_path = self.get_artifact_path(kind, key)
+
+        os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+        previous_size = self.get_size(artifact_path)
+        self.write_atomically(artifact_path, json.dumps(artifact).encode('utf-8'))
+        self.add_artifact_size(artifact_path, previous_size)
+
+    def get_file(self, kind, source_path, extension, pin=False, **params) -> Optional[str]:
+        """
+        Get the path of a file artifact, or None if it was never stored.
+        With `pin`, the artifact isn't evicted until it's unpinned (see `unpin`).
+        """
+        key = self.get_artifact_key(kind, source_path, params)
+        artifact_path = self.get_artifact_path(kind, key, extension)
+
+        # Hold the prune lock, so the artifact can't be evicted between the lookup and the pin
+        with self.prune_lock:
+            try:
+                # Mark the artifact as recently used (LRU eviction is based on mtime)
+                os.utime(artifact_path)
+            except FileNotFoundError:
+                return None
+
+            if pin:
+                self.pin(artifact_path)
+
+        return artifact_path
+
+    def get_temporary_path(self, extension) -> str:
+        """
+        Get a path, inside the store, where a file artifact can be written before being stored with `put_file`.
+        """
+        os.makedirs(self.objects_folder, exist_ok=True)
+        return os.path.join(self.objects_folder, f"{os.getpid()}.{threading.get_ident()}{extension}.tmp")
+
+    def put_file(self, kind, source_path, file_path, extension, pin=False, **params) -> str:
+        """
+        Move a file into the store as an artifact and return its new path.
+        With `pin`, the artifact isn't evicted until it's unpinned (see `unpin`).
+        """
+        key = self.get_artifact_key(kind, source_path, params)
+        artifact_path = self.get_artifact_path(kind, key, extension)
+
+        if pin:
+            self.pin(artifact_path)
+
+        os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+        previous_size = self.get_size(artifact_path)
+        os.replace(file_path, artifact_path)
+        self.add_artifact_size(artifact_path, previous_size)
+
+        return artifact_path
+
+    def pin(self, artifact_path):
+        """
+        Protect an artifact from eviction while it's in use. Each pin must be undone by a call to `unpin`.
+        """
+        with self.prune_lock:
+            self.pins[artifact_path] = self.pins.get(artifact_path, 0) + 1
+
+    def unpin(self, artifact_path):
+        """
+        Undo a pin of an artifact. It can be evicted again once all its pins are undone.
+        """
+        with self.prune_lock:
+            count = self.pins.get(artifact_path, 0) - 1
+            if count > 0:
+                self.pins[artifact_path] = count
+            else:
+                self.pins.pop(artifact_path, None)
+
+    def get_size(self, path) -> int:
+        """
+        Get the size of a file, or 0 if it doesn't exist.
+        """
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def add_artifact_size(self, artifact_path, previous_size):
+        """
+        Add an artifact that was just written (replacing `previous_size` bytes) to the size of the store, and
+        keep the store under its size cap without evicting that artifact.
+        """
+        if self.max_size is None:
+            return
+
+        size = self.get_size(artifact_path)
+        with self.prune_lock:
+            if self.size is None:
+                self.size = sum(entry_size for _, entry_size, _ in self.get_entries())
+            else:
+                self.size += size - previous_size
+
+            if self.size > self.max_size:
+                self.prune(self.max_size, keep=[artifact_path])
+
+    def get_entries(self) -> List[Tuple[str, int, float]]:
+        """
+        Get all stored artifacts as (path, size, last access time), least recently used first.
+        """
+        entries = []
+        if not os.path.isdir(self.objects_folder):
+            return entries
+
+        for folder, _, files in os.walk(self.objects_folder):
+            for file in files:
+                # Skip artifacts that are still being written
+                if file.endswith('.tmp'):
+                    continue
+
+                path = os.path.join(folder, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get the number and size of the stored artifacts by kind.
+        """
+        stats = {'root': self.root, 'count': 0, 'size': 0, 'max_size': self.max_size, 'kinds': {}}
+        for path, size, _ in self.get_entries():
+            kind = os.path.relpath(path, self.objects_folder).split(os.sep)[0]
+            kind_stats = stats['kinds'].setdefault(kind, {'count': 0, 'size': 0})
+            kind_stats['count'] += 1
+            kind_stats['size'] += size
+            stats['count'] += 1
+            stats['size'] += size
+
+        return stats
+
+    def prune(self, max_size, keep=()) -> Tuple[int, int]:
+        """
+        Evict the least recently used artifacts until the store is smaller than `max_size` bytes.
+        Returns the number of evicted artifacts and the number of bytes freed.
+
+        NOTE:
+            - Artifacts in `keep` are never evicted, so an artifact that was just stored is always there for the
+              caller, even when it alone is bigger than `max_size`. It's evicted by a later prune.
+            - Pinned artifacts are never evicted either. Pins only exist in this process, so readers must still
+              handle an artifact evicted by another process (e.g. `cache.py prune`).
+            - The store is walked again on every prune, so the running size also catches up with artifacts
+              written or removed by other processes.
+            - The memoized hashes of source files that don't exist anymore are forgotten too.
+        """
+        self.prune_fingerprints()
+
+        with self.prune_lock:
+            entries = self.get_entries()
+            total_size = sum(size for _, size, _ in entries)
+            keep = set(keep) | set(self.pins)
+
+            removed_count = 0
+            removed_size = 0
+            for path, size, _ in entries:
+                if total_size <= max_size:
+                    break
+                if path in keep:
+                    continue
+
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+                removed_count += 1
+                removed_size += size
+
+            self.size = total_size
+
+        return removed_count, removed_size
+
+    def clear(self):
+        """
+        Remove every artifact and memoized fingerprint.
+        """
+        shutil.rmtree(self.root, ignore_errors=True)
+        with self.lock:
+            self.fingerprints = {}
+        with self.prune_lock:
+            self.size = None
@@ -0,0 +1,134 @@
+"""
+Helpers to decode audio from video files through an ffmpeg pipe.
+"""
+import os
+import threading
+
+import ffmpeg
+import numpy as np
+
+from utils.tracing import tracer
+
+
+CACHE_SAMPLE_RATE = 16000  # Sample rate of the decoded audio shared by all stages (the one expected by Whisper)
+
+
+def stream_audio(video_path, sample_rate, chunk_samples, timeout=None):
+    """
+    Decode the audio of a video as mono 16-bit PCM and yield it in chunks of `chunk_samples` samples.
+
+    NOTE:
+        - Only one chunk is held in memory at a time, so this works for files of any length.
+        - The traced span includes the time the consumer spends on each chunk, as ffmpeg decodes meanwhile.
+        - ffmpeg is killed when the decode takes longer than `timeout` seconds (consumer time included).
+    """
+    with tracer.span('ffmpeg decode audio', 'ffmpeg', input=video_path) as span_args:
+        process = (
+            ffmpeg
+            .input(video_path)
+            .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate)
+            .global_args('-v', 'error', '-nostdin')
+            .run_async(pipe_stdout=True, pipe_stderr=True)
+        )
+
+        # Killing ffmpeg ends the reads below, even when it's stuck without any output
+        timed_out = threading.Event()
+        def kill():
+            timed_out.set()
+            process.kill()
+        timer = threading.Timer(timeout, kill) if timeout is not None else None
+        if timer is not None:
+            timer.start()
+
+        num_samples = 0
+        try:
+            chunk_bytes = chunk_samples * 2
+            while True:
+                data = process.stdout.read(chunk_bytes)
+                if not data:
+                    break
+                num_samples += len(data) // 2
+                yield np.frombuffer(data, dtype=np.int16)
+        finally:
+            process.stdout.close()
+            stderr = process.stderr.read()
+            process.stderr.close()
+            return_code = process.wait()
+            if timer is not None:
+                timer.cancel()
+            span_args['media_duration'] = num_samples / sample_rate
+
+    if timed_out.is_set():
+        raise RuntimeError(f"FFmpeg timed out after {timeout}s for {video_path}")
+    if return_code != 0:
+        raise RuntimeError(f"FFmpeg error: {stderr.decode(errors='replace')}")
+
+
+def decode_audio(video_path, sample_rate, timeout=None) -> np.ndarray:
+    """
+    Decode the whole audio of a video as mono 16-bit PCM.
+    """
+    chunks = list(stream_audio(video_path, sample_rate, sample_rate * 60, timeout=timeout))
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int16)
+
+
+def write_audio(video_path, output_path, sample_rate, timeout=None):
+    """
+    Decode the audio of a video to a raw mono 16-bit PCM file.
+    """
+    with open(output_path, 'wb') as file:
+        for chunk in stream_audio(video_path, sample_rate, sample_rate * 60, timeout=timeout):
+            file.write(chunk.tobytes())
+
+
+def open_audio_file(audio_path) -> np.ndarray:
+    """
+    Memory-map a raw mono 16-bit PCM file. Only the parts of the audio that are read are loaded from disk.
+    """
+    # np.memmap doesn't support empty files
+    if os.path.getsize(audio_path) == 0:
+        return np.empty(0, dtype=np.int16)
+
+    return np.memmap(audio_path, dtype=np.int16, mode='r')
+
+
+def get_audio_file(video_path, artifact_store, pin=False, timeout=None) -> str:
+    """
+    Get the path of the decoded audio of a video in the artifact store, decoding it if it isn't there yet.
+
+    NOTE:
+        - Audio is decoded once at CACHE_SAMPLE_RATE and shared by every analysis stage (loud maps,
+          transcriptions, ...). It's decoded again only when the content of the video changes.
+        - Other stages may evict the file from the store at any time. With `pin`, it's kept until
+          `artifact_store.unpin(audio_path)` is called, so it can be opened later (e.g. by a worker process).
+        - `timeout` is the max duration (in seconds) of the decode.
+    """
+    audio_path = artifact_store.get_file('audio', video_path, '.pcm', pin=pin, sample_rate=CACHE_SAMPLE_RATE)
+    if audio_path is not None:
+        return audio_path
+
+    temporary_path = artifact_store.get_temporary_path('.pcm')
+    try:
+        write_audio(video_path, temporary_path, CACHE_SAMPLE_RATE, timeout=timeout)
+    except Exception:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    return artifact_store.put_file('audio', video_path, temporary_path, '.pcm', pin=pin, sample_rate=CACHE_SAMPLE_RATE)
+
+
+def load_audio(video_path, artifact_store=None, timeout=None) -> np.ndarray:
+    """
+    Get the mono 16-bit PCM audio of a video at CACHE_SAMPLE_RATE. It's memory-mapped from the artifact store
+    when available, otherwise it's decoded in memory.
+    """
+    if artifact_store is None:
+        return decode_audio(video_path, CACHE_SAMPLE_RATE, timeout=timeout)
+
+    # The file is pinned until it's memory-mapped. Once mapped, evicting it doesn't affect the mapping
+    audio_path = get_audio_file(video_path, artifact_store, pin=True, timeout=timeout)
+    try:
+        return open_audio_file(audio_path)
+    finally:
+        artifact_store.unpin(audio_path)
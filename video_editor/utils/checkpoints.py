@@ -0,0 +1,149 @@
+"""
+Checkpoints of the pipeline state, saved after each orchestrator stage so a failed run can be resumed.
+
+Each checkpoint is keyed by a stage fingerprint: a hash of the fingerprint of the previous stage, the stage
+name and the parameters that change its result. The first stage also hashes the source files, so editing a
+source or a parameter invalidates the checkpoint of that stage and of every stage after it.
+
+NOTE:
+    - The state is pickled in a single pass, so objects shared by the timeline and the features (e.g. the
+      clip transforms waiting for `edit_timeline`) are restored with the same references.
+    - The artifact store is not saved: the store of the resumed run takes its place. Whisper results are
+      saved as plain dicts, like in the artifact store.
+"""
+import hashlib
+import json
+import os
+import pickle
+from typing import Any, Dict
+
+import stable_whisper
+
+
+CHECKPOINT_VERSION = 1  # Bump when the saved state changes, so old checkpoints are never loaded
+ARTIFACT_STORE_ID = 'artifact_store'
+WHISPER_RESULT_ID = 'whisper_result'
+
+
+def get_fingerprint(previous_fingerprint, stage, params: Dict[str, Any]) -> str:
+    """
+    Get the fingerprint of a stage.
+    """
+    key_data = json.dumps({
+        'version': CHECKPOINT_VERSION,
+        'previous': previous_fingerprint,
+        'stage': stage,
+        'params': params,
+    }, sort_keys=True, default=str)
+
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+
+def get_sources_signature(paths) -> list:
+    """
+    Get the path, size and modification time of source files. Any edit of a source changes it.
+    """
+    signature = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        signature.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+
+    return signature
+
+
+class StatePickler(pickle.Pickler):
+    def __init__(self, file, artifact_store):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.artifact_store = artifact_store
+
+    def persistent_id(self, obj):
+        if obj is not None and obj is self.artifact_store:
+            return (ARTIFACT_STORE_ID, None)
+
+        if isinstance(obj, stable_whisper.WhisperResult):
+            return (WHISPER_RESULT_ID, obj.to_dict())
+
+        return None
+
+
+class StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, artifact_store):
+        super().__init__(file)
+        self.artifact_store = artifact_store
+
+    def persistent_load(self, persistent_id):
+        kind, value = persistent_id
+        if kind == ARTIFACT_STORE_ID:
+            return self.artifact_store
+
+        if kind == WHISPER_RESULT_ID:
+            return stable_whisper.WhisperResult(value)
+
+        raise pickle.UnpicklingError(f"Unknown persistent object: {kind}")
+
+
+class CheckpointStore:
+    def __init__(self, folder, artifact_store=None):
+        self.folder = folder
+        self.manifest_file = os.path.join(folder, 'checkpoints.json')
+        self.artifact_store = artifact_store
+        self.manifest: Dict[str, Dict[str, str]] = self.load_manifest()
+
+    def load_manifest(self) -> Dict[str, Dict[str, str]]:
+        """
+        Load the fingerprint and file of the checkpoint of each stage.
+        """
+        if not os.path.exists(self.manifest_file):
+            return {}
+
+        try:
+            with open(self.manifest_file, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            # A corrupted manifest only costs running the stages again
+            return {}
+
+    def save_manifest(self):
+        """
+        Save the fingerprint and file of the checkpoint of each stage.
+        """
+        temporary_path = f"{self.manifest_file}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(self.manifest, file, indent=4)
+        os.replace(temporary_path, self.manifest_file)
+
+    def has_checkpoint(self, stage, fingerprint) -> bool:
+        """
+        Check if a stage has a checkpoint with the given fingerprint.
+        """
+        entry = self.manifest.get(stage)
+        return (
+            entry is not None
+            and entry['fingerprint'] == fingerprint
+            and os.path.exists(os.path.join(self.folder, entry['file']))
+        )
+
+    def save(self, stage, fingerprint, state: Dict[str, Any]):
+        """
+        Save the state of the pipeline after a stage.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        filename = f"{stage}.pkl"
+        checkpoint_path = os.path.join(self.folder, filename)
+
+        # Write to a temporary file, so a crash while saving never leaves a broken checkpoint behind
+        temporary_path = f"{checkpoint_path}.tmp"
+        with open(temporary_path, 'wb') as file:
+            StatePickler(file, self.artifact_store).dump(state)
+        os.replace(temporary_path, checkpoint_path)
+
+        self.manifest[stage] = {'fingerprint': fingerprint, 'file': filename}
+        self.save_manifest()
+
+    def load(self, stage) -> Dict[str, Any]:
+        """
+        Load the state of the pipeline after a stage.
+        """
+        checkpoint_path = os.path.join(self.folder, self.manifest[stage]['file'])
+        with open(checkpoint_path, 'rb') as file:
+            return StateUnpickler(file, self.artifact_store).load()
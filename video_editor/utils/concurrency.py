@@ -0,0 +1,159 @@
+"""
+Helpers to run independent jobs (ffmpeg encodes, probes, ...) concurrently.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class JobResult:
+    """
+    Result of a single job executed by `run_jobs`.
+    """
+    item: Any
+    value: Any = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def get_cpu_count() -> int:
+    """
+    Get the number of CPUs available to this process.
+    """
+    # Respect CPU affinity masks (containers, taskset, ...) when the platform supports it
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+
+    return max(1, os.cpu_count() or 1)
+
+
+def get_default_jobs(num_items: int, threads_per_job: int = 1) -> int:
+    """
+    Get a sensible number of concurrent jobs for the current machine.
+    """
+    return max(1, min(num_items, get_cpu_count() // max(1, threads_per_job)))
+
+
+def get_threads_per_job(jobs: int) -> int:
+    """
+    Split the CPU thread budget evenly across concurrent jobs.
+    """
+    return max(1, get_cpu_count() // max(1, jobs))
+
+
+def run_job(function: Callable[[Any], Any], item: Any) -> JobResult:
+    """
+    Run a single job and store its return value or its error.
+    """
+    start_time = time.perf_counter()
+    try:
+        value = function(item)
+        return JobResult(item=item, value=value, elapsed=time.perf_counter() - start_time)
+    except Exception as e:
+        return JobResult(item=item, error=e, elapsed=time.perf_counter() - start_time)
+
+
+def run_jobs(function: Callable[[Any], Any], items: Iterable[Any], jobs: int = None) -> List[JobResult]:
+    """
+    Run `function` for every item with at most `jobs` jobs running at the same time.
+
+    NOTE:
+        - Errors are stored in the result of the job that raised them instead of being propagated, so a
+          single failing item doesn't stop the other ones.
+        - Results are always returned in the same order as `items`, no matter which job finishes first.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    jobs = get_default_jobs(len(items)) if jobs is None else max(1, min(jobs, len(items)))
+
+    # Avoid thread overhead when there is nothing to parallelize
+    if jobs == 1:
+        return [run_job(function, item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_job, function, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def run_jobs_in_processes(
+        function: Callable[[Any], Any],
+        items: Iterable[Any],
+        jobs: int,
+        initializer: Callable = None,
+        initargs: Tuple = ()
+    ) -> List[JobResult]:
+    """
+    Same as `run_jobs`, but each job runs in a separate worker process. Use it for CPU-bound Python work.
+
+    NOTE:
+        - `function`, `initializer` and the items must be picklable (e.g. module level functions).
+        - Workers are spawned instead of forked, which is safer with libraries that start their own threads (torch).
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    jobs = max(1, min(jobs, len(items)))
+    executor = ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=initializer,
+        initargs=initargs
+    )
+    with executor:
+        futures = [executor.submit(run_job, function, item) for item in items]
+        return [future.result() for future in futures]
+
+
+class ResourceBudget:
+    """
+    CPU and memory budget shared by jobs that run at the same time. Each job holds a part of the budget while
+    it runs, and waits until enough of it is free.
+
+    NOTE:
+        - Requests bigger than the whole budget are capped to it, so a big job waits for the others to finish
+          instead of waiting forever.
+        - Amounts are declared by the jobs (estimates), not measured.
+    """
+    def __init__(self, cpus: int, memory: int):
+        self.cpus = max(1, cpus)
+        self.memory = max(0, memory)
+        self.used_cpus = 0
+        self.used_memory = 0
+        self.condition = threading.Condition()
+
+    def has_room(self, cpus, memory) -> bool:
+        return self.used_cpus + cpus <= self.cpus and self.used_memory + memory <= self.memory
+
+    @contextmanager
+    def reserve(self, cpus=1, memory=0):
+        """
+        Hold `cpus` CPUs and `memory` bytes of the budget while the block runs.
+        """
+        cpus = min(max(0, cpus), self.cpus)
+        memory = min(max(0, memory), self.memory)
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.has_room(cpus, memory))
+            self.used_cpus += cpus
+            self.used_memory += memory
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.used_cpus -= cpus
+                self.used_memory -= memory
+                self.condition.notify_all()
@@ -1,7 +1,12 @@
 import mimetypes
 import os
-import ffmpeg
-from moviepy.editor import VideoFileClip
+
+def is_video_file(file_path):
+    """
+    Check if a file is a video, by its name.
+    """
+    file_type, _ = mimetypes.guess_type(file_path)
+    return file_type is not None and file_type.startswith('video')
 
 def get_video_files(videos_folder):
     """
@@ -11,8 +16,7 @@ def get_video_files(videos_folder):
 
     for f in sorted(os.listdir(videos_folder)):
         # Verify if element in folder is a video file
-        file_type, _ = mimetypes.guess_type(f)
-        if file_type is None or not file_type.startswith('video'):
+        if not is_video_file(f):
             continue
 
         # Add video file to the list
@@ -29,29 +33,3 @@ def format_localhost_filepath(file_path):
     file_path = file_path.replace("\\", "/")
     file_path = file_path.replace(" ", "%20")
     return file_path
-
-def get_video_file_specs(video_path):
-    """
-    Get the video file specifications.
-    """
-    # Get video data from FFMPEG
-    probe = ffmpeg.probe(video_path, v='error', select_streams='v:0', show_entries='stream=nb_frames')
-    num_frames = int(probe['streams'][0]['nb_frames'])
-
-    # Get video data from MoviePy
-    with VideoFileClip(video_path) as video:
-        width, height = video.size
-        audio_channels = video.audio.nchannels if video.audio.nchannels is not None else 0
-        filename = os.path.basename(video_path)
-        fps = int(video.fps)
-        localhost_path = format_localhost_filepath(str(video_path))
-    
-    return {
-        'num_frames': num_frames,
-        'width': width,
-        'height': height,
-        'audio_channels': audio_channels,
-        'filename': filename,
-        'localhost_path': localhost_path,
-        'fps': fps
-    }
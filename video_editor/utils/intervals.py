@@ -0,0 +1,82 @@
+"""
+Vectorized helpers to work with sets of [start, end) intervals stored as NumPy arrays (e.g. clips and speech segments in frames).
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+def seconds_to_frame_intervals(starts, ends, fps) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert intervals in seconds to the frames they touch.
+    """
+    starts = np.floor(np.asarray(starts, dtype=np.float64) * fps).astype(np.int64)
+    ends = np.ceil(np.asarray(ends, dtype=np.float64) * fps).astype(np.int64)
+    return starts, np.maximum(starts, ends)
+
+
+def merge_intervals(starts, ends) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge overlapping or touching intervals. Returns sorted and disjoint intervals.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    # Empty intervals don't cover anything
+    non_empty = ends > starts
+    starts, ends = starts[non_empty], ends[non_empty]
+    if len(starts) == 0:
+        return starts, ends
+
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], ends[order]
+
+    # An interval starts a new group when it begins after every previous interval has ended
+    running_ends = np.maximum.accumulate(ends)
+    new_group = np.empty(len(starts), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = starts[1:] > running_ends[:-1]
+
+    group_starts = starts[new_group]
+    group_ends = running_ends[np.append(np.flatnonzero(new_group)[1:] - 1, len(starts) - 1)]
+    return group_starts, group_ends
+
+
+def get_covered_length(positions, starts, ends) -> np.ndarray:
+    """
+    Get how much of [-inf, position) is covered by sorted and disjoint intervals, for every position at once.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(starts) == 0:
+        return np.zeros(len(positions), dtype=np.int64)
+
+    # Covered length before each interval
+    covered_before = np.concatenate(([0], np.cumsum(ends - starts)))
+
+    # Intervals that start before each position are fully covered, except for the part of the last one after it
+    count = np.searchsorted(starts, positions, side='right')
+    last = np.maximum(count - 1, 0)
+    overflow = np.where(count > 0, np.maximum(ends[last] - positions, 0), 0)
+    return covered_before[count] - overflow
+
+
+def get_overlap(starts, ends, interval_starts, interval_ends) -> np.ndarray:
+    """
+    Get how much of each [start, end) is covered by a set of intervals (that may overlap each other).
+    """
+    interval_starts, interval_ends = merge_intervals(interval_starts, interval_ends)
+    return (
+        get_covered_length(ends, interval_starts, interval_ends)
+        - get_covered_length(starts, interval_starts, interval_ends)
+    )
+
+
+def get_coverage_ratio(starts, ends, interval_starts, interval_ends) -> np.ndarray:
+    """
+    Get the ratio (between 0 and 1) of each [start, end) that is covered by a set of intervals.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    overlap = get_overlap(starts, ends, interval_starts, interval_ends)
+    lengths = ends - starts
+    return np.divide(overlap, lengths, out=np.zeros(len(lengths), dtype=np.float64), where=lengths > 0)
@@ -0,0 +1,274 @@
+"""
+Persistent queue of batch jobs. Each job is a JSON status file in the jobs folder of the queue, so the queue
+survives restarts and the progress of each job can be followed from outside (e.g. `cat <queue>/jobs/<id>.json`).
+
+NOTE:
+    - A job is identified by its input and the signature of its source videos, so a project folder is only
+      queued again when its videos change. The new job supersedes the older queued ones of the same input, and
+      it only starts once the job of that input that is already running finishes.
+    - Jobs that were running when the runner stopped are queued again by `requeue`. As the pipeline saves
+      checkpoints, they continue from the last finished stage.
+    - Many runner processes can share a queue folder. Changes to the queue are made while holding a lock file,
+      and a runner holds the lease of each job it runs (a lock on `<id>.lock`), which the OS releases when the
+      runner dies. A running job whose lease is free was left by a runner that stopped.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where a queue folder must only be used by one runner at a time
+    fcntl = None
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SUPERSEDED = 'superseded'  # A newer job of the same input was queued before this one ran
+
+
+class JobQueue:
+    def __init__(self, folder):
+        self.folder = folder
+        self.jobs_folder = os.path.join(folder, 'jobs')
+        self.lock_file = os.path.join(folder, 'queue.lock')
+        self.lock = threading.Lock()
+
+        # Open lease file of each job run by this runner
+        self.leases: Dict[str, Any] = {}
+
+        os.makedirs(self.jobs_folder, exist_ok=True)
+        self.jobs: Dict[str, Dict[str, Any]] = self.load_jobs()
+
+    def get_job_file(self, job_id) -> str:
+        return os.path.join(self.jobs_folder, f"{job_id}.json")
+
+    def get_lease_file(self, job_id) -> str:
+        return os.path.join(self.jobs_folder, f"{job_id}.lock")
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the lock of the queue, shared by the threads of this runner and by the other runner processes.
+        """
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+
+            with open(self.lock_file, 'a') as file:
+                fcntl.flock(file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def load_jobs(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Load the status file of every job.
+        """
+        jobs = {}
+        for filename in sorted(os.listdir(self.jobs_folder)):
+            if not filename.endswith('.json'):
+                continue
+
+            try:
+                with open(os.path.join(self.jobs_folder, filename), 'r') as file:
+                    job = json.load(file)
+            except (OSError, ValueError):
+                print(f"Ignoring unreadable job file {filename}")
+                continue
+
+            jobs[job['id']] = job
+
+        return jobs
+
+    def refresh(self):
+        """
+        Reload the jobs from their status files, which other runners may have changed. Jobs run by this runner
+        are kept as they are. Must be called with the lock held.
+        """
+        jobs = self.load_jobs()
+        for job_id in self.leases:
+            if job_id in self.jobs:
+                jobs[job_id] = self.jobs[job_id]
+        self.jobs = jobs
+
+    def acquire_lease(self, job_id) -> bool:
+        """
+        Take the lease of a job, held while it runs. Returns False when another runner holds it.
+        """
+        if fcntl is None:
+            self.leases[job_id] = None
+            return True
+
+        file = open(self.get_lease_file(job_id), 'a')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+
+        self.leases[job_id] = file
+        return True
+
+    def release_lease(self, job_id):
+        file = self.leases.pop(job_id, None)
+        if file is not None:
+            file.close()
+
+    def is_running(self, job) -> bool:
+        """
+        Whether a job is being run by a live runner (this one or another process).
+        """
+        if job['status'] != RUNNING:
+            return False
+        if job['id'] in self.leases:
+            return True
+        if not self.acquire_lease(job['id']):
+            return True
+
+        self.release_lease(job['id'])
+        return False
+
+    def is_superseded(self, job) -> bool:
+        """
+        Whether a newer job of the same input was queued.
+        """
+        return any(
+            other['input'] == job['input'] and other['created'] > job['created']
+            for other in self.jobs.values()
+        )
+
+    def save_job(self, job):
+        """
+        Write the status file of a job. Must be called with the lock held.
+        """
+        job_file = self.get_job_file(job['id'])
+
+        # Write to a temporary file, so readers never see a half written status
+        temporary_path = f"{job_file}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(job, file, indent=4)
+        os.replace(temporary_path, job_file)
+
+    def get_job_id(self, input_path, signature) -> str:
+        key_data = json.dumps([os.path.abspath(input_path), signature])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()[:16]
+
+    def enqueue(self, input_path, argv=(), signature=None) -> Optional[Dict[str, Any]]:
+        """
+        Add a job for an input folder (or file). Returns None when the same job is already in the queue.
+        Queued jobs of the same input are superseded by the new one.
+        """
+        job_id = self.get_job_id(input_path, signature)
+        with self.locked():
+            self.refresh()
+            if job_id in self.jobs and self.jobs[job_id]['status'] != SUPERSEDED:
+                return None
+
+            job = {
+                'id': job_id,
+                'input': os.path.abspath(input_path),
+                'argv': list(argv),
+                'status': QUEUED,
+                'created': time.time(),
+                'started': None,
+                'finished': None,
+                'attempts': 0,
+                'stage': None,
+                'stage_status': None,
+                'stages': {},   # Duration in seconds of each step that ran
+                'error': None,
+            }
+            self.jobs[job_id] = job
+            self.save_job(job)
+
+            # The videos of the input changed, so the older queued jobs would edit outdated videos
+            for other in self.jobs.values():
+                if other['input'] == job['input'] and other['status'] == QUEUED and other is not job:
+                    other.update(status=SUPERSEDED)
+                    self.save_job(other)
+
+        return job
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Mark the oldest queued job as running, take its lease and return it. Returns None when no job can run.
+
+        NOTE:
+            - A job waits while another job of the same input is running, so two runs never write to the same
+              project folder at the same time.
+        """
+        with self.locked():
+            self.refresh()
+            running_inputs = {job['input'] for job in self.jobs.values() if self.is_running(job)}
+            queued = [job for job in self.jobs.values() if job['status'] == QUEUED and job['input'] not in running_inputs]
+
+            for job in sorted(queued, key=lambda job: job['created']):
+                if not self.acquire_lease(job['id']):
+                    continue
+
+                job.update(status=RUNNING, started=time.time(), finished=None, attempts=job['attempts'] + 1, error=None)
+                self.save_job(job)
+                return job
+
+        return None
+
+    def update(self, job, **fields):
+        """
+        Update fields of a job and write its status file. The lease of the job is released once it stops running.
+        """
+        with self.locked():
+            job.update(fields)
+            self.save_job(job)
+
+            if job['status'] != RUNNING:
+                self.release_lease(job['id'])
+
+    def requeue(self, statuses) -> int:
+        """
+        Queue again the jobs with any of the given statuses (e.g. running jobs of a runner that stopped).
+        Returns the number of queued jobs.
+
+        NOTE:
+            - Running jobs are only queued again when no live runner holds their lease.
+            - Jobs of an input with a newer job are superseded instead.
+        """
+        with self.locked():
+            self.refresh()
+            jobs = [
+                job for job in self.jobs.values()
+                if job['status'] in statuses and not self.is_running(job)
+            ]
+
+            queued = 0
+            for job in jobs:
+                if self.is_superseded(job):
+                    job.update(status=SUPERSEDED, stage=None, stage_status=None)
+                else:
+                    job.update(status=QUEUED, stage=None, stage_status=None)
+                    queued += 1
+                self.save_job(job)
+
+        return queued
+
+    def get_jobs(self) -> List[Dict[str, Any]]:
+        """
+        Get all jobs, oldest first.
+        """
+        with self.locked():
+            self.refresh()
+            return sorted(self.jobs.values(), key=lambda job: job['created'])
+
+    def has_pending_jobs(self) -> bool:
+        with self.locked():
+            self.refresh()
+            return any(job['status'] == QUEUED or self.is_running(job) for job in self.jobs.values())
@@ -0,0 +1,164 @@
+"""
+In-process loud map engine. It's an alternative to running the auto-editor CLI for each video.
+
+The decoded audio (memory-mapped from the artifact store when available) is split in one window per video frame
+and the RMS level of each window is compared against a threshold (in dB relative to the loudest frame). Short cuts and clips are then removed and the
+loud parts are dilated by the margin, following the same steps as auto-editor's `audio` edit method.
+"""
+from fractions import Fraction
+from typing import Any, Dict
+
+import numpy as np
+
+from utils.audio import CACHE_SAMPLE_RATE, load_audio
+
+
+FRAMES_PER_CHUNK = 4096  # Video frames analysed at a time
+MIN_LEVEL_DB = -120.0  # Level used for digital silence
+
+
+def get_frame_boundaries(num_samples, sample_rate, fps) -> np.ndarray:
+    """
+    Get the index of the first audio sample of each video frame, plus the end of the audio.
+    """
+    # Use integer arithmetic, so fractional frame rates (e.g. 30000/1001) don't accumulate rounding errors
+    fps = Fraction(fps)
+    num_frames = -(-num_samples * fps.numerator // (sample_rate * fps.denominator))  # ceil
+    boundaries = np.arange(num_frames + 1, dtype=np.int64) * sample_rate * fps.denominator // fps.numerator
+    return np.minimum(boundaries, num_samples)
+
+
+def get_frame_levels(audio: np.ndarray, sample_rate, fps) -> np.ndarray:
+    """
+    Get the RMS level (in dBFS) of the audio of each video frame.
+    """
+    boundaries = get_frame_boundaries(audio.size, sample_rate, fps)
+    num_frames = boundaries.size - 1
+    if num_frames <= 0:
+        return np.empty(0, dtype=np.float32)
+
+    # Analyse the audio in chunks of frames, so only a chunk of the (memory-mapped) audio is in memory at a time
+    mean_squares = np.empty(num_frames, dtype=np.float64)
+    for first_frame in range(0, num_frames, FRAMES_PER_CHUNK):
+        last_frame = min(first_frame + FRAMES_PER_CHUNK, num_frames)
+        chunk_boundaries = boundaries[first_frame:last_frame + 1]
+
+        samples = np.asarray(audio[chunk_boundaries[0]:chunk_boundaries[-1]], dtype=np.float32) / 32768
+        sums = np.add.reduceat(np.square(samples), chunk_boundaries[:-1] - chunk_boundaries[0])
+        mean_squares[first_frame:last_frame] = sums / np.diff(chunk_boundaries)
+
+    return 10 * np.log10(np.maximum(mean_squares, 10 ** (MIN_LEVEL_DB / 10)))
+
+
+def get_runs(mask: np.ndarray):
+    """
+    Get the start, length and value of each run of equal values in a boolean array.
+    """
+    if mask.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+
+    run_starts = np.flatnonzero(np.diff(mask.astype(np.int8))) + 1
+    run_starts = np.concatenate([[0], run_starts])
+    run_lengths = np.diff(np.concatenate([run_starts, [mask.size]]))
+    return run_starts, run_lengths, mask[run_starts]
+
+
+def remove_short_runs(mask: np.ndarray, value: bool, min_length: int) -> np.ndarray:
+    """
+    Flip the runs of `value` that are shorter than `min_length` frames.
+    """
+    if min_length <= 1:
+        return mask
+
+    run_starts, run_lengths, run_values = get_runs(mask)
+    short_runs = (run_values == value) & (run_lengths < min_length)
+
+    # Runs at the edges are kept, like auto-editor does
+    if short_runs.size:
+        short_runs[0] = short_runs[-1] = False
+
+    # Expand the flag of each run to all of its frames
+    flip = np.repeat(short_runs, run_lengths)
+    return np.where(flip, not value, mask)
+
+
+def dilate(mask: np.ndarray, margin_frames: int) -> np.ndarray:
+    """
+    Extend every loud part by `margin_frames` frames on both sides.
+    """
+    if margin_frames <= 0 or mask.size == 0:
+        return mask
+
+    # A frame is loud if there's any loud frame in the window [i - margin, i + margin]
+    cumulative = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+    indexes = np.arange(mask.size)
+    window_starts = np.maximum(indexes - margin_frames, 0)
+    window_ends = np.minimum(indexes + margin_frames + 1, mask.size)
+
+    return (cumulative[window_ends] - cumulative[window_starts]) > 0
+
+
+def get_loud_mask(levels_db: np.ndarray, threshold_db, margin_frames, min_cut=6, min_clip=3) -> np.ndarray:
+    """
+    Get which frames are loud, relative to the loudest frame of the video.
+    """
+    if levels_db.size == 0:
+        return np.empty(0, dtype=bool)
+
+    mask = levels_db - levels_db.max() >= threshold_db
+    mask = remove_short_runs(mask, False, min_cut)
+    mask = remove_short_runs(mask, True, min_clip)
+    return dilate(mask, margin_frames)
+
+
+def build_loud_map(video_path, mask: np.ndarray, fps) -> Dict[str, Any]:
+    """
+    Build a loud map with the same structure as auto-editor's JSON export.
+
+    NOTE:
+        - Like auto-editor, `offset` is the position of the clip in the source and `start` its position
+          in the edited timeline.
+    """
+    run_starts, run_lengths, run_values = get_runs(mask)
+    loud_starts = run_starts[run_values]
+    loud_durations = run_lengths[run_values]
+    timeline_starts = np.concatenate([[0], np.cumsum(loud_durations)[:-1]]) if loud_durations.size else loud_durations
+
+    clips = [
+        {
+            'name': 'video',
+            'src': video_path,
+            'start': int(timeline_start),
+            'dur': int(duration),
+            'offset': int(source_start),
+            'speed': 1.0,
+            'stream': 0,
+        }
+        for timeline_start, duration, source_start in zip(timeline_starts, loud_durations, loud_starts)
+    ]
+
+    fps = Fraction(fps)
+
+    return {
+        'version': '3',
+        'timebase': f"{fps.numerator}/{fps.denominator}",
+        'samplerate': CACHE_SAMPLE_RATE,
+        'v': [clips],
+        'a': [[{**clip, 'name': 'audio'} for clip in clips]],
+    }
+
+
+def generate_loud_map(video_path, fps, margin=0.2, threshold_db=-28.0, num_frames=None, artifact_store=None, timeout=None) -> Dict[str, Any]:
+    """
+    Detect all parts of the video with sound louder than the threshold. `timeout` is the max duration (in seconds)
+    of the audio decode.
+    """
+    audio = load_audio(video_path, artifact_store, timeout=timeout)
+    levels_db = get_frame_levels(audio, CACHE_SAMPLE_RATE, fps)
+
+    # Audio may be a little longer than the video
+    if num_frames is not None:
+        levels_db = levels_db[:num_frames]
+
+    mask = get_loud_mask(levels_db, threshold_db, int(round(margin * fps)))
+    return build_loud_map(video_path, mask, fps)
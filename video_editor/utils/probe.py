@@ -0,0 +1,167 @@
+"""
+Read video file specifications with a single ffprobe call per file.
+"""
+import os
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Any, Dict, List, Optional
+
+import ffmpeg
+
+from utils.concurrency import run_jobs
+from utils.files import format_localhost_filepath, get_video_files
+from utils.tracing import tracer
+
+
+@dataclass
+class VideoSpecs:
+    """
+    Specifications of a video file.
+    """
+    path: str
+    filename: str
+    localhost_path: str
+    num_frames: int
+    width: int
+    height: int
+    fps: Fraction
+    avg_frame_rate: Optional[Fraction]
+    r_frame_rate: Optional[Fraction]
+    duration: float
+    audio_channels: int
+
+    @property
+    def is_cfr(self) -> bool:
+        """
+        Whether the video has a constant frame rate, i.e. its average frame rate matches its base frame rate.
+        """
+        return self.avg_frame_rate is not None and self.avg_frame_rate == self.r_frame_rate
+
+
+def parse_rational(value) -> Optional[Fraction]:
+    """
+    Parse ffprobe rationals (e.g. '30000/1001'). Returns None for undefined values like '0/0'.
+    """
+    if not value:
+        return None
+
+    numerator, _, denominator = str(value).partition('/')
+    if int(denominator or 1) == 0 or int(numerator) == 0:
+        return None
+
+    return Fraction(int(numerator), int(denominator or 1))
+
+
+def count_video_packets(video_path) -> int:
+    """
+    Count the video packets of a file. This is used when the container doesn't store the number of frames.
+    """
+    with tracer.span('ffprobe count packets', 'ffmpeg', input=video_path):
+        probe = ffmpeg.probe(video_path, v='error', select_streams='v:0', count_packets=None, show_entries='stream=nb_read_packets')
+    return int(probe['streams'][0]['nb_read_packets'])
+
+
+def parse_probe(video_path, probe: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Get the video specifications from the ffprobe JSON output.
+    """
+    video_stream = next((stream for stream in probe['streams'] if stream.get('codec_type') == 'video'), None)
+    audio_stream = next((stream for stream in probe['streams'] if stream.get('codec_type') == 'audio'), None)
+    if video_stream is None:
+        raise RuntimeError(f"No video stream found in file: {video_path}")
+
+    # Get frame rates
+    avg_frame_rate = parse_rational(video_stream.get('avg_frame_rate'))
+    r_frame_rate = parse_rational(video_stream.get('r_frame_rate'))
+    frame_rate = avg_frame_rate or r_frame_rate
+    if frame_rate is None:
+        raise RuntimeError(f"Could not determine the frame rate of file: {video_path}")
+
+    # Get duration from the stream, or from the container when the stream doesn't have it
+    duration = float(video_stream.get('duration') or probe.get('format', {}).get('duration') or 0)
+
+    # Get number of frames, counting packets when the container doesn't store it
+    num_frames = video_stream.get('nb_frames')
+    num_frames = int(num_frames) if num_frames else count_video_packets(video_path)
+
+    return {
+        'num_frames': num_frames,
+        'width': int(video_stream['width']),
+        'height': int(video_stream['height']),
+        'fps': frame_rate,
+        'avg_frame_rate': avg_frame_rate,
+        'r_frame_rate': r_frame_rate,
+        'duration': duration,
+        'audio_channels': int(audio_stream.get('channels') or 0) if audio_stream is not None else 0,
+    }
+
+
+def serialize_specs(specs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert specs to JSON serializable values, so they can be stored in the artifact store.
+    """
+    return {key: str(value) if isinstance(value, Fraction) else value for key, value in specs.items()}
+
+
+def deserialize_specs(specs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert specs loaded from the artifact store back to their original types.
+    """
+    avg_frame_rate = parse_rational(specs['avg_frame_rate'])
+    r_frame_rate = parse_rational(specs['r_frame_rate'])
+
+    # The exact frame rate is rebuilt from the rationals (older entries stored it truncated to an integer)
+    return {
+        **specs,
+        'fps': avg_frame_rate or r_frame_rate,
+        'avg_frame_rate': avg_frame_rate,
+        'r_frame_rate': r_frame_rate,
+    }
+
+
+def probe_video(video_path, artifact_store=None) -> VideoSpecs:
+    """
+    Get the specifications of a video file.
+    """
+    filename = os.path.basename(video_path)
+    localhost_path = format_localhost_filepath(str(video_path))
+
+    # Reuse the specs of a previous run if the file content didn't change
+    specs = artifact_store.get_json('probe', video_path) if artifact_store is not None else None
+    if specs is not None:
+        return VideoSpecs(path=video_path, filename=filename, localhost_path=localhost_path, **deserialize_specs(specs))
+
+    # Get all video data from a single ffprobe call
+    try:
+        with tracer.span('ffprobe', 'ffmpeg', input=video_path):
+            probe = ffmpeg.probe(video_path)
+    except ffmpeg.Error as e:
+        raise RuntimeError(f"FFprobe error: {e.stderr.decode(errors='replace') if e.stderr else e}")
+    specs = parse_probe(video_path, probe)
+
+    if artifact_store is not None:
+        artifact_store.put_json('probe', video_path, serialize_specs(specs))
+
+    return VideoSpecs(path=video_path, filename=filename, localhost_path=localhost_path, **specs)
+
+
+def probe_videos(video_paths, jobs=None, artifact_store=None) -> List[VideoSpecs]:
+    """
+    Get the specifications of many video files in parallel. Specs are returned in the same order as `video_paths`.
+    """
+    results = run_jobs(lambda video_path: probe_video(video_path, artifact_store), video_paths, jobs=jobs)
+
+    # Report every file that couldn't be probed at once
+    failed = [result for result in results if not result.ok]
+    if failed:
+        errors = '\n'.join(f"    {result.item}: {result.error}" for result in failed)
+        raise RuntimeError(f"Failed to probe {len(failed)} of {len(results)} videos:\n{errors}")
+
+    return [result.value for result in results]
+
+
+def probe_folder(videos_folder, jobs=None, artifact_store=None) -> List[VideoSpecs]:
+    """
+    Get the specifications of all video files in a folder, in alphabetical order.
+    """
+    return probe_videos(get_video_files(videos_folder), jobs=jobs, artifact_store=artifact_store)
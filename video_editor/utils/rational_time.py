@@ -0,0 +1,97 @@
+"""
+Helpers for exact rational times (e.g. NTSC 30000/1001 frame rates) in FCPXML.
+
+NOTE:
+    - The timeline stores times as integer ticks of a common timebase (ticks per second). The timebase is a multiple
+      of the numerator of every frame rate used in the timeline, so every frame of every video is an exact number
+      of ticks, and mixed frame rates never need rounding.
+"""
+from fractions import Fraction
+from math import lcm
+
+
+# Max difference (in frames per second) between a float frame rate and the NTSC rate it's rounded to
+NTSC_TOLERANCE = 1e-3
+
+
+def to_frame_rate(fps) -> Fraction:
+    """
+    Convert a frame rate (int, float, Fraction or '30000/1001' string) to an exact Fraction.
+
+    NOTE:
+        - Floats can't represent NTSC rates exactly. Floats within NTSC_TOLERANCE of an NTSC rate (N * 1000/1001)
+          are snapped to it (29.97 -> 30000/1001, 23.976 -> 24000/1001, 59.94 -> 60000/1001). Other floats use
+          the closest fraction with a denominator of at most 1001 (25.0 -> 25).
+    """
+    if isinstance(fps, float):
+        ntsc_fps = Fraction(round(fps * 1.001) * 1000, 1001)
+        if ntsc_fps and abs(fps - ntsc_fps) <= NTSC_TOLERANCE:
+            return ntsc_fps
+
+        return Fraction(fps).limit_denominator(1001)
+
+    return Fraction(fps)
+
+
+def get_timebase(timebase, fps) -> int:
+    """
+    Get the smallest timebase that is a multiple of `timebase` and can represent every frame of `fps`.
+    """
+    return lcm(timebase, to_frame_rate(fps).numerator)
+
+
+def get_frame_ticks(timebase, fps) -> int:
+    """
+    Get the duration of one frame in ticks.
+    """
+    fps = to_frame_rate(fps)
+    ticks, remainder = divmod(timebase * fps.denominator, fps.numerator)
+    if remainder:
+        raise ValueError(f"Frame rate {fps} can't be represented with a timebase of {timebase} ticks per second.")
+
+    return ticks
+
+
+def seconds_to_ticks(seconds, timebase) -> int:
+    """
+    Convert an exact time in seconds to ticks.
+    """
+    ticks = Fraction(seconds) * timebase
+    if ticks.denominator != 1:
+        raise ValueError(f"Time {seconds}s can't be represented with a timebase of {timebase} ticks per second.")
+
+    return ticks.numerator
+
+
+def format_frame_duration(fps) -> str:
+    """
+    Format the duration of one frame as an FCPXML time (e.g. '1001/30000s').
+    """
+    fps = to_frame_rate(fps)
+    return f"{fps.denominator}/{fps.numerator}s"
+
+
+def format_frames(num_frames, fps) -> str:
+    """
+    Format a number of frames as an FCPXML time (e.g. '18018/30000s' for 18 frames at 30000/1001 FPS).
+    """
+    fps = to_frame_rate(fps)
+    return f"{num_frames * fps.denominator}/{fps.numerator}s"
+
+
+def format_ticks(ticks, timebase, fps) -> str:
+    """
+    Format a time in ticks as an FCPXML time.
+
+    NOTE:
+        - Times on the frame grid of `fps` are written as a multiple of its frame duration (e.g. '18/30s'), like
+          editors do. Other times (e.g. timeline offsets after videos with another frame rate) are written as
+          the reduced fraction of seconds.
+    """
+    fps = to_frame_rate(fps)
+    frames, remainder = divmod(ticks * fps.numerator, timebase * fps.denominator)
+    if not remainder:
+        return format_frames(frames, fps)
+
+    seconds = Fraction(ticks, timebase)
+    return f"{seconds.numerator}/{seconds.denominator}s"
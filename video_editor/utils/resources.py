@@ -0,0 +1,65 @@
+"""
+Helpers to measure the resources (memory, CPU) used by the process.
+"""
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def get_rss_bytes() -> int:
+    """
+    Get the current resident memory of the process in bytes.
+    """
+    # Linux exposes the current RSS in /proc
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    # Other platforms only expose the peak RSS
+    return get_peak_rss_bytes()
+
+
+def get_peak_rss_bytes() -> int:
+    """
+    Get the peak resident memory of the process in bytes.
+    """
+    if resource is None:
+        return 0
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on MacOS and in kilobytes on Linux
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def get_available_memory() -> int:
+    """
+    Get the memory (in bytes) that can be used by new processes without swapping. Returns 0 when unknown.
+    """
+    # Linux exposes the available memory (free + reclaimable) in /proc
+    try:
+        with open('/proc/meminfo', 'r') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+
+    # Fallback to the free physical memory
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def format_bytes(size) -> str:
+    """
+    Format a size in bytes to megabytes.
+    """
+    return f"{size / 1024 ** 2:.0f} MB"
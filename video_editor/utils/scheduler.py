@@ -0,0 +1,220 @@
+"""
+Scheduler of a dependency graph of jobs, so independent work (e.g. encoding a video while another one is being
+transcribed) runs at the same time.
+
+Usage:
+    graph = DagScheduler(slots={'encode': 2, 'whisper': 1})
+    graph.add('encode a', encode_a, kind='encode')
+    graph.add('transcribe a', transcribe_a, ['encode a'], kind='whisper')
+    graph.run()
+    graph.raise_for_errors()
+    graph.get_value('transcribe a')
+
+NOTE:
+    - Nodes run in a thread pool. The heavy work happens in ffmpeg processes, NumPy and torch, which release the GIL.
+    - A node runs once all its dependencies succeeded. When a node fails, the nodes that depend on it are skipped
+      and the other ones keep running, so a single failing file doesn't stop the others.
+    - `slots` limits how many nodes of each kind run at the same time. Ready nodes start in the order they were
+      added, so the work of the first files is done first.
+    - `node_context` is called with the kind of each node and returns a context manager the node runs in (e.g. to
+      wait for resources shared with other graphs). Node timings don't include the time spent entering it.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+from utils.concurrency import JobResult
+from utils.tracing import tracer
+
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Node:
+    __slots__ = ('name', 'function', 'dependencies', 'kind', 'index', 'status', 'value', 'error', 'start', 'end')
+
+    def __init__(self, name, function, dependencies, kind, index):
+        self.name = name
+        self.function = function
+        self.dependencies = dependencies
+        self.kind = kind
+        self.index = index      # Order in which the node was added, used as its priority
+        self.status = PENDING
+        self.value = None
+        self.error: Optional[BaseException] = None
+        self.start = None       # Seconds since the graph started running
+        self.end = None
+
+    @property
+    def elapsed(self) -> float:
+        return self.end - self.start if self.start is not None and self.end is not None else 0.0
+
+
+class DagScheduler:
+    def __init__(self, jobs=None, slots: Dict[str, int] = None, node_context: Callable[[str], ContextManager] = None):
+        self.slots = {kind: max(1, count) for kind, count in (slots or {}).items()}
+        self.jobs = jobs or sum(self.slots.values()) + 2   # Room for every kind, plus nodes without a kind
+        self.node_context = node_context
+        self.nodes: Dict[str, Node] = {}
+        self.origin = None
+
+    def add(self, name, function: Callable[[], Any], dependencies=(), kind=None) -> str:
+        """
+        Add a node. Its dependencies must already be in the graph, so the graph never has cycles.
+        """
+        if name in self.nodes:
+            raise ValueError(f"Node '{name}' is already in the graph")
+
+        missing = [dependency for dependency in dependencies if dependency not in self.nodes]
+        if missing:
+            raise ValueError(f"Node '{name}' depends on unknown nodes: {', '.join(missing)}")
+
+        self.nodes[name] = Node(name, function, list(dependencies), kind, len(self.nodes))
+        return name
+
+    def run_node(self, node: Node):
+        node_context = self.node_context(node.kind) if self.node_context is not None else nullcontext()
+        with node_context:
+            node.start = time.perf_counter() - self.origin
+            try:
+                with tracer.span(node.kind or 'node', 'node', node=node.name):
+                    return node.function()
+            finally:
+                node.end = time.perf_counter() - self.origin
+
+    def skip_dependents(self, node: Node, dependents: Dict[str, List[Node]]):
+        """
+        Skip every node that depends (directly or not) on a node that didn't succeed.
+        """
+        for dependent in dependents[node.name]:
+            if dependent.status == PENDING:
+                dependent.status = SKIPPED
+                self.skip_dependents(dependent, dependents)
+
+    def run(self):
+        """
+        Run all nodes, each as soon as its dependencies succeeded and a slot of its kind is free.
+        Errors are stored in the nodes (see `raise_for_errors`).
+        """
+        self.origin = time.perf_counter()
+        dependents: Dict[str, List[Node]] = {name: [] for name in self.nodes}
+        remaining = {}
+        for node in self.nodes.values():
+            remaining[node.name] = len(node.dependencies)
+            for dependency in node.dependencies:
+                dependents[dependency].append(node)
+
+        ready = [node for node in self.nodes.values() if remaining[node.name] == 0]
+        running: Dict[str, int] = {kind: 0 for kind in self.slots}
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while ready or futures:
+                # Start the ready nodes that have a free slot, oldest first
+                ready.sort(key=lambda node: node.index)
+                for node in list(ready):
+                    if len(futures) >= self.jobs:
+                        break
+                    if node.kind in self.slots and running[node.kind] >= self.slots[node.kind]:
+                        continue
+
+                    ready.remove(node)
+                    if node.kind in self.slots:
+                        running[node.kind] += 1
+                    futures[executor.submit(self.run_node, node)] = node
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node = futures.pop(future)
+                    if node.kind in self.slots:
+                        running[node.kind] -= 1
+
+                    try:
+                        node.value = future.result()
+                        node.status = DONE
+                    except Exception as e:
+                        node.error = e
+                        node.status = FAILED
+                        self.skip_dependents(node, dependents)
+                        continue
+
+                    for dependent in dependents[node.name]:
+                        remaining[dependent.name] -= 1
+                        if remaining[dependent.name] == 0 and dependent.status == PENDING:
+                            ready.append(dependent)
+
+    def succeeded(self, name) -> bool:
+        return self.nodes[name].status == DONE
+
+    def get_value(self, name) -> Any:
+        """
+        Get the return value of a node that succeeded.
+        """
+        node = self.nodes[name]
+        if node.status != DONE:
+            raise RuntimeError(f"Node '{name}' didn't succeed ({node.status})")
+
+        return node.value
+
+    def get_job_result(self, name, item=None) -> JobResult:
+        """
+        Get the result of a node as the result of a job (see `utils.concurrency.run_jobs`).
+        """
+        node = self.nodes[name]
+        error = node.error
+        if node.status == SKIPPED:
+            error = RuntimeError('Skipped because a dependency failed')
+
+        return JobResult(item=item, value=node.value, error=error, elapsed=node.elapsed)
+
+    def raise_for_errors(self):
+        """
+        Raise an error listing every node that failed, if any.
+        """
+        failed = [node for node in self.nodes.values() if node.status == FAILED]
+        if not failed:
+            return
+
+        skipped = sum(1 for node in self.nodes.values() if node.status == SKIPPED)
+        errors = '\n'.join(f"    {node.name}: {node.error}" for node in failed)
+        raise RuntimeError(f"{len(failed)} of {len(self.nodes)} nodes failed ({skipped} skipped):\n{errors}")
+
+    def get_timings(self) -> List[Dict[str, Any]]:
+        """
+        Get the status, start and duration (in seconds) of every node, in the order they started.
+        """
+        nodes = sorted(self.nodes.values(), key=lambda node: (node.start is None, node.start or 0, node.index))
+        return [
+            {'node': node.name, 'kind': node.kind, 'status': node.status, 'start': node.start, 'elapsed': node.elapsed}
+            for node in nodes
+        ]
+
+    def print_timings(self):
+        """
+        Print the timings of every node, followed by how busy each kind of node was.
+        """
+        timings = [timing for timing in self.get_timings() if timing['start'] is not None]
+        if not timings:
+            return
+
+        makespan = max(timing['start'] + timing['elapsed'] for timing in timings)
+        print("Graph timings:")
+        print(f"    {'node':<48} {'kind':<10} {'start (s)':>9} {'wall (s)':>9}  status")
+        for timing in timings:
+            print(
+                f"    {timing['node']:<48} {timing['kind'] or '-':<10} {timing['start']:>9.3f} "
+                f"{timing['elapsed']:>9.3f}  {timing['status']}"
+            )
+
+        # Total time of each kind of node. A total longer than the graph means that kind ran in parallel
+        totals: Dict[str, float] = {}
+        for timing in timings:
+            kind = timing['kind'] or '-'
+            totals[kind] = totals.get(kind, 0.0) + timing['elapsed']
+
+        busy = ', '.join(f"{kind}: {total:.1f}s" for kind, total in totals.items())
+        print(f"    Graph wall time: {makespan:.1f}s | Node time by kind: {busy}")
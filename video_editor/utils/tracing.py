@@ -0,0 +1,336 @@
+"""
+Process-wide tracer that records a span for each orchestrator stage and for each external call (ffmpeg,
+auto-editor, Whisper, ...), so we can tell where a long job spends its time.
+
+Usage:
+    tracer.start()
+    with tracer.span('remove_silence', 'stage') as span_args:
+        ...
+        span_args['clips'] = 42                  # Attributes known at the end of the span
+    tracer.export_chrome_trace('trace.json')     # Open in Perfetto (ui.perfetto.dev) or chrome://tracing
+    tracer.print_summary()
+
+NOTE:
+    - When the tracer is not started, spans cost almost nothing, so call sites are always instrumented.
+    - Memory is sampled by a background thread, so the peak memory of a span is the peak RSS of the whole process
+      while it was open. CPU times are process-wide too, so spans that run at the same time share them.
+    - Spans of worker processes (e.g. parallel transcriptions) are not recorded, only the call that waits for them.
+"""
+import bisect
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.resources import format_bytes, get_rss_bytes
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def get_children_cpu_time() -> float:
+    """
+    Get the CPU time of the child processes (e.g. ffmpeg) that already finished.
+    """
+    if resource is None:
+        return 0.0
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Span:
+    __slots__ = ('name', 'category', 'start', 'end', 'cpu', 'children_cpu', 'thread_id', 'args')
+
+    def __init__(self, name, category, start, end, cpu, children_cpu, thread_id, args):
+        self.name = name
+        self.category = category
+        self.start = start                  # Seconds since the tracer started
+        self.end = end
+        self.cpu = cpu                      # CPU time of this process (all threads)
+        self.children_cpu = children_cpu    # CPU time of the child processes that finished
+        self.thread_id = thread_id
+        self.args = args
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.thread_names: Dict[int, str] = {}
+
+        # RSS samples of the process, as (seconds since the tracer started, bytes)
+        self.memory_times: List[float] = []
+        self.memory_values: List[int] = []
+        self.memory_interval = 0.01
+        self.stop_event = threading.Event()
+        self.sampler: Optional[threading.Thread] = None
+
+    def now(self) -> float:
+        return time.perf_counter() - self.origin
+
+    def start(self, memory_interval=0.01):
+        """
+        Start recording spans and memory samples.
+        """
+        if self.enabled:
+            return
+
+        self.enabled = True
+        self.origin = time.perf_counter()
+        self.memory_interval = memory_interval
+        self.stop_event.clear()
+        self.sampler = threading.Thread(target=self.sample_memory, name='memory-sampler', daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        """
+        Stop recording. Recorded spans are kept, so they can still be exported.
+        """
+        if not self.enabled:
+            return
+
+        self.enabled = False
+        self.stop_event.set()
+        self.sampler.join()
+
+    def sample_memory(self):
+        while not self.stop_event.is_set():
+            self.memory_times.append(self.now())
+            self.memory_values.append(get_rss_bytes())
+            self.stop_event.wait(self.memory_interval)
+
+    @contextmanager
+    def span(self, name, category='stage', **args):
+        """
+        Record a span around a block. Yields its attributes, so the block can add the ones it only knows at the end.
+        """
+        if not self.enabled:
+            yield args
+            return
+
+        thread = threading.current_thread()
+        start = self.now()
+        cpu_before = time.process_time()
+        children_cpu_before = get_children_cpu_time()
+        try:
+            yield args
+        finally:
+            span = Span(
+                name,
+                category,
+                start,
+                self.now(),
+                time.process_time() - cpu_before,
+                get_children_cpu_time() - children_cpu_before,
+                thread.ident,
+                args
+            )
+            with self.lock:
+                self.spans.append(span)
+                self.thread_names.setdefault(thread.ident, thread.name)
+
+    def get_peak_memory(self, span: Span) -> int:
+        """
+        Get the peak RSS of the process while a span was open.
+        """
+        first = bisect.bisect_left(self.memory_times, span.start)
+        last = bisect.bisect_right(self.memory_times, span.end)
+
+        # Include the last sample before the span, in case the span is shorter than the sampling interval
+        return max(self.memory_values[max(first - 1, 0):last], default=0)
+
+    def get_span_args(self, span: Span) -> Dict[str, Any]:
+        """
+        Get the attributes of a span, including its measurements.
+        """
+        return {
+            **{key: value for key, value in span.args.items() if value is not None},
+            'cpu_seconds': round(span.cpu, 6),
+            'children_cpu_seconds': round(span.children_cpu, 6),
+            'peak_rss_bytes': self.get_peak_memory(span),
+        }
+
+    def export_chrome_trace(self, trace_file):
+        """
+        Export the spans in the Chrome trace event format, which can be opened in Perfetto or chrome://tracing.
+        """
+        pid = os.getpid()
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id, 'args': {'name': thread_name}}
+            for thread_id, thread_name in self.thread_names.items()
+        ]
+
+        # Complete events have a start and a duration (in microseconds)
+        events += [
+            {
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': span.start * 1e6,
+                'dur': span.duration * 1e6,
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': self.get_span_args(span),
+            }
+            for span in sorted(self.spans, key=lambda span: span.start)
+        ]
+
+        # Counter events show the memory of the process as a graph
+        events += [
+            {'name': 'RSS (MB)', 'ph': 'C', 'ts': sample_time * 1e6, 'pid': pid, 'args': {'rss': value / 1024 ** 2}}
+            for sample_time, value in zip(self.memory_times, self.memory_values)
+        ]
+
+        with open(trace_file, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file, default=str)
+
+    def get_call_summary(self) -> List[Tuple[str, int, float, float]]:
+        """
+        Get the (name, count, total duration, max duration) of the spans that are not stages, slowest first.
+        """
+        calls: Dict[str, List[float]] = {}
+        for span in self.spans:
+            if span.category != 'stage':
+                calls.setdefault(span.name, []).append(span.duration)
+
+        summary = [(name, len(durations), sum(durations), max(durations)) for name, durations in calls.items()]
+        return sorted(summary, key=lambda call: call[2], reverse=True)
+
+    def print_summary(self):
+        """
+        Print the measurements of every stage, followed by the time spent in each kind of call.
+        """
+        stages = sorted((span for span in self.spans if span.category == 'stage'), key=lambda span: span.start)
+        total = sum(span.duration for span in stages)
+
+        print("Trace summary:")
+        print(f"    {'stage':<28} {'wall (s)':>9} {'%':>6} {'cpu (s)':>8} {'child cpu (s)':>14} {'peak rss':>9} {'media (s)':>10} {'clips':>7}")
+        for span in stages:
+            media_duration = span.args.get('media_duration')
+            print(
+                f"    {span.name:<28} {span.duration:>9.3f} {100 * span.duration / total if total else 0:>6.1f} "
+                f"{span.cpu:>8.3f} {span.children_cpu:>14.3f} {format_bytes(self.get_peak_memory(span)):>9} "
+                f"{media_duration if media_duration is not None else 0:>10.1f} {span.args.get('clips', 0):>7}"
+            )
+
+        calls = self.get_call_summary()
+        if not calls:
+            return
+
+        # Calls made from parallel jobs overlap, so their total may be longer than the stage that made them
+        print(f"    {'call':<28} {'count':>9} {'total (s)':>10} {'max (s)':>8}")
+        for name, count, total_duration, max_duration in calls:
+            print(f"    {name:<28} {count:>9} {total_duration:>10.3f} {max_duration:>8.3f}")
+
+
+class SamplingProfiler:
+    """
+    Sample the stack of a thread at a fixed interval. Unlike cProfile, it doesn't slow down the profiled code,
+    so it's better suited for long stages.
+
+    NOTE:
+        - Stacks are saved in the folded format ('a;b;c count'), which can be opened with speedscope or
+          flamegraph.pl. Only the profiled thread is sampled, not the thread pools it uses.
+    """
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name='sampling-profiler', daemon=True)
+
+    def get_stack(self, frame) -> str:
+        """
+        Get the stack of a frame, from the outermost call to the innermost one.
+        """
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+
+        return ';'.join(reversed(stack))
+
+    def sample(self):
+        while not self.stop_event.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self.get_stack(frame)] += 1
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def save(self, output_file):
+        with open(output_file, 'w') as file:
+            for stack, count in self.stacks.items():
+                file.write(f"{stack} {count}\n")
+
+    def print_top_functions(self, limit=20):
+        """
+        Print the functions where the thread was found most often (own time).
+        """
+        total = sum(self.stacks.values())
+        functions: Counter = Counter()
+        for stack, count in self.stacks.items():
+            functions[stack.rsplit(';', 1)[-1]] += count
+
+        print(f"    {'samples':>8} {'%':>6}  function")
+        for function, count in functions.most_common(limit):
+            print(f"    {count:>8} {100 * count / total:>6.1f}  {function}")
+
+
+@contextmanager
+def profile(name, profiler='cprofile', output_folder='.'):
+    """
+    Profile a block with cProfile or the sampling profiler, save the profile and print the hottest functions.
+    """
+    if profiler == 'sampling':
+        sampling_profiler = SamplingProfiler(threading.get_ident())
+        sampling_profiler.start()
+        try:
+            yield
+        finally:
+            sampling_profiler.stop()
+            output_file = os.path.join(output_folder, f"profile_{name}.folded")
+            sampling_profiler.save(output_file)
+            print(f"Sampling profile of '{name}' saved to {output_file}")
+            sampling_profiler.print_top_functions()
+        return
+
+    cprofile_profiler = cProfile.Profile()
+    cprofile_profiler.enable()
+    try:
+        yield
+    finally:
+        cprofile_profiler.disable()
+        output_file = os.path.join(output_folder, f"profile_{name}.prof")
+        cprofile_profiler.dump_stats(output_file)
+        print(f"cProfile of '{name}' saved to {output_file} (open it with snakeviz or pstats)")
+
+        stream = io.StringIO()
+        pstats.Stats(cprofile_profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+        print(stream.getvalue())
+
+
+tracer = Tracer()
@@ -0,0 +1,220 @@
+"""
+Helpers to transcribe only the loud regions of a video.
+
+The loud regions found by RemoveSilence are cut out of the decoded audio and joined (with a short silence between
+them) in a single array, which is transcribed at once. Timestamps of the transcription are then mapped back to
+the source video.
+
+Many sources can be transcribed at the same time by a pool of worker processes (see `transcribe_sources`).
+"""
+import os
+from fractions import Fraction
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from utils.audio import CACHE_SAMPLE_RATE, decode_audio, open_audio_file
+from utils.concurrency import JobResult, get_cpu_count, run_jobs, run_jobs_in_processes
+from utils.resources import get_available_memory
+from utils.tracing import tracer
+from utils.whisper_models import whisper_models
+
+
+SAMPLE_RATE = CACHE_SAMPLE_RATE  # Sample rate expected by Whisper
+REGIONS_GAP = 0.5  # Silence (in seconds) inserted between regions, so words of different regions aren't merged
+MIN_THREADS_PER_WORKER = 2  # Torch threads of each transcription worker
+
+# Approximate memory (in GB) used by a CPU worker process with each Whisper model loaded
+MODEL_MEMORY = {
+    'tiny': 1.0,
+    'base': 1.2,
+    'small': 2.0,
+    'medium': 4.5,
+    'large': 9.0,
+    'turbo': 5.0,
+    'stub': 0.3,
+}
+
+
+def get_loud_regions(loud_map, padding=0.2) -> List[Tuple[float, float]]:
+    """
+    Get the (start, end) in seconds of the loud parts of a loud map, padded and merged when they overlap.
+    """
+    fps = Fraction(loud_map['timebase'])
+    regions = []
+
+    # NOTE: auto-editor loud maps store the source position of each part in `offset`
+    for loud_part in sorted(loud_map['v'][0], key=lambda loud_part: loud_part['offset']):
+        start = max(float(loud_part['offset'] / fps) - padding, 0)
+        end = float((loud_part['offset'] + loud_part['dur']) / fps) + padding
+
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], end))
+        else:
+            regions.append((start, end))
+
+    return regions
+
+
+def join_regions(audio: np.ndarray, regions) -> Tuple[np.ndarray, List[Tuple[float, float, float]]]:
+    """
+    Join the regions of the audio in a single float32 array.
+    Returns the array and one (joined start, source start, duration) tuple per region, all in seconds.
+    """
+    gap = np.zeros(int(REGIONS_GAP * SAMPLE_RATE), dtype=np.float32)
+    pieces = []
+    region_table = []
+    joined_samples = 0
+
+    for start, end in regions:
+        piece = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        if piece.size == 0:
+            continue
+
+        region_table.append((joined_samples / SAMPLE_RATE, start, piece.size / SAMPLE_RATE))
+        pieces.extend([to_whisper_audio(piece), gap])
+        joined_samples += piece.size + gap.size
+
+    joined_audio = np.concatenate(pieces) if pieces else np.empty(0, dtype=np.float32)
+    return joined_audio, region_table
+
+
+def map_time_to_source(time, region_table) -> float:
+    """
+    Map a time of the joined audio back to the source video.
+    """
+    joined_starts = [joined_start for joined_start, _, _ in region_table]
+    index = max(int(np.searchsorted(joined_starts, time, side='right')) - 1, 0)
+    joined_start, source_start, duration = region_table[index]
+
+    # Times inside the gap after a region are clamped to the end of that region
+    return source_start + min(max(time - joined_start, 0), duration)
+
+
+def map_transcription_to_source(transcription: Dict[str, Any], region_table) -> Dict[str, Any]:
+    """
+    Map all timestamps of a transcription (as a dict) back to the source video.
+    """
+    for segment in transcription['segments']:
+        segment['start'] = map_time_to_source(segment['start'], region_table)
+        segment['end'] = map_time_to_source(segment['end'], region_table)
+
+        for word in segment.get('words') or []:
+            word['start'] = map_time_to_source(word['start'], region_table)
+            word['end'] = map_time_to_source(word['end'], region_table)
+
+    return transcription
+
+
+def to_whisper_audio(audio: np.ndarray) -> np.ndarray:
+    """
+    Convert 16-bit PCM samples to the float32 array expected by Whisper.
+    """
+    return np.asarray(audio, dtype=np.float32) / 32768
+
+
+def transcribe_regions(model, audio: np.ndarray, regions) -> Dict[str, Any]:
+    """
+    Transcribe only the given regions of the audio of a video. Returns the transcription as a dict, in source time.
+    """
+    joined_audio, region_table = join_regions(audio, regions)
+
+    # Nothing to transcribe when the whole video is silent
+    if not region_table:
+        return {'text': '', 'segments': []}
+
+    with tracer.span('whisper transcribe', 'whisper', media_duration=len(joined_audio) / SAMPLE_RATE):
+        transcription = model.transcribe(joined_audio).to_dict()
+    return map_transcription_to_source(transcription, region_table)
+
+
+def get_model_memory(model_name) -> int:
+    """
+    Get the approximate memory (in bytes) needed by a worker with the model loaded.
+    """
+    # Handle model variants, like 'large-v3' or 'small.en'
+    for name, memory in MODEL_MEMORY.items():
+        if model_name.startswith(name):
+            return int(memory * 1024 ** 3)
+
+    return int(MODEL_MEMORY['large'] * 1024 ** 3)
+
+
+def get_transcription_workers(num_sources, model_name) -> int:
+    """
+    Get how many sources can be transcribed at the same time, based on the CPUs and the available memory.
+    """
+    cpu_workers = get_cpu_count() // MIN_THREADS_PER_WORKER
+    available_memory = get_available_memory()
+    memory_workers = available_memory // get_model_memory(model_name) if available_memory else 1
+
+    return max(1, min(num_sources, cpu_workers, memory_workers))
+
+
+def init_transcription_worker(threads):
+    """
+    Limit the threads used by torch in a worker process, so workers don't oversubscribe the CPUs.
+    """
+    for variable in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+        os.environ[variable] = str(threads)
+
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # It can only be set once, before any parallel work starts
+        pass
+
+
+def transcribe_source(job) -> Dict[str, Any]:
+    """
+    Transcribe a source video. `job` is a (model name, device, video path, audio path, regions) tuple, where:
+        - audio path is the decoded audio of the video in the artifact store, or None to decode it again.
+        - regions is None to transcribe the whole video.
+
+    NOTE:
+        - In worker processes, the model is loaded once by the process registry and reused for every job.
+    """
+    model_name, device, video_path, audio_path, regions = job
+    model = whisper_models.get(model_name, device)
+
+    audio = None
+    if audio_path is not None:
+        try:
+            audio = open_audio_file(audio_path)
+        except FileNotFoundError:
+            # Evicted from the artifact store by another process (e.g. `cache.py prune`)
+            pass
+    if audio is None:
+        audio = decode_audio(video_path, SAMPLE_RATE)
+
+    if regions is None:
+        with tracer.span('whisper transcribe', 'whisper', input=video_path, media_duration=len(audio) / SAMPLE_RATE):
+            return model.transcribe(to_whisper_audio(audio)).to_dict()
+
+    return transcribe_regions(model, audio, regions)
+
+
+def transcribe_sources(jobs, workers) -> List[JobResult]:
+    """
+    Transcribe many sources. Results are returned in the same order as `jobs`.
+
+    With a single worker, sources are transcribed in this process with the shared model. Otherwise, each worker
+    process loads its own model and gets an even share of the CPUs.
+    """
+    if workers <= 1:
+        return run_jobs(transcribe_source, jobs, jobs=1)
+
+    threads = max(1, get_cpu_count() // workers)
+    print(f"Transcribing {len(jobs)} videos with {workers} workers and {threads} threads each...")
+
+    # Spans of the worker processes are not recorded, so the whole pool is traced as a single call
+    with tracer.span('whisper worker pool', 'whisper', sources=len(jobs), workers=workers):
+        return run_jobs_in_processes(
+            transcribe_source,
+            jobs,
+            workers,
+            initializer=init_transcription_worker,
+            initargs=(threads,)
+        )
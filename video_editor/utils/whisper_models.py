@@ -0,0 +1,164 @@
+"""
+Process-wide registry of Whisper models.
+
+Models are multi-hundred-MB objects, so every stage that needs the same model (name, device and load settings)
+gets the same instance. Models are only loaded when a stage really uses them, and are unloaded once no stage
+that reserved them still needs them.
+
+Usage:
+    whisper_models.reserve('small')      # A stage that will run later needs the model
+    model = whisper_models.get('small')  # Loads the model on first use
+    whisper_models.release('small')      # The stage is done with the model
+
+The 'stub' model doesn't load any weights. It "transcribes" every loud part of the audio with placeholder words,
+so the pipeline can be benchmarked quickly on CPU-only and offline machines.
+"""
+import gc
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import stable_whisper
+
+from utils.resources import format_bytes, get_rss_bytes
+from utils.tracing import tracer
+
+
+STUB_MODEL = 'stub'
+
+
+class StubWhisperModel:
+    """
+    Model with the same `transcribe` interface as a Whisper model, that marks loud audio as speech.
+    """
+    def __init__(self, sample_rate=16000, window=0.1, word_duration=0.4, threshold=0.01):
+        self.sample_rate = sample_rate
+        self.window = window                # Analysis window (in seconds)
+        self.word_duration = word_duration  # Duration of each placeholder word (in seconds)
+        self.threshold = threshold          # Min RMS level (0 to 1) of speech
+
+    def get_speech_runs(self, audio: np.ndarray):
+        """
+        Get the (start, end) in seconds of the runs of loud windows.
+        """
+        window_samples = int(self.sample_rate * self.window)
+        num_windows = len(audio) // window_samples
+        if num_windows == 0:
+            return []
+
+        windows = np.asarray(audio[:num_windows * window_samples], dtype=np.float32).reshape(num_windows, window_samples)
+        loud = np.sqrt(np.mean(windows ** 2, axis=1)) >= self.threshold
+
+        # Find where runs of loud windows start and end
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], loud.astype(np.int8), [0]))))
+        return [(start * self.window, end * self.window) for start, end in zip(edges[::2].tolist(), edges[1::2].tolist())]
+
+    def transcribe(self, audio, **kwargs):
+        """
+        Transcribe float32 audio (at 16 kHz) with one segment per loud run.
+        """
+        segments = []
+        for start, end in self.get_speech_runs(audio):
+            word_starts = np.arange(start, end, self.word_duration).tolist()
+            words = [
+                {'word': f" word{index}", 'start': word_start, 'end': min(word_start + self.word_duration, end), 'probability': 1.0}
+                for index, word_start in enumerate(word_starts)
+            ]
+            segments.append({'start': start, 'end': end, 'text': ''.join(word['word'] for word in words), 'words': words})
+
+        return stable_whisper.WhisperResult({'text': ''.join(segment['text'] for segment in segments), 'segments': segments})
+
+
+class WhisperModelRegistry:
+    def __init__(self):
+        self.models: Dict[Tuple, Any] = {}
+        self.users: Dict[Tuple, int] = {}
+        self.stats: Dict[Tuple, Dict[str, float]] = {}
+        self.lock = threading.Lock()
+        self.load_locks: Dict[Tuple, threading.Lock] = {}
+
+    def get_key(self, name, device=None, **settings) -> Tuple:
+        """
+        Get the key that identifies a model instance.
+        """
+        return (name, device, tuple(sorted(settings.items())))
+
+    def reserve(self, name, device=None, **settings):
+        """
+        Tell the registry that a stage will use the model. The model is not loaded yet.
+        """
+        key = self.get_key(name, device, **settings)
+        with self.lock:
+            self.users[key] = self.users.get(key, 0) + 1
+
+    def get(self, name, device=None, **settings):
+        """
+        Get a model, loading it on first use.
+        """
+        key = self.get_key(name, device, **settings)
+
+        with self.lock:
+            if key in self.models:
+                return self.models[key]
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+
+        # Load the model outside of the registry lock, so other models can be used in the meantime
+        with load_lock:
+            if key in self.models:
+                return self.models[key]
+
+            rss_before = get_rss_bytes()
+            start_time = time.perf_counter()
+            with tracer.span('whisper load model', 'whisper', model=name, device=device):
+                model = StubWhisperModel() if name == STUB_MODEL else stable_whisper.load_model(name, device=device, **settings)
+            load_time = time.perf_counter() - start_time
+            rss_after = get_rss_bytes()
+
+            with self.lock:
+                self.models[key] = model
+                self.stats[key] = {'load_time': load_time, 'memory': rss_after - rss_before}
+
+        print(
+            f"Whisper model '{name}' loaded in {load_time:.1f}s "
+            f"(+{format_bytes(rss_after - rss_before)}, process RSS: {format_bytes(rss_after)})"
+        )
+        return model
+
+    def release(self, name, device=None, **settings):
+        """
+        Tell the registry that a stage is done with the model. It's unloaded when no other stage needs it.
+        """
+        key = self.get_key(name, device, **settings)
+        with self.lock:
+            self.users[key] = self.users.get(key, 0) - 1
+            if self.users[key] > 0:
+                return
+            del self.users[key]
+
+        self.unload(key)
+
+    def unload(self, key):
+        """
+        Free the memory used by a model.
+        """
+        with self.lock:
+            model = self.models.pop(key, None)
+        if model is None:
+            return
+
+        del model
+        gc.collect()
+
+        # Free GPU memory as well when the model was loaded in a GPU
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+        print(f"Whisper model '{key[0]}' unloaded (process RSS: {format_bytes(get_rss_bytes())})")
+
+
+whisper_models = WhisperModelRegistry()